@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main as scenarios
+from synthetic_osm import generate_osm
+
+###########################
+# Rule File Shapes
+###########################
+
+def wide_rules():
+    # many narrow rules, each acting on a few ways only (e.g. a long list of street-specific changes)
+    rules = []
+    for i, highway in enumerate(['residential', 'service', 'tertiary', 'secondary', 'primary', 'footway', 'track', 'path', 'cycleway', 'unclassified']):
+        for j, surface in enumerate(['asphalt', 'gravel', 'paving_stones', 'concrete', 'unpaved']):
+            rules.append(f"IF highway == {highway} AND surface == {surface} THEN ADD smoothness=intermediate ELSE ADD note=rule_{i}_{j}")
+            rules.append(f"IF highway == {highway} AND lanes >= {1 + j % 3} THEN lanes-=1")
+        for name in ['Hauptstraße', 'Kirchgasse', 'Ringstraße', 'Gartenweg']:
+            rules.append(f"IF name == {name} AND highway == {highway} THEN UPDATE lit TO yes")
+    return rules
+
+# rule files of typical shapes, from a few rules acting on every way to many selective rules
+RULE_SHAPES = {
+    'unconditional': [
+        "UPDATE surface TO asphalt",
+        "ADD lit=yes",
+        "REMOVE parking:both",
+        "maxspeed-=10",
+    ],
+    'conditional': [
+        "IF highway == residential THEN UPDATE maxspeed TO 30",
+        "IF highway == primary OR highway == secondary THEN ADD cycleway=lane",
+        "IF NOTEXISTS sidewalk THEN DONOTHING ELSE REMOVE parking:both",
+        "IF highway == footway THEN ADD lit=yes",
+        "IF lanes > 2 THEN lanes-=1",
+        "IF EXISTS bicycle THEN UPDATE bicycle TO designated",
+    ],
+    'compound': [
+        "IF highway == residential AND lanes > 1 THEN UPDATE maxspeed TO 30 AND ADD traffic_calming=bump FREQ 0.5/1",
+        "IF highway == tertiary AND NOTEXISTS cycleway OR highway == secondary AND NOTEXISTS cycleway THEN ADD cycleway=shared_lane ELSE UPDATE cycleway TO track",
+        "IF lanes >= 2 AND oneway != yes THEN lanes-=1 OR ADD lanes=1",
+        "IF NOTEXISTS parking:both AND highway == residential THEN ADD parking:both=lane ELSE REMOVE parking:both FREQ 0.25/1",
+        "IF surface != asphalt OR NOTEXISTS surface THEN ADD surface=asphalt OR UPDATE surface TO asphalt",
+        "IF osm_id > 1000 AND highway != footway THEN ADD sidewalk=both FREQ 0.1/1",
+    ],
+    'wide': wide_rules(),
+}
+
+###########################
+# Benchmark Stages
+###########################
+
+def time_stages(xml_path, rule_set):
+    """
+    Rewrite the OSM XML like stream_modifications (without writing the output) and measure the time spent reading
+    (parsing) the elements, applying the rules to the ways and serializing the elements.
+    Returns a dict of seconds per stage and the number of ways.
+    """
+    seconds = {'read': 0.0, 'apply': 0.0, 'write': 0.0}
+    ways = 0
+    with scenarios.open_osm_file(xml_path) as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        depth = 0
+        mark = time.perf_counter()
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 0:
+                continue
+            parsed = time.perf_counter()
+            seconds['read'] += parsed - mark
+            if elem.tag == 'way':
+                ways += 1
+                elem, _ = scenarios.scenario_way(elem, rule_set)
+            applied = time.perf_counter()
+            seconds['apply'] += applied - parsed
+            scenarios.serialize_element(elem)
+            root.clear()
+            mark = time.perf_counter()
+            seconds['write'] += mark - applied
+    return seconds, ways
+
+def time_rule_parsing(rule_path, min_seconds=0.2):
+    """
+    Parse and compile the rule file (see RuleSet) repeatedly for at least min_seconds. Returns the rules per second.
+    """
+    rules = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_seconds:
+        rules += len(scenarios.RuleSet(scenarios.parse_modification_rules(rule_path)).rules)
+    return rules / (time.perf_counter() - start)
+
+def time_rewriter(xml_path, rule_path, output_path, workers):
+    """
+    Run the streaming rewriter (workers=None) or the parallel rewriter end to end. Returns the seconds taken.
+    """
+    start = time.perf_counter()
+    writers = [scenarios.ScenarioWriter(output_path)]
+    if workers:
+        scenarios.parallel_modifications(xml_path, writers, [rule_path], [1], workers)
+    else:
+        scenarios.stream_modifications(xml_path, writers, [scenarios.RuleSet(scenarios.parse_modification_rules(rule_path), 1)])
+    writers[0].close()
+    return time.perf_counter() - start
+
+def run_benchmark(sizes, shapes, directory, workers=None, repeat=1):
+    """
+    Benchmark rule parsing, rule application, reading and writing and the rewriters for synthetic OSM files with the
+    given numbers of ways and the given rule file shapes. The files are generated once in directory.
+    Returns {ways: {shape: {stage: throughput}}} with rules per second for parsing and ways per second otherwise,
+    the best of repeat runs each.
+    """
+    results = {}
+    for size in sizes:
+        xml_path = os.path.join(directory, f"synthetic_{size}.xml")
+        if not os.path.exists(xml_path):
+            print(f"Generating {xml_path}...")
+            generate_osm(xml_path, size)
+        results[str(size)] = {}
+        for shape in shapes:
+            rule_path = os.path.join(directory, f"rules_{shape}.txt")
+            with open(rule_path, 'w') as f:
+                f.write('\n'.join(RULE_SHAPES[shape]) + '\n')
+            result = {}
+            for _ in range(repeat):
+                seconds, ways = time_stages(xml_path, scenarios.RuleSet(scenarios.parse_modification_rules(rule_path), 1))
+                run = {'parse [rules/s]': time_rule_parsing(rule_path)}
+                run.update({f"{stage} [ways/s]": ways / value if value else 0.0 for stage, value in seconds.items()})
+                output_path = os.path.join(directory, "output.xml")
+                run['stream [ways/s]'] = ways / time_rewriter(xml_path, rule_path, output_path, None)
+                if workers:
+                    run[f"parallel x{workers} [ways/s]"] = ways / time_rewriter(xml_path, rule_path, output_path, workers)
+                result = {stage: max(value, result.get(stage, 0.0)) for stage, value in run.items()}
+            results[str(size)][shape] = result
+            print(f"{size:>9} ways  {shape:<14}" + "".join(f"  {stage} {value:,.0f}" for stage, value in result.items()))
+    return results
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compare the results with those of a previous run. Returns a list of (ways, shape, stage, throughput, baseline) of all
+    throughputs that dropped by more than tolerance (a fraction).
+    """
+    regressions = []
+    for size, shapes in results.items():
+        for shape, stages in shapes.items():
+            for stage, value in stages.items():
+                previous = baseline.get(size, {}).get(shape, {}).get(stage)
+                if previous and value < previous * (1 - tolerance):
+                    regressions.append((size, shape, stage, value, previous))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scenario engine of main.py on synthetic OSM data.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help="Numbers of ways of the synthetic files")
+    parser.add_argument('--shapes', nargs='+', choices=list(RULE_SHAPES), default=list(RULE_SHAPES), help="Rule file shapes")
+    parser.add_argument('--workers', type=int, help="Also benchmark the parallel rewriter with N worker processes")
+    parser.add_argument('--directory', default=os.path.join(tempfile.gettempdir(), 'netascore_benchmark'),
+                        help="Directory for the synthetic files (generated once and re-used)")
+    parser.add_argument('--repeat', type=int, default=1, help="Run each benchmark N times and report the best throughput (less noise)")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON file of a previous run: exit with an error if a throughput dropped by more than --tolerance")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed drop of throughput compared to --baseline (default: 0.1 = 10%%)")
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    results = run_benchmark(args.sizes, args.shapes, args.directory, args.workers, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for size, shape, stage, value, previous in regressions:
+            print(f"Regression: {size} ways, {shape}, {stage}: {value:,.0f} (baseline {previous:,.0f})")
+        if regressions:
+            sys.exit(1)
+        print("No regressions compared to the baseline.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import toolbox.dbhelper as dbhelper
+import toolbox.helper as h
+from core.attributes_step import OsmAttributesStep
+from core.import_step import OsmImporter
+from core.index_step import generate_index, load_profiles
+from core.network_step import OsmNetworkStep
+from settings import DbSettings, GlobalSettings
+from synthetic_osm import generate_city_osm
+
+PROFILES = [
+    {'profile_name': 'bike', 'filename': 'profile_bike.yml', 'filter_access_bike': True},
+    {'profile_name': 'walk', 'filename': 'profile_walk.yml', 'filter_access_walk': True},
+]
+# steps of the pipeline that are benchmarked: the SQL templates osm_network, osm_attributes, index and export
+STEPS = ['network', 'attributes', 'index']
+
+###########################
+# Synthetic Context Layers
+###########################
+
+def create_noise_layer(db_settings):
+    """
+    Create the noise layer of the synthetic city (there is no noise data in OSM): polygons of 25 to 75 m around the
+    primary and secondary roads and 10 m around the other streets with a noise level decreasing with the road class,
+    overlapping like the noise bands of real noise maps.
+    """
+    schema = db_settings.entities.data_schema
+    srid = GlobalSettings.get_target_srid()
+    db = dbhelper.PostgresConnection.from_settings_object(db_settings)
+    db.connect()
+    db.drop_table('noise', schema=schema)
+    db.ex(f"""CREATE TABLE {schema}.noise AS (
+        SELECT row_number() OVER () AS fid, a.noise, ST_Multi(ST_Buffer(ST_Transform(b.way, {srid}), a.distance))::geometry(MultiPolygon, {srid}) AS geom
+        FROM {schema}.osm_line b
+        JOIN (VALUES ('primary', 75, 25), ('primary', 65, 50), ('primary', 55, 75), ('secondary', 65, 25), ('secondary', 55, 50),
+                     ('tertiary', 55, 10), ('residential', 45, 10)) AS a (highway, noise, distance) USING (highway)
+    )""")
+    db.ex(f"CREATE INDEX noise_geom_idx ON {schema}.noise USING gist (geom)")
+    db.commit()
+    db.close()
+
+###########################
+# Benchmark Runs
+###########################
+
+def table_count(db_settings, schema, table):
+    db = dbhelper.PostgresConnection.from_settings_object(db_settings)
+    count = db.query_one(f"SELECT count(*) FROM {schema}.{table}")[0]
+    db.close()
+    return count
+
+def drop_schemas(db_settings):
+    db = dbhelper.PostgresConnection.from_settings_object(db_settings)
+    db.connect()
+    db.drop_schema(db_settings.entities.network_schema, cascade=True)
+    db.drop_schema(db_settings.entities.data_schema, cascade=True)
+    db.commit()
+    db.close()
+
+def run_size(blocks, directory, connection, repeat=1, keep=False):
+    """
+    Generate (once) and import a synthetic city of blocks x blocks blocks and run the network, attributes and index
+    steps on it repeat times. Returns the number of network edges, the best wall time per step and the best time per
+    SQL template statement (keyed by "<template> #<position> <label>", see dbhelper.sql_profile) in seconds.
+    """
+    filename = f"city_{blocks}.osm"
+    if not os.path.exists(os.path.join(directory, filename)):
+        print(f"Generating {filename}...")
+        generate_city_osm(os.path.join(directory, filename), blocks)
+    GlobalSettings.data_directory = directory
+    GlobalSettings.case_id = f"benchmark_{blocks}"
+    GlobalSettings.base_case_id = None
+    db_settings = DbSettings(*connection, on_existing='delete')
+    db_settings.entities.data_schema = f"netascore_benchmark_data_{blocks}"
+
+    h.majorInfo(f" === importing the synthetic city of {blocks} x {blocks} blocks ===")
+    OsmImporter(db_settings).run_step({'type': 'osm', 'filename': filename, 'on_existing': 'delete'})
+    create_noise_layer(db_settings)
+
+    profiles = load_profiles(os.path.join(ROOT, 'data'), PROFILES)
+    runs = {
+        'network': lambda: OsmNetworkStep(db_settings).run_step({'type': 'osm'}),
+        'attributes': lambda: OsmAttributesStep(db_settings).run_step({'type': 'osm'}),
+        'index': lambda: generate_index(db_settings, profiles, None),
+    }
+    steps = {}
+    statements = {}
+    for _ in range(repeat):
+        for step in STEPS:
+            dbhelper.sql_profile.clear()
+            start = time.perf_counter()
+            runs[step]()
+            steps[step] = min(time.perf_counter() - start, steps.get(step, math.inf))
+            # templates executed several times per step (e.g. index, once per profile) are summed up
+            run = {}
+            for s in dbhelper.sql_profile:
+                key = f"{s['template']} #{s['statement']} {s['label']}"
+                run[key] = run.get(key, 0.0) + s['seconds']
+            for key, seconds in run.items():
+                statements[key] = min(seconds, statements.get(key, math.inf))
+    edges = table_count(db_settings, db_settings.entities.network_schema, 'network_edge')
+    if not keep:
+        drop_schemas(db_settings)
+    return {'edges': edges, 'steps': steps, 'statements': statements}
+
+def scaling_exponent(points):
+    """
+    Least squares slope of log(seconds) over log(edges) for [(edges, seconds)]: 1 for linear scaling, 2 for quadratic.
+    """
+    points = [(math.log(x), math.log(y)) for x, y in points if x > 0 and y > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance if variance else None
+
+def print_scaling(results, top=10):
+    """
+    Print the wall time per step for all sizes with its scaling exponent, and the same for the statements that take
+    the longest on the largest size.
+    """
+    sizes = sorted(results, key=lambda size: results[size]['edges'])
+    print(f"{'':<60}" + "".join(f"{results[size]['edges']:>11,} e" for size in sizes) + "   exponent")
+    def row(name, values):
+        exponent = scaling_exponent([(results[size]['edges'], value) for size, value in zip(sizes, values) if value is not None])
+        print(f"{name[:60]:<60}" + "".join(f"{value:>13.2f}" if value is not None else f"{'-':>13}" for value in values)
+              + (f"   {exponent:.2f}" if exponent is not None else ""))
+    for step in STEPS:
+        row(step, [results[size]['steps'].get(step) for size in sizes])
+    largest = results[sizes[-1]]['statements']
+    print()
+    for key in sorted(largest, key=largest.get, reverse=True)[:top]:
+        row(key, [results[size]['statements'].get(key) for size in sizes])
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compare the results with those of a previous run. Returns a list of (size, step, seconds, baseline) of all steps and
+    statements that got slower by more than tolerance (a fraction). Statements shorter than 0.1 s are ignored (noise).
+    """
+    regressions = []
+    for size, result in results.items():
+        previous = baseline.get('results', {}).get(size)
+        if previous is None:
+            continue
+        timings = [(step, value, previous['steps'].get(step)) for step, value in result['steps'].items()]
+        timings += [(key, value, previous['statements'].get(key)) for key, value in result['statements'].items()]
+        for name, value, before in timings:
+            if before and max(value, before) >= 0.1 and value > before * (1 + tolerance):
+                regressions.append((size, name, value, before))
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SQL templates (network, attributes, index, export) on synthetic cities in a PostGIS database.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 30, 60], help="Sizes of the synthetic cities in blocks per side (N x N blocks)")
+    parser.add_argument('--directory', default=os.path.join(ROOT, 'data', 'benchmark'),
+                        help="Directory for the synthetic OSM files (generated once and re-used)")
+    parser.add_argument('--host', default=os.getenv('DB_HOST', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('DB_PORT', '5432')))
+    parser.add_argument('--dbname', default=os.getenv('DB_NAME', 'postgres'))
+    parser.add_argument('--username', default=os.getenv('DB_USERNAME', 'postgres'))
+    parser.add_argument('--password', default=os.getenv('DB_PASSWORD', 'postgres'))
+    parser.add_argument('--repeat', type=int, default=1, help="Run the steps N times per size and report the best time (less noise)")
+    parser.add_argument('--keep', action='store_true', help="Keep the benchmark schemas in the database (for inspection)")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON file of a previous run: exit with an error if a step or statement got slower by more than --tolerance")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown compared to --baseline (default: 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # the steps load their SQL templates relative to the repository
+    os.chdir(ROOT)
+    GlobalSettings.custom_srid = 32633
+    os.makedirs(args.directory, exist_ok=True)
+    connection = (args.host, args.port, args.dbname, args.username, args.password)
+    results = {str(size): run_size(size, os.path.abspath(args.directory), connection, args.repeat, args.keep) for size in args.sizes}
+    print_scaling(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for size, name, value, before in regressions:
+            print(f"Regression: {size} blocks, {name}: {value:.2f} s (baseline {before:.2f} s)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions compared to the baseline.")
+
+if __name__ == '__main__':
+    main()
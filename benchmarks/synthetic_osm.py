@@ -0,0 +1,273 @@
+import argparse
+import os
+import random
+import sys
+from xml.sax.saxutils import quoteattr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from main import open_osm_file
+
+###########################
+# Tag Distributions
+###########################
+
+# Share of the ways of a city extract per highway value (roughly following taginfo); all other ways are buildings
+# or land use areas, which most scenario rules do not act on.
+HIGHWAY_WEIGHTS = {
+    'service': 30, 'residential': 20, 'footway': 14, 'track': 8, 'path': 6, 'unclassified': 5, 'tertiary': 3.5,
+    'secondary': 2.5, 'primary': 2, 'cycleway': 1.5, 'steps': 1.5, 'living_street': 1, 'pedestrian': 1,
+    'trunk': 0.5, 'motorway': 0.5, 'motorway_link': 0.3, 'primary_link': 0.2, 'construction': 0.2, 'bridleway': 0.1
+}
+ROADS = {'residential', 'unclassified', 'tertiary', 'secondary', 'primary', 'trunk', 'motorway', 'motorway_link',
+         'primary_link', 'living_street', 'service'}
+AREA_WEIGHTS = {'building': 85, 'landuse': 10, 'leisure': 3, 'natural': 2}
+AREA_VALUES = {
+    'building': ['yes', 'house', 'residential', 'apartments', 'garage', 'commercial'],
+    'landuse': ['residential', 'grass', 'meadow', 'forest', 'industrial', 'retail'],
+    'leisure': ['park', 'pitch', 'playground', 'garden'],
+    'natural': ['wood', 'scrub', 'water', 'tree_row']
+}
+
+# (key, probability for roads, probability for other highways, values with weights)
+HIGHWAY_TAGS = [
+    ('name', 0.7, 0.15, None),
+    ('maxspeed', 0.45, 0.02, {'30': 35, '50': 40, '70': 8, '100': 5, 'walk': 4, 'none': 2, '30 mph': 1}),
+    ('surface', 0.4, 0.5, {'asphalt': 60, 'paving_stones': 12, 'gravel': 10, 'concrete': 6, 'unpaved': 6, 'grass': 3, 'sett': 3}),
+    ('oneway', 0.25, 0.03, {'yes': 85, 'no': 10, '-1': 5}),
+    ('lanes', 0.2, 0.0, {'1': 25, '2': 55, '3': 12, '4': 8}),
+    ('lit', 0.3, 0.25, {'yes': 80, 'no': 20}),
+    ('sidewalk', 0.2, 0.0, {'both': 55, 'left': 10, 'right': 15, 'no': 15, 'separate': 5}),
+    ('cycleway', 0.08, 0.0, {'lane': 40, 'shared_lane': 25, 'track': 20, 'no': 15}),
+    ('parking:both', 0.06, 0.0, {'lane': 50, 'no': 30, 'street_side': 20}),
+    ('width', 0.05, 0.1, {'2': 20, '3': 30, '3.5': 20, '5': 20, '7.5': 10}),
+    ('bicycle', 0.05, 0.2, {'yes': 50, 'designated': 30, 'no': 15, 'dismount': 5}),
+    ('foot', 0.03, 0.25, {'yes': 50, 'designated': 35, 'no': 15}),
+    ('layer', 0.02, 0.02, {'1': 70, '-1': 25, '2': 5}),
+    ('bridge', 0.02, 0.02, {'yes': 100}),
+    ('access', 0.05, 0.08, {'private': 50, 'no': 20, 'destination': 20, 'permissive': 10}),
+]
+EXTRA_KEYS = ['source', 'note', 'check_date', 'old_name', 'ref', 'smoothness', 'incline', 'tracktype', 'motor_vehicle', 'psv']
+STREET_NAMES = ['Hauptstraße', 'Bahnhofstraße', 'Kirchgasse', 'Linzer Gasse', 'Schillerstraße', 'Am Bach', 'Ringstraße',
+                'Mozartplatz', 'Gartenweg', 'Müllner Hauptstraße', 'Ignaz-Harrer-Straße', 'Rue de la "Gare" & Co']
+
+def weighted_choice(rng, weights):
+    return rng.choices(list(weights), list(weights.values()))[0]
+
+def synthetic_way_tags(rng, highway_share, extra_tags):
+    """
+    Return the (key, value) tags of a random way: a highway with typical attributes (with probability highway_share)
+    or an area, plus on average extra_tags tags with other keys.
+    """
+    if rng.random() < highway_share:
+        highway = weighted_choice(rng, HIGHWAY_WEIGHTS)
+        tags = [('highway', highway)]
+        road = highway in ROADS
+        for key, road_probability, other_probability, values in HIGHWAY_TAGS:
+            if rng.random() < (road_probability if road else other_probability):
+                tags.append((key, rng.choice(STREET_NAMES) if values is None else weighted_choice(rng, values)))
+    else:
+        key = weighted_choice(rng, AREA_WEIGHTS)
+        tags = [(key, rng.choice(AREA_VALUES[key]))]
+        if key == 'building' and rng.random() < 0.3:
+            tags += [('addr:street', rng.choice(STREET_NAMES)), ('addr:housenumber', str(rng.randint(1, 120)))]
+    count = int(extra_tags) + (1 if rng.random() < extra_tags % 1 else 0)
+    for key in rng.sample(EXTRA_KEYS, min(count, len(EXTRA_KEYS))):
+        tags.append((key, f"{key} {rng.randint(1, 1000)}"))
+    return tags
+
+###########################
+# OSM XML Generator
+###########################
+
+def synthetic_ways(ways, highway_share, extra_tags, seed):
+    """
+    Yield the node ids and tags of the given number of random ways. Ways have 2 to 12 nodes, a highway continues at
+    the last node of the previous highway with probability 0.7 (so that the highways form a network) and areas
+    are closed. The same seed yields the same ways.
+    """
+    rng = random.Random(seed)
+    next_id = 1
+    previous_end = None
+    for _ in range(ways):
+        count = rng.randint(2, 12)
+        tags = synthetic_way_tags(rng, highway_share, extra_tags)
+        if tags[0][0] != 'highway':
+            refs = list(range(next_id, next_id + count)) + [next_id]
+            next_id += count
+        elif previous_end is not None and rng.random() < 0.7:
+            refs = [previous_end] + list(range(next_id, next_id + count - 1))
+            next_id += count - 1
+        else:
+            refs = list(range(next_id, next_id + count))
+            next_id += count
+        if tags[0][0] == 'highway':
+            previous_end = refs[-1]
+        yield refs, tags
+
+def generate_osm(path, ways, highway_share=0.6, extra_tags=0.5, seed=1, bbox=(13.0, 47.78, 13.1, 47.85)):
+    """
+    Write a synthetic OSM XML file with the given number of ways (see synthetic_ways), optionally compressed (see
+    open_osm_file). Nodes, ways and relations are sorted by id like in real extracts. The ways are generated twice
+    (first to count their nodes) instead of being kept in memory. Returns the number of nodes.
+    """
+    nodes = max((max(refs) for refs, _ in synthetic_ways(ways, highway_share, extra_tags, seed)), default=0)
+    rng = random.Random(seed + 1)
+    min_lon, min_lat, max_lon, max_lat = bbox
+    with open_osm_file(path, 'wb') as f:
+        f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="NetAScore synthetic OSM">\n')
+        f.write(f'  <bounds minlat="{min_lat}" minlon="{min_lon}" maxlat="{max_lat}" maxlon="{max_lon}"/>\n'.encode())
+        lines = []
+        for node_id in range(1, nodes + 1):
+            lines.append(f'  <node id="{node_id}" lat="{rng.uniform(min_lat, max_lat):.7f}" lon="{rng.uniform(min_lon, max_lon):.7f}"/>\n')
+            if len(lines) >= 10000:
+                f.write(''.join(lines).encode())
+                lines = []
+        for way_id, (refs, tags) in enumerate(synthetic_ways(ways, highway_share, extra_tags, seed), 1):
+            lines.append(f'  <way id="{way_id}">\n')
+            lines += [f'    <nd ref="{ref}"/>\n' for ref in refs]
+            lines += [f'    <tag k={quoteattr(key)} v={quoteattr(value)}/>\n' for key, value in tags]
+            lines.append('  </way>\n')
+            if len(lines) >= 10000:
+                f.write(''.join(lines).encode())
+                lines = []
+        for relation_id in range(1, ways // 1000 + 1):
+            members = ''.join(f'    <member type="way" ref="{rng.randint(1, ways)}" role=""/>\n' for _ in range(rng.randint(2, 20)))
+            lines.append(f'  <relation id="{relation_id}">\n{members}    <tag k="type" v="route"/>\n  </relation>\n')
+        lines.append('</osm>\n')
+        f.write(''.join(lines).encode())
+    return nodes
+
+###########################
+# Grid City Generator
+###########################
+
+# metres per degree of latitude and (at 47.8° N) longitude
+METRES_PER_DEGREE_LAT = 111200
+METRES_PER_DEGREE_LON = 74700
+CITY_AMENITIES = ['cafe', 'library', 'restaurant', 'school', 'kindergarten', 'pharmacy', 'bar', 'theatre', 'museum', 'community_centre']
+
+def street_tags(rng, highway):
+    # typical attributes of a street of the given class (see HIGHWAY_TAGS)
+    tags = [('highway', highway)]
+    for key, road_probability, other_probability, values in HIGHWAY_TAGS:
+        if rng.random() < (road_probability if highway in ROADS else other_probability):
+            tags.append((key, rng.choice(STREET_NAMES) if values is None else weighted_choice(rng, values)))
+    return tags
+
+def generate_city_osm(path, blocks, block_size=100, seed=1, origin=(13.0, 47.78)):
+    """
+    Write a synthetic OSM XML file of a city laid out as a grid of blocks x blocks square blocks of block_size metres
+    (optionally compressed, see open_osm_file). Unlike generate_osm, the ways are spatially coherent, so that the
+    network and attribute SQL of NetAScore sees realistic intersections and spatial context: streets along the grid
+    (every 5th a primary or secondary road) that share their crossing nodes, footways through parks, buildings along
+    the streets, parks and meadows (greenness), amenities (facilities), pedestrian crossings, a river and bicycle
+    route relations. Returns the number of street ways.
+    """
+    rng = random.Random(seed)
+    nodes = []   # (id, lon, lat, tags)
+    ways = []    # (id, refs, tags)
+
+    def node(x, y, tags=()):
+        nodes.append((len(nodes) + 1, origin[0] + x / METRES_PER_DEGREE_LON, origin[1] + y / METRES_PER_DEGREE_LAT, tags))
+        return len(nodes)
+
+    def way(refs, tags):
+        ways.append((len(ways) + 1, refs, tags))
+        return len(ways)
+
+    # crossing nodes of the grid streets and two intermediate nodes per block side
+    grid = [[node(i * block_size + rng.uniform(-3, 3), j * block_size + rng.uniform(-3, 3),
+                  [('highway', 'crossing')] if rng.random() < 0.2 else []) for j in range(blocks + 1)] for i in range(blocks + 1)]
+
+    def street(points):
+        # street along the given grid points with intermediate nodes, split into ways of up to 4 blocks
+        segments = []
+        refs = [points[0][2]]
+        for (x0, y0, _), (x1, y1, ref) in zip(points, points[1:]):
+            refs += [node(x0 + (x1 - x0) * t + rng.uniform(-2, 2), y0 + (y1 - y0) * t + rng.uniform(-2, 2)) for t in (1 / 3, 2 / 3)] + [ref]
+            if len(refs) >= 13:
+                segments.append(refs)
+                refs = [ref]
+        if len(refs) > 1:
+            segments.append(refs)
+        return segments
+
+    street_ways = []
+    for line in range(blocks + 1):
+        highway = 'primary' if line % 10 == 0 else 'secondary' if line % 5 == 0 else weighted_choice(rng, {'residential': 6, 'tertiary': 2, 'service': 1, 'living_street': 0.5})
+        for points in ([(i * block_size, line * block_size, grid[i][line]) for i in range(blocks + 1)],
+                       [(line * block_size, j * block_size, grid[line][j]) for j in range(blocks + 1)]):
+            tags = street_tags(rng, highway)
+            street_ways.append([way(refs, tags) for refs in street(points)])
+
+    # block contents: parks with footways or buildings, amenities
+    for i in range(blocks):
+        for j in range(blocks):
+            x, y = i * block_size, j * block_size
+            if rng.random() < 0.1:
+                corners = [node(x + 10, y + 10), node(x + block_size - 10, y + 10), node(x + block_size - 10, y + block_size - 10), node(x + 10, y + block_size - 10)]
+                way(corners + corners[:1], [('landuse', rng.choice(['grass', 'meadow', 'forest'])), ('leisure', 'park')])
+                way([grid[i][j], node(x + block_size / 2, y + block_size / 2), grid[i + 1][j + 1]], street_tags(rng, 'footway'))
+                continue
+            for _ in range(rng.randint(4, 8)):
+                bx = x + 15 + rng.uniform(0, block_size - 45)
+                by = y + 15 + rng.uniform(0, block_size - 45)
+                w, d = rng.uniform(8, 15), rng.uniform(8, 15)
+                corners = [node(bx, by), node(bx + w, by), node(bx + w, by + d), node(bx, by + d)]
+                way(corners + corners[:1], [('building', weighted_choice(rng, {'yes': 5, 'house': 3, 'apartments': 2, 'commercial': 1}))])
+            if rng.random() < 0.3:
+                node(x + rng.uniform(20, block_size - 20), y + rng.uniform(20, block_size - 20), [('amenity', rng.choice(CITY_AMENITIES)), ('name', rng.choice(STREET_NAMES))])
+
+    # a river through the middle of a row of blocks
+    river_y = (blocks // 2 + 0.5) * block_size
+    way([node(x * block_size / 4, river_y + rng.uniform(-5, 5)) for x in range(4 * blocks + 1)], [('waterway', 'river'), ('name', 'Salzach')])
+
+    # bicycle routes along a few streets
+    relations = []
+    for ids in rng.sample(street_ways, max(1, len(street_ways) // 10)):
+        relations.append((len(relations) + 1, ids, [('type', 'route'), ('route', 'bicycle'), ('network', rng.choice(['lcn', 'rcn', 'ncn']))]))
+
+    with open_osm_file(path, 'wb') as f:
+        f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="NetAScore synthetic OSM">\n')
+        lines = []
+        for node_id, lon, lat, tags in nodes:
+            if tags:
+                lines.append(f'  <node id="{node_id}" lat="{lat:.7f}" lon="{lon:.7f}">\n' + ''.join(f'    <tag k={quoteattr(k)} v={quoteattr(v)}/>\n' for k, v in tags) + '  </node>\n')
+            else:
+                lines.append(f'  <node id="{node_id}" lat="{lat:.7f}" lon="{lon:.7f}"/>\n')
+            if len(lines) >= 10000:
+                f.write(''.join(lines).encode())
+                lines = []
+        for way_id, refs, tags in ways:
+            lines.append(f'  <way id="{way_id}">\n' + ''.join(f'    <nd ref="{ref}"/>\n' for ref in refs)
+                         + ''.join(f'    <tag k={quoteattr(k)} v={quoteattr(v)}/>\n' for k, v in tags) + '  </way>\n')
+            if len(lines) >= 10000:
+                f.write(''.join(lines).encode())
+                lines = []
+        for relation_id, ids, tags in relations:
+            lines.append(f'  <relation id="{relation_id}">\n' + ''.join(f'    <member type="way" ref="{i}" role=""/>\n' for i in ids)
+                         + ''.join(f'    <tag k={quoteattr(k)} v={quoteattr(v)}/>\n' for k, v in tags) + '  </relation>\n')
+        lines.append('</osm>\n')
+        f.write(''.join(lines).encode())
+    return sum(len(ids) for ids in street_ways)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic OSM XML file with a realistic mix of ways and tags.")
+    parser.add_argument('--ways', type=int, help="Number of ways (randomly placed, see generate_osm)")
+    parser.add_argument('--blocks', type=int, help="Instead of --ways: generate a grid city of N x N blocks (see generate_city_osm)")
+    parser.add_argument('--output', required=True, help="Output file (.xml, optionally compressed: .xml.gz, .xml.bz2, .xml.zst)")
+    parser.add_argument('--highway_share', type=float, default=0.6, help="Share of highways among the ways (the others are areas)")
+    parser.add_argument('--extra_tags', type=float, default=0.5, help="Average number of additional tags per way with other keys")
+    parser.add_argument('--seed', type=int, default=1, help="Seed of the generator")
+    args = parser.parse_args()
+    if args.blocks:
+        streets = generate_city_osm(args.output, args.blocks, seed=args.seed)
+        print(f"Wrote a city of {args.blocks} x {args.blocks} blocks with {streets} street ways to {args.output}")
+    elif args.ways:
+        nodes = generate_osm(args.output, args.ways, args.highway_share, args.extra_tags, args.seed)
+        print(f"Wrote {args.ways} ways and {nodes} nodes to {args.output}")
+    else:
+        parser.error("either --ways or --blocks is required")
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,17 @@
 import toolbox.helper as h
+from core import delta
 from core.db_step import DbStep
 from settings import DbSettings, GlobalSettings, InputType
 from toolbox.dbhelper import PostgresConnection
 
 
 class GipAttributesStep(DbStep):
+    input_tables = ['data.gip_link', 'data.gip_referenceobject', 'network.network_edge', 'network.network_node',
+                    'data.dem', 'data.noise', 'data.building', 'data.crossing', 'data.facility', 'data.greenness', 'data.water']
+    output_tables = ['network.network_edge_attributes', 'network.network_edge_export', 'network.network_node_attributes', 'network.*']
+    sql_files = ['sql/templates/gip_attributes.sql.j2', 'sql/functions/gip_calculate_bicycle_infrastructure.sql',
+                 'sql/functions/gip_calculate_pedestrian_infrastructure.sql', 'sql/functions/gip_calculate_road_category.sql']
+
     def __init__(self, db_settings: DbSettings):
         super().__init__(db_settings)
 
@@ -54,6 +61,12 @@ class GipAttributesStep(DbStep):
 
 
 class OsmAttributesStep(DbStep):
+    input_tables = ['data.osm_line', 'network.network_edge', 'network.network_node',
+                    'data.dem', 'data.noise', 'data.building', 'data.crossing', 'data.facility', 'data.greenness', 'data.water']
+    output_tables = ['network.network_edge_attributes', 'network.network_edge_export', 'network.network_node_attributes', 'network.*']
+    sql_files = ['sql/templates/osm_attributes.sql.j2', 'sql/functions/osm_calculate_access_bicycle.sql',
+                 'sql/functions/osm_calculate_access_car.sql', 'sql/functions/osm_calculate_access_pedestrian.sql', 'core/delta.py']
+
     def __init__(self, db_settings: DbSettings):
         super().__init__(db_settings)
 
@@ -69,19 +82,29 @@ class OsmAttributesStep(DbStep):
         db.connect()
         db.schema = schema
 
-        # create functions
-        h.log('create functions')
-        db.execute_sql_from_file("osm_calculate_access_bicycle", "sql/functions")
-        db.execute_sql_from_file("osm_calculate_access_car", "sql/functions")
-        db.execute_sql_from_file("osm_calculate_access_pedestrian", "sql/functions")
-        db.commit()
+        # if the network step determined the edges affected by the scenario, only compute their attributes
+        base_schema = None
+        if db.exists('network_edge_affected', schema):
+            base_schema = delta.get_base_network_schema(db, self.db_settings, ['network_edge_attributes', 'network_edge_export', 'network_node_attributes'])
+        target_schema = schema if base_schema is None else f"{schema}_delta"
 
         # execute "osm_attributes"
         h.logBeginTask('execute "osm_attributes"')
         if db.handle_conflicting_output_tables(['network_edge_attributes', 'network_edge_export', 'network_node_attributes']):
+            if base_schema is not None:
+                delta.create_delta_schema(db, schema, target_schema)
+                db.schema = target_schema
+
+            # create functions
+            h.log('create functions')
+            db.execute_sql_from_file("osm_calculate_access_bicycle", "sql/functions")
+            db.execute_sql_from_file("osm_calculate_access_car", "sql/functions")
+            db.execute_sql_from_file("osm_calculate_access_pedestrian", "sql/functions")
+            db.commit()
+
             params = {
                 # TODO: harmonize schema + load table names from dbEntitySettings (which are populated / overwritten by read values from settings file)
-                'schema_network': schema,
+                'schema_network': target_schema,
                 'schema_data': self.db_settings.entities.data_schema,
                 'table_dem': db.use_if_exists('dem', self.db_settings.entities.data_schema),
                 'table_noise': db.use_if_exists('noise', self.db_settings.entities.data_schema),
@@ -95,6 +118,13 @@ class OsmAttributesStep(DbStep):
             }
             db.execute_template_sql_from_file("osm_attributes", params)
             db.commit()
+            if base_schema is not None:
+                # node attributes (elevation) and the edge export table do not depend on tags
+                delta.merge_delta_table(db, schema, base_schema, target_schema, 'network_edge_attributes')
+                delta.copy_base_table(db, schema, base_schema, 'network_edge_export', 'edge_id')
+                delta.copy_base_table(db, schema, base_schema, 'network_node_attributes', 'node_id')
+                db.drop_schema(target_schema, cascade=True)
+                db.commit()
         h.logEndTask()
 
         # close database connection
@@ -1,11 +1,35 @@
+import glob
+import inspect
+import os
+from typing import List, Tuple
+
 from settings import GlobalSettings, DbSettings
 
+# tables are declared as "data.<table>" or "network.<table>" (the data and network schema of the case) - "<schema>.*"
+# stands for all tables of a schema
+ALL_TABLES = ['data.*', 'network.*']
+
 
 class DbStep:
     db_settings: DbSettings
-    
+    # tables read and written by run_step: steps that do not share tables may run concurrently (see core/step_graph.py),
+    # steps without declaration conflict with all other steps
+    input_tables: List[str] = ALL_TABLES
+    output_tables: List[str] = ALL_TABLES
+    # SQL files (and other resources) the results depend on, in addition to the module of the step - None for all SQL files
+    sql_files: List[str] = None
+
     def __init__(self, db_settings: DbSettings):
         self.db_settings = db_settings
 
+    def tables(self, settings: dict) -> Tuple[List[str], List[str]]:
+        """Returns the input and output tables of run_step for the given settings."""
+        return self.input_tables, self.output_tables
+
+    def files(self) -> List[str]:
+        """Returns the code and SQL files the results of run_step depend on (see core/step_cache.py)."""
+        sql_files = self.sql_files if self.sql_files is not None else sorted(glob.glob('sql/**/*.*', recursive=True))
+        return [os.path.relpath(inspect.getsourcefile(type(self)))] + sql_files
+
     def run_step(self, settings: dict):
         raise NotImplementedError()
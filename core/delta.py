@@ -0,0 +1,109 @@
+from typing import List, Optional
+
+import toolbox.helper as h
+from settings import DbEntitySettings, DbSettings, GlobalSettings
+from toolbox.dbhelper import PostgresConnection
+
+# tags that determine which ways are part of the network and where edges are split (see osm_network);
+# "netascore:table" changes if a way moved between the osm2pgsql line and polygon tables (see osm_changed_way)
+TOPOLOGY_KEYS = ['highway', 'railway', 'aerialway', 'layer', 'level', 'bridge', 'bridge:movable', 'bridge:structure',
+                 'seamark:type', 'man_made', 'tunnel', 'covered', 'conveying', 'indoor', 'netascore:table']
+# tags of ways that are used as spatial context of edges in osm_attributes (buildings, greenness, water, routes, ...)
+CONTEXT_KEYS = ['building', 'amenity', 'tourism', 'landuse', 'leisure', 'natural', 'waterway', 'tunnel', 'route', 'network']
+# largest distance between an edge and its spatial context in osm_attributes (buffers of 30 m)
+CONTEXT_DISTANCE = 30
+
+
+def get_base_network_schema(db: PostgresConnection, db_settings: DbSettings, tables: List[str]) -> Optional[str]:
+    """Returns the network schema of the base case if incremental processing is enabled ('base_case_id' in the global
+    settings) and the base case contains all given tables, None otherwise."""
+    if not GlobalSettings.base_case_id or GlobalSettings.base_case_id == GlobalSettings.case_id:
+        return None
+    base_schema = DbEntitySettings(GlobalSettings.base_case_id).network_schema
+    if base_schema == db_settings.entities.network_schema:
+        return None
+    for table in tables:
+        if not db.exists(table, base_schema):
+            h.info(f"base case table '{base_schema}.{table}' does not exist - computing all edges")
+            return None
+    return base_schema
+
+
+def topology_changed(db: PostgresConnection, data_schema: str) -> bool:
+    """Returns True if the ways changed by the scenario (table "osm_changed_way") affect the network topology."""
+    if not db.exists('osm_changed_way', data_schema):
+        h.info("no changed ways found for the scenario (table 'osm_changed_way') - computing all edges")
+        return True
+    changed = db.query_one(f"SELECT count(*) FROM {data_schema}.osm_changed_way WHERE changed_keys && %s::text[]", (TOPOLOGY_KEYS,))[0]
+    if changed > 0:
+        h.info(f"{changed} changed ways affect the network topology - computing all edges")
+        return True
+    return False
+
+
+def create_delta_schema(db: PostgresConnection, schema: str, delta_schema: str, tables: List[str] = None):
+    """Creates a schema with the affected edges (table "network_edge_affected") of the network in schema and their nodes.
+    Further tables with an edge_id column (e.g. network_edge_attributes) are copied for the affected edges as well."""
+    h.log(f"creating schema '{delta_schema}' with the affected edges")
+    db.drop_schema(delta_schema, cascade=True)
+    db.create_schema(delta_schema)
+    db.execute(f"""
+        CREATE TABLE {delta_schema}.network_edge AS (
+            SELECT *
+            FROM {schema}.network_edge
+            WHERE edge_id IN (SELECT edge_id FROM {schema}.network_edge_affected)
+        );
+        ALTER TABLE {delta_schema}.network_edge ADD PRIMARY KEY (edge_id);
+        CREATE INDEX network_edge_geom_idx ON {delta_schema}.network_edge USING gist(geom);
+
+        CREATE TABLE {delta_schema}.network_node AS (
+            SELECT *
+            FROM {schema}.network_node
+            WHERE node_id IN (SELECT from_node FROM {delta_schema}.network_edge UNION SELECT to_node FROM {delta_schema}.network_edge)
+        );
+        ALTER TABLE {delta_schema}.network_node ADD PRIMARY KEY (node_id);
+        CREATE INDEX network_node_geom_idx ON {delta_schema}.network_node USING gist(geom);
+    """)
+    for table in tables or []:
+        db.execute(f"""
+            CREATE TABLE {delta_schema}.{table} AS (
+                SELECT *
+                FROM {schema}.{table}
+                WHERE edge_id IN (SELECT edge_id FROM {schema}.network_edge_affected)
+            );
+            ALTER TABLE {delta_schema}.{table} ADD PRIMARY KEY (edge_id);
+        """)
+    db.commit()
+
+
+def merge_delta_table(db: PostgresConnection, schema: str, base_schema: str, delta_schema: str, table: str):
+    """Creates the given table (with an edge_id column) in schema from the rows of the base case for all edges that are not
+    affected by the scenario and from the rows computed in delta_schema for the affected edges."""
+    columns = ', '.join(f'"{row[0]}"' for row in db.query_all(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position",
+        (base_schema, table)))
+    h.log(f"merging table '{table}' from base case and affected edges")
+    db.drop_table(table, schema=schema)
+    db.execute(f"""
+        CREATE TABLE {schema}.{table} AS (
+            SELECT {columns}
+            FROM {base_schema}.{table} a
+            WHERE NOT EXISTS (SELECT FROM {schema}.network_edge_affected b WHERE a.edge_id = b.edge_id)
+
+            UNION ALL
+
+            SELECT {columns}
+            FROM {delta_schema}.{table}
+        );
+    """)
+    db.add_primary_key(table, ['edge_id'], schema=schema)
+    db.commit()
+
+
+def copy_base_table(db: PostgresConnection, schema: str, base_schema: str, table: str, key: str):
+    """Copies a table that is not affected by the scenario from the base case."""
+    h.log(f"copying table '{table}' from base case")
+    db.drop_table(table, schema=schema)
+    db.execute(f"CREATE TABLE {schema}.{table} AS (SELECT * FROM {base_schema}.{table});")
+    db.add_primary_key(table, [key], schema=schema)
+    db.commit()
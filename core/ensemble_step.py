@@ -0,0 +1,81 @@
+import re
+
+import toolbox.helper as h
+from core import delta
+from core.db_step import DbStep
+from settings import DbEntitySettings, DbSettings, GlobalSettings
+from toolbox.dbhelper import PostgresConnection
+
+
+class EnsembleStep(DbStep):
+    """Collects the index of one replicate of a scenario ensemble (e.g. the same FREQ rules with different seeds): only the
+    index deltas to the base case are stored for the edges that changed, together with mean, variance and percentiles
+    of the deltas of all replicates per edge. The replicate's own schemas are dropped afterwards unless they are kept (the
+data schema shared by all replicates is dropped after the last one)."""
+
+    def __init__(self, db_settings: DbSettings):
+        super().__init__(db_settings)
+
+    def run_step(self, settings: dict):
+        h.info('ensemble step')
+        h.log(f"using ensemble settings: {str(settings)}")
+        h.require_keys(settings, ['name', 'replicate'], 'error: ensemble section is missing:')
+
+        schema = self.db_settings.entities.network_schema
+        data_schema = self.db_settings.entities.data_schema
+        ensemble_schema = self.db_settings.entities.get_ensemble_schema(settings['name'])
+        base_data_schema = DbEntitySettings(GlobalSettings.case_id).data_schema
+        shared_data_schema = DbEntitySettings(GlobalSettings.case_id).get_ensemble_data_schema(settings['name'])
+        replicate = int(settings['replicate'])
+        replicates = int(settings['replicates']) if h.has_keys(settings, ['replicates']) else None
+
+        # open database connection
+        h.log('connecting to database...')
+        db = PostgresConnection.from_settings_object(self.db_settings)
+        db.connect()
+        db.init_extensions_and_schema(ensemble_schema)
+
+        # the deltas can only be computed per edge if the replicate was computed from the base case (same edges)
+        base_schema = delta.get_base_network_schema(db, self.db_settings, ['network_edge_index'])
+        if base_schema is None or not db.exists('network_edge_affected', schema):
+            raise Exception("Ensemble replicates require the index of the base case ('base_case_id') and a scenario that does "
+                            "not change the network topology (only the affected edges are recomputed).")
+
+        columns = [row[0] for row in db.query_all(
+            "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = 'network_edge_index' ORDER BY ordinal_position",
+            (base_schema,)) if re.match(r'^index_.+_(ft|tf)$', row[0])]
+
+        # execute "ensemble"
+        h.logBeginTask(f'execute "ensemble" for replicate {replicate}')
+        params = {
+            'schema_ensemble': ensemble_schema,
+            'schema_network': schema,
+            'schema_base_network': base_schema,
+            'replicate': replicate,
+            'replicates': replicates,
+            'case_id': GlobalSettings.case_id,
+            'columns': columns
+        }
+        db.execute_template_sql_from_file("ensemble", params)
+        changed = db.query_one(f"SELECT edges_changed FROM {ensemble_schema}.replicate WHERE replicate = %s", (replicate,))[0]
+        collected = db.query_one(f"SELECT count(*) FROM {ensemble_schema}.replicate")[0]
+        h.info(f"{changed} edges with changed index in replicate {replicate} ({collected} replicates in '{ensemble_schema}')")
+        h.logEndTask()
+
+        # drop the schemas of the replicate (the base case and its data schema are shared by all replicates)
+        if not settings.get('keep_replicates', False):
+            h.logBeginTask('drop replicate schemas')
+            db.drop_schema(schema, cascade=True)
+            last_replicate = replicates is None or replicate >= replicates
+            if data_schema != base_data_schema and (data_schema != shared_data_schema or last_replicate):
+                db.drop_schema(data_schema, cascade=True)
+            db.commit()
+            h.logEndTask()
+
+        # close database connection
+        h.log('closing database connection')
+        db.close()
+
+
+def create_ensemble_step(db_settings: DbSettings):
+    return EnsembleStep(db_settings)
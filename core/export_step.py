@@ -17,6 +17,10 @@ def export_geopackage(connection_string: str, path: str, schema: str, table: str
 
 
 class GeopackageExporter(DbStep):
+    input_tables = ['network.export_edge', 'network.export_node']
+    output_tables = []
+    sql_files = []
+
     def run_step(self, settings: dict):
         h.info('exporting geopackage')
         h.log(f"using the following settings: {str(settings)}")
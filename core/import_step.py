@@ -1,11 +1,16 @@
+import io
+import itertools
 import os
 import re
+import shutil
 import subprocess
 from urllib.error import HTTPError
 import urllib.request
+import xml.etree.ElementTree as ET
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from osgeo import ogr
-from typing import List
+from typing import Iterable, Iterator, List
 
 import toolbox.helper as h
 from core.db_step import DbStep
@@ -13,72 +18,77 @@ from settings import DbSettings, GlobalSettings, InputType
 from toolbox.dbhelper import PostgresConnection
 
 
-def create_csv(file_txt: str) -> None:
-    """Takes in a path to an ogd gip txt file and converts it to a csv file."""
-    with open(file_txt, 'r', encoding='iso-8859-1') as f:
-        for line in f:
-            if line.startswith('tbl;'):
-                file_csv = open(os.path.splitext(file_txt)[0] + '.csv', 'w', encoding='utf-8')
-            elif line.startswith('atr;'):
-                file_csv.write(line[4:])
-            elif line.startswith('rec;'):
-                file_csv.write(line[4:].replace('""', '').replace('" "', ''))
-
-    file_csv.close()
-
-
-def create_sql(file_txt: str) -> None:
-    """Takes in a path to an ogd gip txt file and creates a sql file from it."""
-    with open(file_txt, 'r', encoding='iso-8859-1') as f:
-        for line in f:
-            if line.startswith('tbl;'):
-                file_sql = open(os.path.splitext(file_txt)[0] + '.sql', 'w', encoding='utf-8')
-                tbl = line[4:].strip().lower()
-            elif line.startswith('atr;'):
-                atr = line[4:].strip().lower().split(';')
-            elif line.startswith('frm;'):
-                frm = line[4:].strip().lower().split(';')
-            elif line.startswith('rec;'):
+def gip_column_type(frm: str) -> str:
+    """Takes in a column format of an ogd gip txt file (e.g. "decimal(10)") and returns the PostgreSQL data type."""
+    if frm == 'string':
+        return 'varchar'
+    if m := re.search(r"^(string)[(]([0-9]*)[)]", frm):
+        length = m.group(2)
+        return f"varchar({length})"
+    if m := re.search(r"^(decimal)[(]([0-9]*)[,]([0-9]*)[)]", frm):
+        precision = m.group(2)
+        scale = m.group(3)
+        return f"numeric({precision},{scale})"
+    if m := re.search(r"^(decimal)[(]([0-9]*)[)]", frm):
+        precision = m.group(2)
+        if int(precision) <= 4:
+            return "smallint"
+        elif int(precision) <= 10:
+            return "integer"
+        elif int(precision) <= 18:
+            return "bigint"
+        return f"numeric({precision})"
+    return frm
+
+
+class GipRecordStream:
+    """File-like object for COPY ... FROM STDIN: reads the "rec;" lines of an ogd gip txt file as CSV (utf-8) from the
+    given lines, one chunk at a time."""
+
+    def __init__(self, lines: Iterator[str]):
+        self._lines = lines
+        self._buffer = b''
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
                 break
-
-    for i, atr_ in enumerate(atr):
-        if atr_ == 'offset':
-            atr[i] = 'offset_'
-
-    for i, frm_ in enumerate(frm):
-        if frm_ == 'string':
-            frm[i] = 'varchar'
-        if m := re.search(r"^(string)[(]([0-9]*)[)]", frm_):
-            length = m.group(2)
-            frm[i] = f"varchar({length})"
-        elif m := re.search(r"^(decimal)[(]([0-9]*)[,]([0-9]*)[)]", frm_):
-            precision = m.group(2)
-            scale = m.group(3)
-            frm[i] = f"numeric({precision},{scale})"
-        elif m := re.search(r"^(decimal)[(]([0-9]*)[)]", frm_):
-            precision = m.group(2)
-            if int(precision) <= 4:
-                frm[i] = "smallint"
-            elif int(precision) <= 10:
-                frm[i] = "integer"
-            elif int(precision) <= 18:
-                frm[i] = "bigint"
-            else:
-                frm[i] = f"numeric({precision})"
-
-    columns = [f"{atr_} {frm_}" for atr_, frm_ in zip(atr, frm)]
-    sql = f"CREATE TABLE gip_{tbl} ({', '.join(columns)});"
-
-    file_sql.write(sql)
-    file_sql.close()
-
-
-def import_csv(connection_string: str, path: str, schema: str, table: str) -> None:
-    """Takes in a path to a csv file and imports it to a database table."""
-    h.log(f"Importing CSV '{path}' into database: '{schema}.{table}'")
-    # INFO: for psql in Windows, connection_string MUST be the LAST parameter - otherwise, further arguments are ignored
-    subprocess.run(['psql', '-c', f"\\copy {schema}.{table} from '{path}' WITH CSV DELIMITER ';' NULL '' HEADER ENCODING 'utf-8'", connection_string],
-        check=True)
+            if line.startswith('rec;'):
+                self._buffer += line[4:].replace('""', '').replace('" "', '').encode('utf-8')
+        data, self._buffer = (self._buffer, b'') if size < 0 else (self._buffer[:size], self._buffer[size:])
+        return data
+
+
+def copy_gip_table(db: PostgresConnection, lines: Iterable[str], schema: str) -> str:
+    """Takes in the lines of an ogd gip txt file and imports it to a database table in a single pass: the table is
+    created from the "tbl;", "atr;" and "frm;" header and the "rec;" lines are streamed into COPY. Returns the table name."""
+    lines = iter(lines)
+    tbl = atr = frm = None
+    first_record = None
+    for line in lines:
+        if line.startswith('tbl;'):
+            tbl = line[4:].strip().lower()
+        elif line.startswith('atr;'):
+            atr = line[4:].strip().lower().split(';')
+        elif line.startswith('frm;'):
+            frm = line[4:].strip().lower().split(';')
+        elif line.startswith('rec;'):
+            first_record = line
+            break
+    if tbl is None or atr is None or frm is None:
+        raise Exception("ERROR: missing tbl, atr or frm header in gip txt file.")
+
+    atr = ['offset_' if atr_ == 'offset' else atr_ for atr_ in atr]
+    columns = [f"{atr_} {gip_column_type(frm_)}" for atr_, frm_ in zip(atr, frm)]
+    table = f"gip_{tbl}"
+    db.drop_table(table, schema=schema)
+    db.ex(f"CREATE TABLE {schema}.{table} ({', '.join(columns)});")
+
+    h.log(f"Copying gip records into database: '{schema}.{table}'")
+    records = itertools.chain([first_record], lines) if first_record is not None else lines
+    db.cur.copy_expert(f"COPY {schema}.{table} FROM STDIN WITH CSV DELIMITER ';' NULL '' ENCODING 'utf-8'", GipRecordStream(records))
+    return table
 
 
 def import_geopackage(connection_string: str, path: str, schema: str, table: str, fid: str = None, target_srid: int = None, layers: List[str] = None,  attributes: List[str] = None, geometry_types: List[str] = None) -> None:  # TODO: @CW: add error handling
@@ -111,15 +121,75 @@ def import_geopackage(connection_string: str, path: str, schema: str, table: str
         #h.debugLog(f"ogr2ogr stdout: {result.args}")
 
 
-def import_osm(connection_string: str, path: str, path_style: str, schema: str, prefix: str = None) -> None:
-    """Takes in a path to an osm pbf file and imports it to database tables."""
+def import_osm(connection_string: str, path: str, path_style: str, schema: str, prefix: str = None, append: bool = False) -> None:
+    """Takes in a path to an osm pbf file and imports it to database tables.
+    With append=True, the file is an osmChange file (.osc) that is applied to the tables of a previous import.
+    OSM XML and osmChange files may be compressed (.gz, .bz2, .zst): osm2pgsql reads gzip and bzip2 itself, zstd is
+    decompressed on the fly and piped to osm2pgsql."""
     prefix = f"--prefix {prefix}" if prefix else ""
-
-    subprocess.run(f"osm2pgsql --database={connection_string} --middle-schema={schema} --output-pgsql-schema={schema} {prefix} --latlong --slim --hstore --style=\"{path_style}\" \"{path}\"", 
-        shell=True, check=True)
+    mode = "--append" if append else ""
+    command = f"osm2pgsql --database={connection_string} --middle-schema={schema} --output-pgsql-schema={schema} {prefix} {mode} --latlong --slim --hstore --style=\"{path_style}\""
+
+    if h.compression_suffix(path) != '.zst':
+        subprocess.run(f"{command} \"{path}\"", shell=True, check=True)
+        return
+    with h.open_compressed(path) as f:
+        process = subprocess.Popen(f"{command} --input-reader=xml -", shell=True, stdin=subprocess.PIPE)
+        try:
+            shutil.copyfileobj(f, process.stdin, 4 * 1024 * 1024)
+        except BrokenPipeError:
+            pass  # osm2pgsql failed - see its return code
+        finally:
+            process.stdin.close()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def revert_diff_filename(diff_filename: str) -> str:
+    """Returns the name of the osmChange file that undoes the given osmChange file (written along with it by main.py)."""
+    suffix = h.compression_suffix(diff_filename)
+    return re.sub(r'\.osc$', '', diff_filename[:len(diff_filename) - len(suffix)]) + '.revert.osc' + suffix
+
+
+def applied_revert_filename(filename: str, diff_filename: str) -> str:
+    """Returns the name of the copy of the revert file of the osmChange file diff_filename while it is applied to the data
+    imported from the given base file. The revert file next to the osmChange file may be overwritten by a new scenario
+    of the same name."""
+    base = filename[:len(filename) - len(h.compression_suffix(filename))]
+    return re.sub(r'(\.osm)?\.[^./\\]*$', '', base) + '.applied.revert.osc' + h.compression_suffix(diff_filename)
+
+
+def osm_change_way_ids(path: str) -> List[int]:
+    """Returns the ids of all ways in an (optionally compressed) osmChange file."""
+    ids = []
+    with h.open_compressed(path) as f:
+        for _, elem in ET.iterparse(f):
+            if elem.tag == 'way':
+                ids.append(int(elem.get('id')))
+                elem.clear()
+    return ids
+
+
+def osm_download_filename(settings: dict) -> str:
+    """Returns the name of the OSM XML file downloaded from the Overpass API, compressed if the import settings specify a 'compression' (gz, bz2, zst)."""
+    compression = settings.get('compression')
+    if compression and compression not in ('gz', 'bz2', 'zst'):
+        raise Exception(f"Unknown compression '{compression}' for the OSM download. Please use gz, bz2 or zst.")
+    return f"{GlobalSettings.osm_download_prefix}_{GlobalSettings.case_id}.xml" + (f".{compression}" if compression else "")
+
+
+def file_signature(path: str) -> str:
+    """Returns a string that changes whenever the given file is replaced or modified."""
+    stat = os.stat(path)
+    return f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}"
 
 
 class GipImporter(DbStep):
+    input_tables = []
+    output_tables = ['data.gip_bikehike', 'data.gip_link', 'data.gip_linkcoordinate', 'data.gip_linkuse',
+                     'data.gip_link2referenceobject', 'data.gip_node', 'data.gip_referenceobject']
+    sql_files = []
+
     def __init__(self, db_settings: DbSettings):
         super().__init__(db_settings)
 
@@ -145,42 +215,56 @@ class GipImporter(DbStep):
         db = PostgresConnection.from_settings_object(self.db_settings)
         db.connect()
         db.init_extensions_and_schema(schema)
+        db.close()
 
-        # extract zip files
-        h.logBeginTask('extract zip files')
-        with zipfile.ZipFile(os.path.join(directory, settings['filename_A']), 'r') as zf:
-            for file in files_A:
-                if not os.path.isfile(os.path.join(directory, os.path.splitext(settings['filename_A'])[0], file['filename'])):
-                    zf.extract(file['filename'], os.path.join(directory, os.path.splitext(settings['filename_A'])[0]))
-        h.logEndTask()
-
-        # create tables from files_A
-        for file in files_A:
-            h.logBeginTask(f"create table \"{file['table']}\"")
-            if not os.path.isfile(os.path.join(directory, os.path.splitext(settings['filename_A'])[0], f"{os.path.splitext(file['filename'])[0]}.csv")):
-                create_csv(os.path.join(directory, os.path.splitext(settings['filename_A'])[0], file['filename']))
-            if not os.path.isfile(os.path.join(directory, os.path.splitext(settings['filename_A'])[0], f"{os.path.splitext(file['filename'])[0]}.sql")):
-                create_sql(os.path.join(directory, os.path.splitext(settings['filename_A'])[0], file['filename']))
-
-            db.drop_table(file['table'], schema=schema)
-            db.execute_sql_from_file(f"{os.path.splitext(file['filename'])[0]}", os.path.join(directory, os.path.splitext(settings['filename_A'])[0]))
-            db.commit()
+        # create tables from files_A: the zip members are streamed into their tables concurrently, each on its own
+        # connection (as many as the connection pool of the run allows) - largest first, as LinkCoordinate.txt takes
+        # the longest
+        path = os.path.join(directory, settings['filename_A'])
+        with zipfile.ZipFile(path, 'r') as zf:
+            sizes = {file['filename']: zf.getinfo(file['filename']).file_size for file in files_A}
+        files_A.sort(key=lambda file: sizes[file['filename']], reverse=True)
+        with ThreadPoolExecutor(max_workers=min(len(files_A), os.cpu_count() or 1)) as executor:
+            for future in [executor.submit(self.load_table, path, file, schema) for file in files_A]:
+                future.result()
+
+    def load_table(self, path: str, file: dict, schema: str):
+        """Streams a txt file of the zip file into its table and adds the primary key afterwards (faster than
+        maintaining the index while copying)."""
+        h.logBeginTask(f"create table \"{file['table']}\"")
+        db = PostgresConnection.from_settings_object(self.db_settings)
+        db.connect()
+        with zipfile.ZipFile(path, 'r') as zf, zf.open(file['filename']) as member:
+            table = copy_gip_table(db, io.TextIOWrapper(member, encoding='iso-8859-1'), schema)
+        db.commit()
 
-            import_csv(db.connection_string, os.path.join(directory, os.path.splitext(settings['filename_A'])[0], f"{os.path.splitext(file['filename'])[0]}.csv"), schema, table=file['table'])
+        db.add_primary_key(table, file['columns'], schema=schema)
+        db.commit()
+        db.close()
+        h.logEndTask()
 
-            db.add_primary_key(file['table'], file['columns'], schema=schema)
-            db.commit()
-            h.logEndTask()
 
-        # close database connection
-        h.log('closing database connection')
-        db.close()
+OSM_OUTPUT_TABLES = ["osm_point", "osm_line", "osm_polygon"]
+# tables of osm2pgsql that are only needed for applying osmChange files (--append)
+OSM_MIDDLE_TABLES = ["osm_nodes", "osm_rels", "osm_roads", "osm_ways"]
+OSM_IMPORT_STATE_TABLE = "osm_import_state"
 
 
 class OsmImporter(DbStep):
+    input_tables = []
+    output_tables = [f"data.{table}" for table in OSM_OUTPUT_TABLES + OSM_MIDDLE_TABLES + [OSM_IMPORT_STATE_TABLE]] + \
+        ['data.osm_changed_way', 'data.aoi', 'data.building', 'data.crossing', 'data.facility', 'data.greenness', 'data.water']
+    sql_files = ['sql/functions/determine_utmzone.sql', 'sql/templates/osm_changed_way.sql.j2', 'resources/default.style']
+
     def __init__(self, db_settings: DbSettings):
         super().__init__(db_settings)
 
+    def tables(self, settings: dict):
+        # importing a scenario with "scenario_sql" moves the data schema of all following steps
+        if h.has_keys(settings, ['scenario_sql']):
+            return self.input_tables, ['data.*']
+        return self.input_tables, self.output_tables
+
     def _get_srid_for_AOI(self, data_con:PostgresConnection, aoi_name: str, aoi_table: str = "aoi", aoi_schema: str = "data", save_to_aoi_table: bool = True) -> int:
         data_con.execute_sql_from_file("determine_utmzone", "sql/functions")
         srid = data_con.query_one(f"SELECT srid FROM {aoi_schema}.{aoi_table} WHERE name=%s", (aoi_name,))[0]
@@ -339,7 +423,7 @@ class OsmImporter(DbStep):
             [timeout:900][maxsize:1073741824];
             nwr(__bbox__);
             out;"""
-        net_file = f"{GlobalSettings.osm_download_prefix}_{GlobalSettings.case_id}.xml"
+        net_file = osm_download_filename(settings)
         if os.path.isfile(os.path.join(GlobalSettings.data_directory, net_file)):
             if not h.has_keys(settings, ['on_existing']):
                 raise Exception("Target file for OSM download already exists. Please add a value for 'on_existing' to the import settings. [skip/abort/delete]")
@@ -359,9 +443,11 @@ class OsmImporter(DbStep):
         while curEndpointIndex < len(GlobalSettings.overpass_api_endpoints) and not success:
             success = False
             try:
-                file_name, headers = urllib.request.urlretrieve(
-                    GlobalSettings.overpass_api_endpoints[curEndpointIndex] + "?data=" + urllib.parse.quote_plus(q_str), 
-                    os.path.join(GlobalSettings.data_directory, net_file))
+                # the response is streamed to the file (compressed on the fly if the file name says so)
+                with urllib.request.urlopen(GlobalSettings.overpass_api_endpoints[curEndpointIndex] + "?data=" + urllib.parse.quote_plus(q_str)) as response, \
+                        h.open_compressed(os.path.join(GlobalSettings.data_directory, net_file), 'wb') as f:
+                    headers = response.info()
+                    shutil.copyfileobj(response, f, 4 * 1024 * 1024)
             except HTTPError as e:
                 h.log(f"HTTPError while trying to download OSM data from '{GlobalSettings.overpass_api_endpoints[curEndpointIndex]}': Error code {e.code}\n{e.args}\n{e.info()} --> trying again with next available API endpoint...")
                 curEndpointIndex+=1
@@ -379,6 +465,143 @@ class OsmImporter(DbStep):
             raise Exception("OSM data download was not successful. Terminating.")
         h.logEndTask()
 
+    def _import_osm_file(self, db: PostgresConnection, schema: str, directory: str, filename: str, keep_middle: bool = False):
+        h.logBeginTask('import osm file')
+        db.drop_table(OSM_IMPORT_STATE_TABLE, schema=schema)
+        db.drop_table("osm_changed_way", schema=schema)
+        for table in OSM_OUTPUT_TABLES + OSM_MIDDLE_TABLES:
+            db.drop_table(table, schema=schema)
+        db.commit()
+
+        import_osm(db.connection_string, os.path.join(directory, filename), os.path.join('resources', 'default.style'), schema, prefix='osm')  # 12 m 35 s
+
+        # remember which file the tables belong to, so that later runs can re-use them
+        db.execute(f"CREATE TABLE {schema}.{OSM_IMPORT_STATE_TABLE} (signature varchar, diff_filename varchar)")
+        db.execute(f"INSERT INTO {schema}.{OSM_IMPORT_STATE_TABLE} VALUES (%s, NULL)", (file_signature(os.path.join(directory, filename)),))
+        if not keep_middle:
+            for table in OSM_MIDDLE_TABLES:
+                db.drop_table(table, schema=schema)
+        db.commit()
+        h.logEndTask()
+
+    def _imported_osm_state(self, db: PostgresConnection, schema: str, directory: str, filename: str, tables: List[str]):
+        # returns (signature, diff_filename) of a previous import of the given file if all given tables still exist, None otherwise
+        if not db.exists(OSM_IMPORT_STATE_TABLE, schema) or not all(db.exists(table, schema) for table in tables):
+            return None
+        state = db.query_one(f"SELECT signature, diff_filename FROM {schema}.{OSM_IMPORT_STATE_TABLE}")
+        if state is None or state[0] != file_signature(os.path.join(directory, filename)):
+            return None
+        h.info(f"re-using osm data previously imported from '{filename}'")
+        return state
+
+    def _import_osm_diff(self, db: PostgresConnection, schema: str, directory: str, filename: str, diff_filename: str):
+        # (re-)import the base file unless it was already imported (with middle tables) by a previous run
+        state = self._imported_osm_state(db, schema, directory, filename, OSM_OUTPUT_TABLES + OSM_MIDDLE_TABLES)
+        if state is None:
+            h.info(f"importing base osm file '{filename}' for applying osmChange files")
+            self._import_osm_file(db, schema, directory, filename, keep_middle=True)
+            state = (None, None)
+
+        # undo the osmChange file applied by the previous run (using the copy of its revert file made when it was applied),
+        # then apply the new one
+        revert_path = os.path.join(directory, applied_revert_filename(filename, state[1] or ''))
+        if state[1] is not None and not os.path.isfile(revert_path):
+            h.info(f"revert file for osm changes of '{state[1]}' not found - importing base osm file '{filename}' again")
+            self._import_osm_file(db, schema, directory, filename, keep_middle=True)
+            state = (None, None)
+        if state[1] is not None:
+            h.logBeginTask(f"revert osm changes of '{state[1]}'")
+            import_osm(db.connection_string, revert_path, os.path.join('resources', 'default.style'), schema, prefix='osm', append=True)
+            db.execute(f"UPDATE {schema}.{OSM_IMPORT_STATE_TABLE} SET diff_filename = NULL")
+            db.commit()
+            h.logEndTask()
+
+        # keep the current version of the ways in the osmChange file for determining the changed ways
+        h.logBeginTask(f"apply osm changes of '{diff_filename}'")
+        db.drop_table("osm_changed_way", schema=schema)
+        db.execute(f"""
+            DROP TABLE IF EXISTS {schema}.osm_diff_way, {schema}.osm_line_before, {schema}.osm_polygon_before;
+            CREATE TABLE {schema}.osm_diff_way (osm_id bigint PRIMARY KEY);
+            INSERT INTO {schema}.osm_diff_way SELECT DISTINCT unnest(%s::bigint[]);
+            CREATE TABLE {schema}.osm_line_before AS (SELECT * FROM {schema}.osm_line WHERE osm_id IN (SELECT osm_id FROM {schema}.osm_diff_way));
+            CREATE TABLE {schema}.osm_polygon_before AS (SELECT * FROM {schema}.osm_polygon WHERE osm_id IN (SELECT osm_id FROM {schema}.osm_diff_way));
+        """, (osm_change_way_ids(os.path.join(directory, diff_filename)),))
+        db.commit()
+        revert_path = os.path.join(directory, applied_revert_filename(filename, diff_filename))
+        shutil.copyfile(os.path.join(directory, revert_diff_filename(diff_filename)), revert_path)
+        import_osm(db.connection_string, os.path.join(directory, diff_filename), os.path.join('resources', 'default.style'), schema, prefix='osm', append=True)
+        db.execute(f"UPDATE {schema}.{OSM_IMPORT_STATE_TABLE} SET diff_filename = %s", (diff_filename,))
+        db.commit()
+        h.logEndTask()
+
+        h.logBeginTask("determine changed ways")
+        params = {
+            'schema_data': schema,
+            'table_line_before': f"{schema}.osm_line_before",
+            'table_polygon_before': f"{schema}.osm_polygon_before",
+            'table_way_ids': f"{schema}.osm_diff_way"
+        }
+        db.execute_template_sql_from_file("osm_changed_way", params)
+        db.execute(f"DROP TABLE IF EXISTS {schema}.osm_diff_way, {schema}.osm_line_before, {schema}.osm_polygon_before;")
+        db.commit()
+        h.logEndTask()
+
+    def _import_osm_scenario_sql(self, db: PostgresConnection, schema: str, directory: str, filename: str, scenario_sql: str,
+                                 scenario_schema: str = None) -> str:
+        # (re-)import the base file unless it was already imported by a previous run; it is not modified by the scenario
+        state = self._imported_osm_state(db, schema, directory, filename, OSM_OUTPUT_TABLES)
+        if state is None:
+            h.info(f"importing base osm file '{filename}' for scenario '{GlobalSettings.case_id}'")
+            self._import_osm_file(db, schema, directory, filename)
+        elif state[1] is not None:
+            raise Exception(f"The osm data in schema '{schema}' was modified by osmChange file '{state[1]}'. Please re-import the base file.")
+        signature = db.query_one(f"SELECT signature FROM {schema}.{OSM_IMPORT_STATE_TABLE}")[0]
+
+        # the tables of ways are copied to a scenario data schema (nodes are not modified by scenarios); if the schema holds
+        # a previous scenario on the same base data, only the ways changed by it are restored from the base data instead
+        scenario_schema = (scenario_schema or f"{schema}_{GlobalSettings.case_id}").lower()
+        if self._imported_osm_state(db, scenario_schema, directory, filename, ["osm_line", "osm_polygon", "osm_changed_way"]) is not None:
+            h.logBeginTask(f"restore ways changed by the previous scenario in schema '{scenario_schema}'")
+            db.execute(f"""
+                DELETE FROM {scenario_schema}.osm_line WHERE osm_id IN (SELECT osm_id FROM {scenario_schema}.osm_changed_way);
+                DELETE FROM {scenario_schema}.osm_polygon WHERE osm_id IN (SELECT osm_id FROM {scenario_schema}.osm_changed_way);
+                INSERT INTO {scenario_schema}.osm_line SELECT * FROM {schema}.osm_line WHERE osm_id IN (SELECT osm_id FROM {scenario_schema}.osm_changed_way);
+                INSERT INTO {scenario_schema}.osm_polygon SELECT * FROM {schema}.osm_polygon WHERE osm_id IN (SELECT osm_id FROM {scenario_schema}.osm_changed_way);
+                DROP TABLE {scenario_schema}.osm_changed_way;
+            """)
+            db.commit()
+            h.logEndTask()
+        else:
+            h.logBeginTask(f"copy osm data to scenario schema '{scenario_schema}'")
+            db.drop_schema(scenario_schema, cascade=True)
+            db.create_schema(scenario_schema)
+            for table in ["osm_line", "osm_polygon"]:
+                db.execute(f"CREATE TABLE {scenario_schema}.{table} (LIKE {schema}.{table} INCLUDING ALL)")
+                db.execute(f"INSERT INTO {scenario_schema}.{table} SELECT * FROM {schema}.{table}")
+            db.execute(f"CREATE VIEW {scenario_schema}.osm_point AS SELECT * FROM {schema}.osm_point")
+            db.execute(f"CREATE TABLE {scenario_schema}.{OSM_IMPORT_STATE_TABLE} (signature varchar, diff_filename varchar)")
+            db.execute(f"INSERT INTO {scenario_schema}.{OSM_IMPORT_STATE_TABLE} VALUES (%s, NULL)", (signature,))
+            db.commit()
+            h.logEndTask()
+
+        h.logBeginTask(f"apply scenario sql '{scenario_sql}'")
+        db.schema = scenario_schema
+        db.execute_sql_from_file(os.path.splitext(scenario_sql)[0], directory)
+        db.commit()
+        h.logEndTask()
+
+        h.logBeginTask("determine changed ways")
+        params = {
+            'schema_data': scenario_schema,
+            'table_line_before': f"{schema}.osm_line",
+            'table_polygon_before': f"{schema}.osm_polygon",
+            'table_way_ids': None
+        }
+        db.execute_template_sql_from_file("osm_changed_way", params)
+        db.schema = scenario_schema
+        h.logEndTask()
+        return scenario_schema
+
     def run_step(self, settings: dict):
         h.info('importing osm')
         h.log(f"using settings: {str(settings)}")
@@ -407,27 +630,17 @@ class OsmImporter(DbStep):
                 self._load_osm_from_placename(db, schema, directory, settings)
 
         # import osm file
-        h.logBeginTask('import osm file')
-        db.drop_table("osm_point", schema=schema)
-        db.drop_table("osm_line", schema=schema)
-        db.drop_table("osm_polygon", schema=schema)
-        db.drop_table("osm_nodes", schema=schema)
-        db.drop_table("osm_rels", schema=schema)
-        db.drop_table("osm_roads", schema=schema)
-        db.drop_table("osm_ways", schema=schema)
-        db.commit()
-
-        filename = f"{GlobalSettings.osm_download_prefix}_{GlobalSettings.case_id}.xml"
+        filename = osm_download_filename(settings)
         if not use_overpass_api:
             filename = settings['filename']
-        import_osm(db.connection_string, os.path.join(directory, filename), os.path.join('resources', 'default.style'), schema, prefix='osm')  # 12 m 35 s
-
-        db.drop_table("osm_nodes", schema=schema)
-        db.drop_table("osm_rels", schema=schema)
-        db.drop_table("osm_roads", schema=schema)
-        db.drop_table("osm_ways", schema=schema)
-        db.commit()
-        h.logEndTask()
+        if h.has_keys(settings, ['scenario_sql']):
+            # all following steps use the scenario data schema
+            schema = self._import_osm_scenario_sql(db, schema, directory, filename, settings['scenario_sql'], settings.get('scenario_schema'))
+            self.db_settings.entities.data_schema = schema
+        elif h.has_keys(settings, ['diff_filename']):
+            self._import_osm_diff(db, schema, directory, filename, settings['diff_filename'])
+        else:
+            self._import_osm_file(db, schema, directory, filename, keep_middle=settings.get('keep_middle', False))
 
         # create dataset "building"
         h.logBeginTask('create dataset "building"')
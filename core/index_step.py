@@ -3,6 +3,7 @@ import re
 import yaml
 
 import toolbox.helper as h
+from core import delta
 from settings import DbSettings
 from toolbox.dbhelper import PostgresConnection
 from typing import List
@@ -35,6 +36,31 @@ class ModeProfile:
             self.access_car = self.access_bike = self.access_walk = True
         with open(filename) as file:
             self.profile = yaml.safe_load(file)
+        self._indicator_mapping_sql = None
+        self._overrides_sql = None
+
+    # the SQL is compiled only once per profile, as parsing consumes the yml definitions
+    def get_indicator_mapping_sql(self) -> str:
+        if self._indicator_mapping_sql is None:
+            # parse profile definition: generate SQL for indicator value assignments
+            h.info(f'parsing indicator value mapping for profile "{self.profile_name}"...')
+            self._indicator_mapping_sql = ""
+            for indicator in self.profile['indicator_mapping']:
+                self._indicator_mapping_sql += _build_sql_indicator_mapping(indicator)
+            h.debugLog(f"compiled indicator mapping SQL: \n\n{self._indicator_mapping_sql}")
+        return self._indicator_mapping_sql
+    indicator_mapping_sql: str = property(get_indicator_mapping_sql)
+
+    def get_overrides_sql(self) -> str:
+        if self._overrides_sql is None:
+            # parse profile definition: generate SQL for overrides (indicator weights or index)
+            h.info(f'parsing value overrides for profile "{self.profile_name}"...')
+            self._overrides_sql = ""
+            for override in self.profile['overrides']:
+                self._overrides_sql += _build_sql_overrides(override)
+            h.debugLog(f"compiled overrides SQL: \n\n{self._overrides_sql}")
+        return self._overrides_sql
+    overrides_sql: str = property(get_overrides_sql)
 
 
 def load_profiles(base_path: str, profile_definitions: dict):
@@ -183,6 +209,34 @@ def _build_sql_indicator_mapping(indicator_yml: dict) -> str:
         END IF;"""
     return sql
 
+def _compute_index(db: PostgresConnection, schema: str, profiles: List[ModeProfile], settings: dict):
+    # registers the index function of each profile in the working schema and computes its index columns for the network in schema
+    for p in profiles:
+        profile_name = p.profile_name
+        indicator_weights = p.profile['weights']
+        
+        # profile-specific function registration
+        h.info(f'register index function for profile "{profile_name}"...')
+        f_params = {
+            'compute_explanation': settings and h.has_keys(settings, ['compute_explanation']) and settings['compute_explanation'],
+            'indicator_mappings': p.indicator_mapping_sql,
+            'overrides': p.overrides_sql
+        }
+        db.execute_template_sql_from_file("calculate_index", f_params, template_subdir="sql/functions/")
+        # calculate index for currrent profile
+        h.info('calculate index_' + profile_name)
+        params = {
+            'schema_network': schema,
+            'profile_name': profile_name,
+            'compute_explanation': settings and h.has_keys(settings, ['compute_explanation']) and settings['compute_explanation'],
+            'access_car': p.access_car,
+            'access_bike': p.access_bike,
+            'access_walk': p.access_walk,
+        }
+        params.update(indicator_weights)
+        print(params)
+        db.execute_template_sql_from_file("index", params)
+
 def generate_index(db_settings: DbSettings, profiles: List[ModeProfile], settings: dict):
     schema = db_settings.entities.network_schema
 
@@ -197,46 +251,28 @@ def generate_index(db_settings: DbSettings, profiles: List[ModeProfile], setting
     # create functions
     ## this now happens in the "calculate index step" (re-defining functions based on mode profile and settings)
 
+    # if the network step determined the edges affected by the scenario, only compute their index
+    base_schema = None
+    if db.exists('network_edge_affected', schema):
+        base_schema = delta.get_base_network_schema(db, db_settings, ['network_edge_index'])
+        if base_schema is not None and not all(db.column_exists(f"index_{p.profile_name}_ft", base_schema, 'network_edge_index') for p in profiles):
+            h.info("base case index was computed for different profiles - computing all edges")
+            base_schema = None
+
     # calculate index
     h.logBeginTask("compute index columns for given profiles")
     if db.handle_conflicting_output_tables(['network_edge_index']):
-        for p in profiles:
-            profile_name = p.profile_name
-            indicator_weights = p.profile['weights']
-            # parse profile definition: generate SQL for indicator value assignments
-            h.info(f'parsing indicator value mapping for profile "{profile_name}"...')
-            indicator_mapping_sql = ""
-            for indicator in p.profile['indicator_mapping']:
-                indicator_mapping_sql += _build_sql_indicator_mapping(indicator)
-            h.debugLog(f"compiled indicator mapping SQL: \n\n{indicator_mapping_sql}")
-            # parse profile definition: generate SQL for overrides (indicator weights or index)
-            h.info(f'parsing value overrides for profile "{profile_name}"...')
-            overrides_sql = ""
-            for override in p.profile['overrides']:
-                overrides_sql += _build_sql_overrides(override)
-            h.debugLog(f"compiled overrides SQL: \n\n{overrides_sql}")
-            
-            # profile-specific function registration
-            h.info(f'register index function for profile "{profile_name}"...')
-            f_params = {
-                'compute_explanation': settings and h.has_keys(settings, ['compute_explanation']) and settings['compute_explanation'],
-                'indicator_mappings': indicator_mapping_sql,
-                'overrides': overrides_sql
-            }
-            db.execute_template_sql_from_file("calculate_index", f_params, template_subdir="sql/functions/")
-            # calculate index for currrent profile
-            h.info('calculate index_' + profile_name)
-            params = {
-                'schema_network': schema,
-                'profile_name': profile_name,
-                'compute_explanation': settings and h.has_keys(settings, ['compute_explanation']) and settings['compute_explanation'],
-                'access_car': p.access_car,
-                'access_bike': p.access_bike,
-                'access_walk': p.access_walk,
-            }
-            params.update(indicator_weights)
-            print(params)
-            db.execute_template_sql_from_file("index", params)
+        if base_schema is None:
+            _compute_index(db, schema, profiles, settings)
+        else:
+            delta_schema = f"{schema}_delta"
+            delta.create_delta_schema(db, schema, delta_schema, ['network_edge_attributes'])
+            db.schema = delta_schema
+            _compute_index(db, delta_schema, profiles, settings)
+            db.schema = schema
+            delta.merge_delta_table(db, schema, base_schema, delta_schema, 'network_edge_index')
+            db.drop_schema(delta_schema, cascade=True)
+            db.commit()
     h.logEndTask()
 
     # create tables "edges" and "nodes"
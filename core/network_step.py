@@ -1,10 +1,16 @@
 import toolbox.helper as h
+from core import delta
 from core.db_step import DbStep
 from settings import DbSettings, GlobalSettings, InputType
 from toolbox.dbhelper import PostgresConnection
 
 
 class GipNetworkStep(DbStep):
+    input_tables = ['data.gip_bikehike', 'data.gip_link', 'data.gip_linkcoordinate', 'data.gip_linkuse', 'data.gip_node']
+    # besides network_edge and network_node, the network templates create intermediate tables in the network schema
+    output_tables = ['network.network_edge', 'network.network_node', 'network.*']
+    sql_files = ['sql/templates/gip_network.sql.j2']
+
     def __init__(self, db_settings: DbSettings):
         super().__init__(db_settings)
 
@@ -38,6 +44,11 @@ class GipNetworkStep(DbStep):
 
 
 class OsmNetworkStep(DbStep):
+    input_tables = ['data.osm_line', 'data.osm_polygon', 'data.osm_changed_way']
+    output_tables = ['network.network_edge', 'network.network_node', 'network.*']
+    sql_files = ['sql/templates/osm_network.sql.j2', 'sql/templates/osm_network_delta.sql.j2',
+                 'sql/functions/osm_delete_dangling_edges.sql', 'core/delta.py']
+
     def __init__(self, db_settings: DbSettings):
         super().__init__(db_settings)
 
@@ -58,7 +69,30 @@ class OsmNetworkStep(DbStep):
         db.execute_sql_from_file("osm_delete_dangling_edges", "sql/functions")
         db.commit()
 
+        # if the base case is available and the scenario does not change the topology, only update the changed edges
+        base_schema = delta.get_base_network_schema(db, self.db_settings, ['network_edge', 'network_node'])
+        if base_schema is not None and not delta.topology_changed(db, self.db_settings.entities.data_schema):
+            h.logBeginTask('execute "osm_network_delta"')
+            if db.handle_conflicting_output_tables(['network_edge', 'network_node', 'network_edge_affected']):
+                params = {
+                    'schema_network': schema,
+                    'schema_data': self.db_settings.entities.data_schema,
+                    'schema_base_network': base_schema,
+                    'target_srid': GlobalSettings.get_target_srid(),
+                    'context_keys': delta.CONTEXT_KEYS,
+                    'context_distance': delta.CONTEXT_DISTANCE
+                }
+                db.execute_template_sql_from_file("osm_network_delta", params)
+                db.commit()
+                h.info(f"{db.query_one(f'SELECT count(*) FROM {schema}.network_edge_affected')[0]} edges affected by the scenario")
+            h.logEndTask()
+            h.log('closing database connection')
+            db.close()
+            return
+
         # execute "osm_network"
+        db.drop_table('network_edge_affected', schema=schema)
+        db.commit()
         h.logBeginTask('execute "osm_network"')
         if db.handle_conflicting_output_tables(['network_edge', 'network_node']):
             params = {
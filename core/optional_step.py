@@ -1,9 +1,12 @@
 import os
 import subprocess
+from functools import partial
+from typing import List
 
 import toolbox.helper as h
 from core import import_step
 from core.db_step import DbStep
+from core.step_graph import PipelineStep, run_steps
 from settings import DbSettings, GlobalSettings
 from toolbox.dbhelper import PostgresConnection
 
@@ -15,6 +18,10 @@ def import_raster(connection_string: str, path: str, schema: str, table: str, in
 
 
 class DemImporter(DbStep):
+    input_tables = []
+    output_tables = ['data.dem']
+    sql_files = []
+
     def run_step(self, settings: dict):
         h.info('importing dem:')
         h.log(f"using settings: {str(settings)}")
@@ -40,6 +47,10 @@ class DemImporter(DbStep):
 
 
 class NoiseImporter(DbStep):
+    input_tables = []
+    output_tables = ['data.noise']
+    sql_files = []
+
     def run_step(self, settings: dict):
         h.log('importing noise:')
         h.log(f"using settings: {str(settings)}")
@@ -65,6 +76,10 @@ class NoiseImporter(DbStep):
 
 
 class BuildingImporter(DbStep):
+    input_tables = []
+    output_tables = ['data.building']
+    sql_files = []
+
     def run_step(self, settings: dict):
         h.info('importing building')
         h.log(f"using settings: {str(settings)}")
@@ -90,6 +105,10 @@ class BuildingImporter(DbStep):
 
 
 class CrossingImporter(DbStep):
+    input_tables = []
+    output_tables = ['data.crossing']
+    sql_files = []
+
     def run_step(self, settings: dict):
         h.log('importing crossing:')
         h.log(f"using settings: {str(settings)}")
@@ -115,6 +134,10 @@ class CrossingImporter(DbStep):
 
 
 class FacilityImporter(DbStep):
+    input_tables = []
+    output_tables = ['data.facility']
+    sql_files = []
+
     def run_step(self, settings: dict):
         h.log('importing facility:')
         h.log(f"using settings: {str(settings)}")
@@ -140,6 +163,10 @@ class FacilityImporter(DbStep):
 
 
 class GreennessImporter(DbStep):
+    input_tables = []
+    output_tables = ['data.greenness']
+    sql_files = []
+
     def run_step(self, settings: dict):
         h.log('importing greenness:')
         h.log(f"using settings: {str(settings)}")
@@ -165,6 +192,10 @@ class GreennessImporter(DbStep):
 
 
 class WaterImporter(DbStep):
+    input_tables = []
+    output_tables = ['data.water']
+    sql_files = []
+
     def run_step(self, settings: dict):
         h.log('importing water:')
         h.log(f"using settings: {str(settings)}")
@@ -209,7 +240,16 @@ def create_optional_importer(db_settings: DbSettings, import_type: str):
     raise NotImplementedError(f"import type '{import_type}' not implemented")
 
 
-def run_optional_importers(db_settings: DbSettings, optional_importer_settings: dict):
+def create_optional_steps(db_settings: DbSettings, optional_importer_settings: dict) -> List[PipelineStep]:
+    steps = []
     for import_type, settings in optional_importer_settings.items():
         optional_importer = create_optional_importer(db_settings, import_type)
-        optional_importer.run_step(settings)
+        input_tables, output_tables = optional_importer.tables(settings)
+        steps.append(PipelineStep(f"optional {import_type}", partial(optional_importer.run_step, settings), input_tables, output_tables,
+                                  settings, optional_importer.files()))
+    return steps
+
+
+def run_optional_importers(db_settings: DbSettings, optional_importer_settings: dict, max_parallel: int = 1):
+    # the datasets are independent of each other: up to max_parallel of them are imported at the same time
+    run_steps(create_optional_steps(db_settings, optional_importer_settings), max_parallel)
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+from typing import List
+
+import toolbox.helper as h
+from core.step_graph import PipelineStep
+from settings import DbSettings, GlobalSettings
+from toolbox.dbhelper import PostgresConnection
+
+FINGERPRINT_TABLE = "step_fingerprint"
+
+
+def file_fingerprint(path: str, content: bool = True) -> str:
+    """Returns a hash of the contents of the given file - or of its name, size and modification time if content is False
+    (for large data files)."""
+    if not os.path.isfile(path):
+        return f"{path}:missing"
+    if not content:
+        stat = os.stat(path)
+        return f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class StepCache:
+    """Fingerprints of the processing steps, stored in the metadata schema of the database (see settings 'on_existing:
+    update'). A fingerprint covers the settings, data files, code and SQL files of a step and the fingerprints of the
+    steps it depends on: a step is skipped if its fingerprint did not change and its output tables still exist."""
+
+    def __init__(self, db_settings: DbSettings):
+        self.db_settings = db_settings
+        self.schema = db_settings.entities.metadata_schema
+        self.fingerprints = {}
+
+    def _connect(self) -> PostgresConnection:
+        # steps may run at the same time: each call uses its own connection
+        db = PostgresConnection.from_settings_object(self.db_settings)
+        db.connect()
+        db.create_schema(self.schema)
+        db.ex(f"""CREATE TABLE IF NOT EXISTS {self.schema}.{FINGERPRINT_TABLE} (
+            step varchar PRIMARY KEY, fingerprint varchar, tables varchar[], updated timestamp DEFAULT now())""")
+        db.commit()
+        return db
+
+    def _resolve_tables(self, tables: List[str]) -> List[str]:
+        # schema-qualified names of the declared tables (without wildcards)
+        schemas = {'data': self.db_settings.entities.data_schema, 'network': self.db_settings.entities.network_schema}
+        return [f"{schemas[t.split('.')[0]]}.{t.split('.')[1]}" for t in tables if not t.endswith('.*')]
+
+    def _key(self, step: PipelineStep) -> str:
+        # steps are identified by name and by the schemas they write to (e.g. the data schema is shared by several cases)
+        schemas = sorted({table.split('.')[0] for table in self._resolve_tables(step.output_tables)})
+        return f"{step.name}:{','.join(schemas)}"
+
+    def fingerprint(self, step: PipelineStep) -> str:
+        data_files = [value for value in (step.settings or {}).values() if isinstance(value, str) and value
+                      and os.path.isfile(os.path.join(GlobalSettings.data_directory, value))]
+        contents = {
+            'step': step.name,
+            'settings': step.settings,
+            'target_srid': GlobalSettings.get_target_srid(),
+            'base_case_id': GlobalSettings.base_case_id,
+            'data_files': {f: file_fingerprint(os.path.join(GlobalSettings.data_directory, f), content=False) for f in data_files},
+            'files': {f: file_fingerprint(f) for f in step.files},
+            'upstream': {name: self.fingerprints.get(name) for name in step.depends_on}
+        }
+        fingerprint = hashlib.sha256(json.dumps(contents, sort_keys=True, default=str).encode()).hexdigest()
+        self.fingerprints[step.name] = fingerprint
+        return fingerprint
+
+    def is_current(self, step: PipelineStep, fingerprint: str) -> bool:
+        """Returns True if the step was run with the same fingerprint before and all of its output tables still exist.
+        Steps without (non-wildcard) output tables are never skipped."""
+        if not self._resolve_tables(step.output_tables):
+            return False
+        db = self._connect()
+        row = db.query_one(f"SELECT fingerprint, tables FROM {self.schema}.{FINGERPRINT_TABLE} WHERE step = %s", (self._key(step),))
+        current = row is not None and row[0] == fingerprint and all(db.exists(t.split('.')[1], t.split('.')[0]) for t in row[1])
+        if row is not None and not current:
+            h.info(f"step '{step.name}': inputs or output tables changed since the last run")
+        db.close()
+        return current
+
+    def store(self, step: PipelineStep, fingerprint: str):
+        """Records the fingerprint of a finished step together with those of its output tables that exist."""
+        if not self._resolve_tables(step.output_tables):
+            return
+        db = self._connect()
+        tables = [t for t in self._resolve_tables(step.output_tables) if db.exists(t.split('.')[1], t.split('.')[0])]
+        db.ex(f"""INSERT INTO {self.schema}.{FINGERPRINT_TABLE} (step, fingerprint, tables) VALUES (%s, %s, %s)
+            ON CONFLICT (step) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, tables = EXCLUDED.tables, updated = now()""",
+              (self._key(step), fingerprint, tables))
+        db.commit()
+        db.close()
+
+    def run(self, step: PipelineStep):
+        """Runs the step unless its fingerprint is unchanged (see is_current)."""
+        fingerprint = self.fingerprint(step)
+        if self.is_current(step, fingerprint):
+            h.majorInfo(f" === skipping step '{step.name}' (unchanged since the last run) ===")
+            return
+        step.run()
+        self.store(step, fingerprint)
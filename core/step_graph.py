@@ -0,0 +1,81 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, List
+
+import toolbox.helper as h
+
+
+@dataclass
+class PipelineStep:
+    name: str
+    run: Callable[[], None]
+    input_tables: List[str]
+    output_tables: List[str]
+    settings: dict = None
+    files: List[str] = field(default_factory=list)  # code and SQL files the results depend on (see core/step_cache.py)
+    depends_on: List[str] = field(default_factory=list)
+
+
+def tables_overlap(tables: List[str], other_tables: List[str]) -> bool:
+    """Returns True if both lists share a table - "<schema>.*" matches all tables of the schema."""
+    for table in tables:
+        for other in other_tables:
+            if table == other:
+                return True
+            if table.endswith('.*') and other.startswith(table[:-1]) or other.endswith('.*') and table.startswith(other[:-1]):
+                return True
+    return False
+
+
+def add_dependencies(steps: List[PipelineStep]) -> None:
+    """Derives the dependencies of the steps (given in the order of a serial run) from their tables: a step depends on
+    each previous step that writes a table it reads or writes, or that reads a table it writes. Running the steps in
+    any order respecting these dependencies thus gives the same result as running them one after another."""
+    for i, step in enumerate(steps):
+        for previous in steps[:i]:
+            if tables_overlap(step.input_tables + step.output_tables, previous.output_tables) \
+                    or tables_overlap(step.output_tables, previous.input_tables):
+                step.depends_on.append(previous.name)
+
+
+def run_steps(steps: List[PipelineStep], max_parallel: int = 1, cache=None) -> None:
+    """Runs the steps (given in the order of a serial run) respecting their dependencies (see add_dependencies).
+    Up to max_parallel independent steps run at the same time, each in its own thread - steps lease their own database
+    connection (see dbhelper.ConnectionPool). If a step fails, no further steps are started and the error is raised once the running steps finished.
+    If a StepCache is given, steps are only run if their inputs changed since the last run (see core/step_cache.py)."""
+    add_dependencies(steps)
+    h.log("step dependencies: " + ", ".join(f"{s.name} <- [{', '.join(s.depends_on)}]" for s in steps))
+    run = cache.run if cache is not None else lambda step: step.run()
+    if max_parallel <= 1:
+        for step in steps:
+            run(step)
+        return
+
+    h.info(f"running up to {max_parallel} independent steps in parallel")
+    done = set()
+    pending = list(steps)
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        while pending or running:
+            # start the ready steps in their serial order
+            for step in list(pending):
+                if error is not None or len(running) >= max_parallel:
+                    break
+                if all(name in done for name in step.depends_on):
+                    h.log(f"starting step '{step.name}'")
+                    running[executor.submit(run, step)] = step
+                    pending.remove(step)
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                if future.exception() is not None:
+                    h.majorInfo(f"step '{step.name}' failed: {future.exception()}")
+                    error = error or future.exception()
+                else:
+                    h.log(f"step '{step.name}' finished")
+                    done.add(step.name)
+    if error is not None:
+        raise error
@@ -1,37 +1,25 @@
 import argparse
+import os
 import sys
 import yaml
 import re
+from datetime import datetime as dt
 from typing import List
 
+import toolbox.dbhelper as dbhelper
 import toolbox.helper as h
 from core.attributes_step import create_attributes_step
 from core.db_step import DbStep
+from core.ensemble_step import create_ensemble_step
 from core.export_step import create_exporter
 from core.import_step import create_importer
-from core.index_step import generate_index, load_profiles
+from core.index_step import ModeProfile, generate_index, load_profiles
 from core.network_step import create_network_step
-from core.optional_step import run_optional_importers
+from core.optional_step import create_optional_steps
+from core.step_cache import StepCache
+from core.step_graph import PipelineStep, run_steps
 from settings import DbSettings, GlobalSettings
 
-parser = argparse.ArgumentParser(description='TODO: add description')
-parser.add_argument('settings_file', type=argparse.FileType('r', encoding='utf-8'),
-                    help='TODO: write detailed description here')
-parser.add_argument('--skip', nargs='+', choices=['import', 'optional', 'network', 'attributes', 'index', 'export'],
-                    help='skip one or more of these steps - e.g. "--skip import optional"')
-parser.add_argument('--loglevel', nargs=1, choices=["1", "2", "3", "4"],
-                    help="Sets the level of debug outputs on the console: 1=MajorInfo, 2=Info, 3=Detailed, 4=Debug")
-
-args = parser.parse_args()
-settings_stream = args.settings_file
-skip_steps = args.skip or []
-base_path = settings_stream.name.rsplit('/', 1)[0]
-if args.loglevel:
-    h.verbose_level = int(args.loglevel[0])
-    h.majorInfo(f"using log level {h.verbose_level}")
-
-h.info(f'loading {settings_stream.name}')
-h.info(f'skip steps: {str(skip_steps)}')
 
 def require_allowed_value(setting_value: str, setting_name: str, allowed: List[str]):
     for value in allowed:
@@ -49,8 +37,13 @@ def require_on_existing_setting(settings: dict):
     require_allowed_value(settings['on_existing'], 'on_existing', ['skip', 'delete', 'abort'])
 
 
-with settings_stream:
-    settings: dict = yaml.safe_load(settings_stream)
+def apply_global_settings(settings: dict):
+    # global settings are class attributes: reset them, so that consecutive runs in one process do not share them
+    GlobalSettings.custom_srid = None
+    GlobalSettings.case_id = "default_net"
+    GlobalSettings.base_case_id = None
+    GlobalSettings.max_parallel_steps = 1
+    GlobalSettings.sql_profile = None
 
     # process global settings if given
     if h.has_keys(settings, ['global']):
@@ -60,68 +53,154 @@ with settings_stream:
             h.info(f"Set the target SRID to {GlobalSettings.get_target_srid()}")
         if h.has_keys(global_settings, ['case_id']):
             GlobalSettings.case_id = re.sub("[^a-zA-Z0-9_]", "", str(global_settings['case_id']))
-    
+        if h.has_keys(global_settings, ['base_case_id']):
+            GlobalSettings.base_case_id = re.sub("[^a-zA-Z0-9_]", "", str(global_settings['base_case_id']))
+        if h.has_keys(global_settings, ['max_parallel_steps']):
+            GlobalSettings.max_parallel_steps = max(1, int(global_settings['max_parallel_steps']))
+            h.info(f"Running up to {GlobalSettings.max_parallel_steps} independent steps at the same time")
+        if h.has_keys(global_settings, ['sql_profile']):
+            GlobalSettings.sql_profile = str(global_settings['sql_profile']).replace("<case_id>", GlobalSettings.case_id)
+
+
+def db_pipeline_step(name: str, message: str, step: DbStep, step_settings: dict) -> PipelineStep:
+    input_tables, output_tables = step.tables(step_settings)
+
+    def run():
+        h.majorInfo(message)
+        step.run_step(step_settings)
+    return PipelineStep(name, run, input_tables, output_tables, step_settings, step.files())
+
+
+def report_sql_profile(top: int = 10):
+    # lists the slowest SQL template statements of the run and writes all of them to the file given in the global settings
+    if not dbhelper.sql_profile:
+        return
+    h.info(f"slowest of {len(dbhelper.sql_profile)} SQL template statements:")
+    for s in sorted(dbhelper.sql_profile, key=lambda s: s['seconds'], reverse=True)[:top]:
+        h.info(f"{h.secondsToStr(s['seconds'], detailed=True)}  {s['template']} #{s['statement']}: {s['label']} ({s['rows']} rows)")
+    if GlobalSettings.sql_profile:
+        path = os.path.join(GlobalSettings.data_directory, GlobalSettings.sql_profile)
+        dbhelper.write_sql_profile(path, {'case_id': GlobalSettings.case_id, 'finished': dt.now().isoformat(timespec='seconds')})
+        h.info(f"SQL profile written to '{path}'")
+
+
+def run_pipeline(settings: dict, base_path: str, skip_steps: List[str] = None, profiles: List[ModeProfile] = None):
+    """Runs all processing steps for the given (parsed) settings file. Mode profile files are loaded relative to base_path
+    unless already loaded profiles are given (e.g. when running several scenarios in one process)."""
+    skip_steps = skip_steps or []
+    apply_global_settings(settings)
+
     db_settings: DbSettings = DbSettings.from_dict(settings.get('database'))
 
     # check if all required sections are present first before taking any actions
     if 'import' not in skip_steps:
         h.require_keys(settings, ['import'], 'error: section missing:')
-    if 'export' not in skip_steps:
+    if 'export' not in skip_steps and 'ensemble' not in settings:
         h.require_keys(settings, ['export'], 'error: section missing:')
     if 'index' not in skip_steps:
         h.require_keys(settings, ['profiles'], 'error: section missing:')
 
-    # execute processing steps
+    # replicates of an ensemble share one scenario data schema: only the ways changed by the previous replicate are restored
+    if 'ensemble' in settings and h.has_keys(settings, ['import']) and h.has_keys(settings['ensemble'], ['name']):
+        settings['import'].setdefault('scenario_schema', db_settings.entities.get_ensemble_data_schema(settings['ensemble']['name']))
+
+    # build the processing steps: steps that do not share tables may run at the same time (see core/step_graph.py)
+    steps: List[PipelineStep] = []
     if 'import' not in skip_steps:
-        h.majorInfo(' === importing ===')
         import_settings: dict = settings['import']
         h.require_keys(import_settings, ['type'], 'error: import section is missing:')
         require_on_existing_setting(import_settings)
         importer: DbStep = create_importer(db_settings, import_settings['type'])
-        importer.run_step(import_settings)
+        steps.append(db_pipeline_step('import', ' === importing ===', importer, import_settings))
     else:
         h.majorInfo(' === skipping import ===')
 
     if 'optional' not in skip_steps and 'optional' in settings:
-        h.majorInfo(' === running optional importers ===')
-        run_optional_importers(db_settings, settings.get('optional'))
+        steps += create_optional_steps(db_settings, settings.get('optional'))
 
     if 'network' not in skip_steps and 'import' in settings:
         # TODO: specify settings key that is needed by the network step
-        h.majorInfo(' === running network step ===')
         # TODO: add error handling for import_settings
         # TODO: code repetition
         import_settings: dict = settings['import']
         h.require_keys(import_settings, ['type'], 'error: import section is missing:')
         require_on_existing_setting(import_settings)
         network_step: DbStep = create_network_step(db_settings, import_settings['type'])
-        network_step.run_step(import_settings)
+        steps.append(db_pipeline_step('network', ' === running network step ===', network_step, import_settings))
 
     if 'attributes' not in skip_steps and 'import' in settings:
         # TODO: specify settings key that is needed by the attributes step
-        h.majorInfo(' === running attributes step ===')
         # TODO: add error handling for import_settings
         # TODO: code repetition
         import_settings: dict = settings['import']
         h.require_keys(import_settings, ['type'], 'error: import section is missing:')
         require_on_existing_setting(import_settings)
         attributes_step: DbStep = create_attributes_step(db_settings, import_settings['type'])
-        attributes_step.run_step(import_settings)
+        steps.append(db_pipeline_step('attributes', ' === running attributes step ===', attributes_step, import_settings))
 
     if 'index' not in skip_steps:
-        h.majorInfo(' === generating index ===')
-        mode_profile_settings: dict = settings['profiles']
-        profiles = load_profiles(base_path, mode_profile_settings)
+        if profiles is None:
+            mode_profile_settings: dict = settings['profiles']
+            profiles = load_profiles(base_path, mode_profile_settings)
         index_settings: dict = None
         if h.has_keys(settings, ['index']):
             index_settings = settings['index']
-        generate_index(db_settings, profiles, index_settings)
 
-    if 'export' not in skip_steps:
-        h.majorInfo(' === exporting ===')
+        def run_index_step():
+            h.majorInfo(' === generating index ===')
+            generate_index(db_settings, profiles, index_settings)
+        profile_settings = [{'name': p.profile_name, 'profile': p.profile, 'access': [p.access_car, p.access_bike, p.access_walk]} for p in profiles]
+        steps.append(PipelineStep('index', run_index_step, ['network.*'], ['network.network_edge_index', 'network.export_edge', 'network.export_node', 'network.*'],
+                                  {'index': index_settings, 'profiles': profile_settings},
+                                  ['core/index_step.py', 'core/delta.py', 'sql/functions/calculate_index.sql.j2', 'sql/templates/index.sql.j2', 'sql/templates/export.sql.j2']))
+
+    if 'ensemble' in settings:
+        # replicates of an ensemble are not exported: only their index deltas are kept
+        ensemble_step: DbStep = create_ensemble_step(db_settings)
+        steps.append(db_pipeline_step('ensemble', ' === collecting ensemble replicate ===', ensemble_step, settings['ensemble']))
+    elif 'export' not in skip_steps:
         export_settings: dict = settings['export']
         h.require_keys(export_settings, ['type'], 'error: export section is missing:')
         exporter: DbStep = create_exporter(db_settings, export_settings['type'])
-        exporter.run_step(export_settings)
+        steps.append(db_pipeline_step('export', ' === exporting ===', exporter, export_settings))
     else:
         h.majorInfo('skipping export (as listed in skip_steps)')
+
+    # execute processing steps - with 'on_existing: update', steps whose inputs did not change since the last run are skipped
+    # all steps lease their database connections from one pool: room for each running step and the step cache
+    db_settings.tuning = dbhelper.tuning_profile(db_settings.tuning, GlobalSettings.max_parallel_steps)
+    h.log(f"database session settings: {db_settings.tuning or 'server defaults'}")
+    db_settings.pool = dbhelper.ConnectionPool(db_settings, 2 * GlobalSettings.max_parallel_steps + 1)
+    cache = StepCache(db_settings) if db_settings.on_existing == 'update' else None
+    dbhelper.sql_profile.clear()
+    try:
+        run_steps(steps, GlobalSettings.max_parallel_steps, cache)
+    finally:
+        report_sql_profile()
+        db_settings.pool.close()
+        db_settings.pool = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='TODO: add description')
+    parser.add_argument('settings_file', type=argparse.FileType('r', encoding='utf-8'),
+                        help='TODO: write detailed description here')
+    parser.add_argument('--skip', nargs='+', choices=['import', 'optional', 'network', 'attributes', 'index', 'export'],
+                        help='skip one or more of these steps - e.g. "--skip import optional"')
+    parser.add_argument('--loglevel', nargs=1, choices=["1", "2", "3", "4"],
+                        help="Sets the level of debug outputs on the console: 1=MajorInfo, 2=Info, 3=Detailed, 4=Debug")
+
+    args = parser.parse_args()
+    settings_stream = args.settings_file
+    skip_steps = args.skip or []
+    base_path = settings_stream.name.rsplit('/', 1)[0]
+    if args.loglevel:
+        h.verbose_level = int(args.loglevel[0])
+        h.majorInfo(f"using log level {h.verbose_level}")
+
+    h.info(f'loading {settings_stream.name}')
+    h.info(f'skip steps: {str(skip_steps)}')
+
+    with settings_stream:
+        settings: dict = yaml.safe_load(settings_stream)
+    run_pipeline(settings, base_path, skip_steps)
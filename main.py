@@ -3,10 +3,27 @@ import sys
 import platform
 import time
 import argparse
+import bz2
+import gzip
 import xml.etree.ElementTree as ET
 import os
 import re
 import random
+import hashlib
+import json
+import lzma
+import math
+import mmap
+import struct
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import deque
+from multiprocessing import Pool
+from contextlib import ExitStack
+from xml.sax.saxutils import quoteattr
+
+from settings import DbEntitySettings
  
 def print_manual():
     manual = """
@@ -45,9 +62,14 @@ Conditional Rules:
      OR, to check for the absence/presence of a tag:
          NOTEXISTS <tag_key>
          EXISTS <tag_key>
+     OR, to check whether at least one node of the way lies within an area:
+         WITHIN <min_lon>,<min_lat>,<max_lon>,<max_lat>
+         WITHIN <file.geojson>
+     (the GeoJSON file holds a Polygon or MultiPolygon geometry, feature or feature collection in WGS 84)
   - The THEN action and optional ELSE action can be any of the operations above (ASSIGN, INCREMENT, DECREMENT, ADD, REMOVE, UPDATE).
   Example:
        IF LANES>1 AND NOTEXISTS HEIGHT THEN ADD HEIGHT=5 ELSE UPDATE LANES TO 2
+       IF EXISTS parking:both AND WITHIN 16.36,48.20,16.38,48.22 THEN REMOVE parking:both
  
 Frequency-based Execution:
   You can append a frequency specifier to any rule to have it applied only a fraction of the times.
@@ -56,10 +78,12 @@ Frequency-based Execution:
   For example:
        UPDATE MAXSPEED TO 50 FREQ 0.5/1
   This means the update will be applied approximately 50% of the times.
+  Which ways are chosen depends on the seed (--seed): the same seed always chooses the same ways.
  
 Notes:
- - All commands must be written in CAPITALS where specified (e.g. IF, THEN, ELSE, ADD, REMOVE, UPDATE, EXISTS, NOTEXISTS, FREQ, AND, OR).
+ - All commands must be written in CAPITALS where specified (e.g. IF, THEN, ELSE, ADD, REMOVE, UPDATE, EXISTS, NOTEXISTS, WITHIN, FREQ, AND, OR).
  - Frequency rules work with both unconditional and conditional operations.
+ - In conditions, the key osm_id refers to the id of the way (e.g. IF osm_id == 6503856 THEN REMOVE parking:both), unless the way has its own osm_id tag.
 """
     print(manual)
     sys.exit(0)
@@ -192,86 +216,89 @@ def parse_action(action_string, original_line):
     print(f"Error: Invalid action in rule: {original_line}")
     sys.exit(1)
 
-def execute_atomic_action(way, action):
+def compile_atomic_action(action):
     """
-    Executes an atomic action on the given way.
-    Returns True if the way is modified, False otherwise.
+    Compile an atomic action into a callable that is executed on a WayTags index.
+    The callable returns True if the way is modified, False otherwise.
     """
     key = action.get('key')
+    value = action.get('value')
     action_type = action.get('action_type')
     if action_type == 'ASSIGN':
-        tags = way.findall(f"tag[@k='{key}']")
-        if tags:
-            tags[0].set('v', action.get('value'))
-            return True
-        return False
+        def assign(tags):
+            if key in tags.values:
+                tags.set(key, value)
+                return True
+            return False
+        return assign
     elif action_type in ('INCREMENT', 'DECREMENT'):
-        tags = way.findall(f"tag[@k='{key}']")
-        if tags:
+        try:
+            mod_value = float(value)
+        except ValueError:
+            mod_value = None
+        def modify(tags):
+            current_value = tags.values.get(key)
+            if current_value is None:
+                return False
             try:
-                current_value = float(tags[0].get('v'))
-                mod_value = float(action.get('value'))
+                if mod_value is None:
+                    raise ValueError()
+                current_value = float(current_value)
                 new_value = current_value + mod_value if action_type == 'INCREMENT' else current_value - mod_value
-                tags[0].set('v', str(new_value))
+                tags.set(key, str(new_value))
                 return True
             except ValueError:
-                print(f"Warning: Skipping {action_type} for non-numeric '{key}' in way {way.get('id')}")
+                print(f"Warning: Skipping {action_type} for non-numeric '{key}' in way {tags.way_id}")
                 return False
-        return False
+        return modify
     elif action_type == 'ADD':
-        tags = way.findall(f"tag[@k='{key}']")
-        if not tags:
-            new_tag = ET.SubElement(way, 'tag')
-            new_tag.set('k', key)
-            new_tag.set('v', action.get('value'))
-            return True
-        return False
+        def add(tags):
+            if key not in tags.values:
+                tags.set(key, value)
+                return True
+            return False
+        return add
     elif action_type == 'REMOVE':
-        tags = way.findall(f"tag[@k='{key}']")
-        if tags:
-            for tag in tags:
-                way.remove(tag)
-            return True
-        return False
+        def remove(tags):
+            if key in tags.values:
+                tags.remove(key)
+                return True
+            return False
+        return remove
     elif action_type == 'UPDATE':
-        tags = way.findall(f"tag[@k='{key}']")
-        if tags:
-            tags[0].set('v', action.get('value'))
-        else:
-            new_tag = ET.SubElement(way, 'tag')
-            new_tag.set('k', key)
-            new_tag.set('v', action.get('value'))
-        return True
+        def update(tags):
+            tags.set(key, value)
+            return True
+        return update
     elif action_type == 'DONOTHING':
-        return False
+        return lambda tags: False
     else:
         print(f"Error: Unknown action type: {action_type}")
         sys.exit(1)
 
-def execute_action_ast(way, ast):
+def compile_action_ast(ast):
     """
-    Recursively execute an action expression AST on the given way.
-    For an atomic node, execute the atomic action.
-    For an AND node, execute both sides sequentially.
-    For an OR node, execute the left side and, if it returns False, execute the right side.
-    Returns True if the action (or chosen alternative) modifies the way.
+    Recursively compile an action expression AST into a single callable.
+    For an atomic node, the atomic action is compiled.
+    For an AND node, both sides are executed sequentially.
+    For an OR node, the left side is executed and, if it returns False, the right side.
+    The callable returns True if the action (or chosen alternative) modifies the way.
     """
     if ast.get("type") == "atomic":
-        return execute_atomic_action(way, ast["action"])
+        return compile_atomic_action(ast["action"])
     elif "op" in ast:
-        op = ast["op"]
-        if op == "AND":
-            left_res = execute_action_ast(way, ast["left"])
-            right_res = execute_action_ast(way, ast["right"])
-            return left_res and right_res
-        elif op == "OR":
-            left_res = execute_action_ast(way, ast["left"])
-            if left_res:
-                return True
-            return execute_action_ast(way, ast["right"])
-    else:
-        print("Error: Invalid AST node in action expression")
-        sys.exit(1)
+        left = compile_action_ast(ast["left"])
+        right = compile_action_ast(ast["right"])
+        if ast["op"] == "AND":
+            def execute_and(tags):
+                left_res = left(tags)
+                right_res = right(tags)
+                return left_res and right_res
+            return execute_and
+        elif ast["op"] == "OR":
+            return lambda tags: left(tags) or right(tags)
+    print("Error: Invalid AST node in action expression")
+    sys.exit(1)
 
 ###########################
 # Condition Parsing and Evaluation
@@ -309,58 +336,87 @@ def parse_conditions(conditions_str, original_line):
         sys.exit(1)
     return shunting_yard(tokens)
 
-def evaluate_single_condition(way, condition_str, original_line):
+# pseudo tag key that refers to the id of the way in conditions (unless the way has an explicit 'osm_id' tag)
+OSM_ID_KEY = 'osm_id'
+
+NUMERIC_COMPARISONS = {
+    '>': lambda a, b: a > b,
+    '<': lambda a, b: a < b,
+    '>=': lambda a, b: a >= b,
+    '<=': lambda a, b: a <= b,
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+}
+
+def split_condition(condition_str, original_line):
     """
-    Evaluate a single condition string against the provided way.
-    Supported forms:
-      - NOTEXISTS <tag_key>
-      - EXISTS <tag_key>
-      - <tag_key> [==, !=, >=, <=, >, <] <value>
+    Split a single condition string into its parts.
+    Returns a tuple (operator, tag_key, value), where operator is NOTEXISTS, EXISTS, WITHIN or a comparison
+    operator and value is None for NOTEXISTS/EXISTS. For WITHIN, tag_key is None and value is the area.
     Exits if the condition is invalid.
     """
     if condition_str.startswith("NOTEXISTS "):
-        tag_key = condition_str[len("NOTEXISTS "):].strip()
-        return (len(way.findall(f"tag[@k='{tag_key}']")) == 0)
+        return "NOTEXISTS", condition_str[len("NOTEXISTS "):].strip(), None
     if condition_str.startswith("EXISTS "):
-        tag_key = condition_str[len("EXISTS "):].strip()
-        return (len(way.findall(f"tag[@k='{tag_key}']")) == 1)
+        return "EXISTS", condition_str[len("EXISTS "):].strip(), None
+    if condition_str.startswith("WITHIN "):
+        return "WITHIN", None, condition_str[len("WITHIN "):].strip()
     m = re.match(r'^(\S+)\s*(==|!=|>=|<=|>|<)\s*(\S+)$', condition_str)
     if not m:
         print(f"Error: Invalid condition '{condition_str}' in rule: {original_line}")
         sys.exit(1)
     cond_key, cond_op, cond_value = m.groups()
-    tags = way.findall(f"tag[@k='{cond_key}']")
-    if not tags:
-        return False
-    tag_val = tags[0].get('v')
+    return cond_op, cond_key, cond_value
+
+def compile_single_condition(condition_str, original_line):
+    """
+    Compile a single condition string into a callable that is evaluated on a WayTags index.
+    Supported forms:
+      - NOTEXISTS <tag_key>
+      - EXISTS <tag_key>
+      - <tag_key> [==, !=, >=, <=, >, <] <value>
+      - WITHIN <bbox or GeoJSON file>
+    Comparisons on the key 'osm_id' fall back to the id of the way if it has no such tag.
+    Exits if the condition is invalid.
+    """
+    cond_op, cond_key, cond_value = split_condition(condition_str, original_line)
+    if cond_op == "WITHIN":
+        area = load_area(cond_value, original_line)
+        return area.contains_way
+    if cond_op == "NOTEXISTS":
+        return lambda tags: cond_key not in tags.values
+    if cond_op == "EXISTS":
+        return lambda tags: tags.exists(cond_key)
+    compare = NUMERIC_COMPARISONS[cond_op]
     try:
-        tag_val_num = float(tag_val)
         cond_val_num = float(cond_value)
-        if cond_op == '>':
-            return tag_val_num > cond_val_num
-        elif cond_op == '<':
-            return tag_val_num < cond_val_num
-        elif cond_op == '>=':
-            return tag_val_num >= cond_val_num
-        elif cond_op == '<=':
-            return tag_val_num <= cond_val_num
-        elif cond_op == '==':
-            return tag_val_num == cond_val_num
-        elif cond_op == '!=':
-            return tag_val_num != cond_val_num
     except ValueError:
+        cond_val_num = None
+    if cond_val_num is None and cond_op not in ('==', '!='):
+        print(f"Error: Non-numeric comparison for '{cond_key}' in rule: {original_line}")
+        sys.exit(1)
+
+    def condition(tags):
+        tag_val = tags.values.get(cond_key, tags.way_id if cond_key == OSM_ID_KEY else None)
+        if tag_val is None:
+            return False
+        if cond_val_num is not None:
+            try:
+                return compare(float(tag_val), cond_val_num)
+            except ValueError:
+                pass
         if cond_op == '==':
             return tag_val == cond_value
         elif cond_op == '!=':
             return tag_val != cond_value
-        else:
-            print(f"Error: Non-numeric comparison for '{cond_key}' in rule: {original_line}")
-            sys.exit(1)
+        print(f"Error: Non-numeric comparison for '{cond_key}' in rule: {original_line}")
+        sys.exit(1)
+    return condition
 
-def evaluate_rpn(way, rpn_tokens, original_line):
+def compile_conditions(rpn_tokens, original_line):
     """
-    Evaluate the RPN expression (list of condition tokens and operators) for the given way.
-    Returns True or False.
+    Compile the RPN expression (list of condition tokens and operators) into a single callable
+    that returns True or False for a WayTags index.
     Exits if the expression is invalid.
     """
     stack = []
@@ -372,17 +428,334 @@ def evaluate_rpn(way, rpn_tokens, original_line):
             b = stack.pop()
             a = stack.pop()
             if token == "AND":
-                stack.append(a and b)
+                stack.append(lambda tags, a=a, b=b: a(tags) and b(tags))
             else:
-                stack.append(a or b)
+                stack.append(lambda tags, a=a, b=b: a(tags) or b(tags))
         else:
-            result = evaluate_single_condition(way, token, original_line)
-            stack.append(result)
+            stack.append(compile_single_condition(token, original_line))
     if len(stack) != 1:
         print(f"Error: Invalid condition expression in rule: {original_line}")
         sys.exit(1)
     return stack[0]
 
+###########################
+# Way Tag Index
+###########################
+
+class WayTags:
+    """
+    Key -> value index over the tags of a single way, shared by all rules applied to that way.
+    Changed keys are recorded so that only their tags are written back to the way element.
+    For WITHIN conditions, the node references of the way are resolved with a NodeIndex on first use.
+    """
+    __slots__ = ('way_id', 'values', 'duplicates', 'changed', 'refs', 'nodes', '_coordinates', 'bbox')
+
+    def __init__(self, way_id, tag_pairs, refs=None, nodes=None):
+        self.way_id = way_id
+        self.values = {}
+        self.duplicates = set()  # keys that occur more than once on the way
+        self.changed = {}        # modified keys (in order of modification) -> original value (None if not present)
+        self.refs = refs         # node ids of the way (only given if a rule has a WITHIN condition)
+        self.nodes = nodes       # NodeIndex of the input file
+        self._coordinates = None
+        self.bbox = None         # (min_lon, min_lat, max_lon, max_lat) of the way's nodes
+        for key, value in tag_pairs:
+            if key in self.values:
+                self.duplicates.add(key)
+            else:
+                self.values[key] = value
+
+    def exists(self, key):
+        return key in self.values and key not in self.duplicates
+
+    def coordinates(self):
+        """
+        Return the (lon, lat) coordinates of the way's nodes (see NodeIndex) and compute the bounding box of the way.
+        Nodes missing in the input file are left out.
+        """
+        if self._coordinates is None:
+            if self.nodes is None or not self.refs:
+                self._coordinates = []
+            else:
+                self._coordinates = self.nodes.coordinates(self.refs)
+            if self._coordinates:
+                lons = [lon for lon, _ in self._coordinates]
+                lats = [lat for _, lat in self._coordinates]
+                self.bbox = (min(lons), min(lats), max(lons), max(lats))
+        return self._coordinates
+
+    def set(self, key, value):
+        if key not in self.changed:
+            self.changed[key] = self.values.get(key)
+        self.values[key] = value
+
+    def remove(self, key):
+        if key not in self.changed:
+            self.changed[key] = self.values.get(key)
+        del self.values[key]
+        self.duplicates.discard(key)
+
+    def changes(self):
+        """
+        Return the net tag changes as a list of (key, old value, new value) tuples, where None stands for a missing tag.
+        Keys that end up with their original value again are left out.
+        """
+        values = self.values
+        return [(key, old, values.get(key)) for key, old in self.changed.items() if values.get(key) != old]
+
+    def updated_pairs(self, tag_pairs):
+        """
+        Return the given (key, value) tag pairs of the way with the changed keys updated, in the same order
+        as write_back writes the tags of a way element.
+        """
+        pairs = []
+        written = set()
+        for key, value in tag_pairs:
+            if key in self.changed:
+                if key in self.values and key not in written:
+                    pairs.append((key, self.values[key]))
+                    written.add(key)
+                continue
+            pairs.append((key, value))
+        for key in self.changed:
+            if key in self.values and key not in written:
+                pairs.append((key, self.values[key]))
+        return pairs
+
+    def write_back(self, way):
+        """
+        Write the changed keys back to the way element. Tags of unchanged keys are left untouched.
+        Returns True if the way element was modified.
+        """
+        if not self.changed:
+            return False
+        children = []
+        written = set()
+        for child in way:
+            if child.tag == 'tag':
+                key = child.get('k')
+                if key in self.changed:
+                    if key in self.values and key not in written:
+                        new_tag = ET.Element('tag', {'k': key, 'v': self.values[key]})
+                        new_tag.tail = child.tail
+                        children.append(new_tag)
+                        written.add(key)
+                    continue
+            children.append(child)
+        for key in self.changed:
+            if key in self.values and key not in written:
+                children.append(ET.Element('tag', {'k': key, 'v': self.values[key]}))
+        way[:] = children
+        return True
+
+###########################
+# Spatial Conditions
+###########################
+
+# Coordinates are handled as integers in units of 100 nanodegrees (as in OSM PBF files), so that the node index
+# is compact and the spatial tests compare integers only.
+COORDINATE_FACTOR = 10**7
+BBOX_PATTERN = re.compile(r'^(-?[\d.]+),(-?[\d.]+),(-?[\d.]+),(-?[\d.]+)$')
+NODE_TAG_PATTERN = re.compile(rb'<node\s[^>]*>')
+NODE_ATTRIBUTE_PATTERN = re.compile(rb'\s(id|lat|lon)=["\']([^"\']*)["\']')
+
+def to_coordinate(degrees):
+    return round(float(degrees) * COORDINATE_FACTOR)
+
+class NodeIndex:
+    """
+    Compact index of the node coordinates of an OSM file for WITHIN conditions: node ids, longitudes and latitudes
+    in three parallel arrays sorted by id (24 bytes per node and no Python object per node). Nodes are looked up
+    with a binary search. Nodes are added while the file is read (they precede the ways).
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.lons = array('i')
+        self.lats = array('i')
+        self.sorted = True
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, node_id, lon, lat):
+        ids = self.ids
+        if ids and node_id <= ids[-1]:
+            self.sorted = False
+        ids.append(node_id)
+        self.lons.append(lon)
+        self.lats.append(lat)
+
+    def add_element(self, elem):
+        self.add(int(elem.get('id')), to_coordinate(elem.get('lon')), to_coordinate(elem.get('lat')))
+
+    def add_xml(self, data):
+        """
+        Add all <node> elements of a part of an OSM XML file (bytes) without parsing it as a tree.
+        """
+        for m in NODE_TAG_PATTERN.finditer(data):
+            attributes = dict(NODE_ATTRIBUTE_PATTERN.findall(m.group()))
+            if b'id' in attributes and b'lat' in attributes and b'lon' in attributes:
+                self.add(int(attributes[b'id']), to_coordinate(attributes[b'lon']), to_coordinate(attributes[b'lat']))
+
+    def add_arrays(self, ids, lons, lats):
+        if len(ids) and len(self.ids) and ids[0] <= self.ids[-1]:
+            self.sorted = False
+        self.ids.extend(ids)
+        self.lons.extend(lons)
+        self.lats.extend(lats)
+
+    def sort(self):
+        # OSM files are usually sorted by id: the arrays only have to be sorted for unsorted input
+        if self.sorted:
+            return
+        order = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+        self.ids = array('q', (self.ids[i] for i in order))
+        self.lons = array('i', (self.lons[i] for i in order))
+        self.lats = array('i', (self.lats[i] for i in order))
+        self.sorted = True
+
+    def coordinates(self, refs):
+        """
+        Return the (lon, lat) coordinates of the given node ids that are in the index.
+        """
+        self.sort()
+        ids, lons, lats = self.ids, self.lons, self.lats
+        count = len(ids)
+        coordinates = []
+        for ref in refs:
+            i = bisect_left(ids, ref)
+            if i < count and ids[i] == ref:
+                coordinates.append((lons[i], lats[i]))
+        return coordinates
+
+class BoundingBoxArea:
+    """
+    Area of a WITHIN condition given as bounding box (min_lon,min_lat,max_lon,max_lat in degrees).
+    """
+
+    def __init__(self, min_lon, min_lat, max_lon, max_lat):
+        self.degrees = (min_lon, min_lat, max_lon, max_lat)
+        self.bbox = tuple(to_coordinate(value) for value in self.degrees)
+
+    def contains_way(self, tags):
+        """
+        True if at least one node of the way (WayTags) lies within the area.
+        """
+        coordinates = tags.coordinates()
+        if not coordinates:
+            return False
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        way_min_lon, way_min_lat, way_max_lon, way_max_lat = tags.bbox
+        if way_max_lon < min_lon or way_min_lon > max_lon or way_max_lat < min_lat or way_min_lat > max_lat:
+            return False
+        if way_min_lon >= min_lon and way_max_lon <= max_lon and way_min_lat >= min_lat and way_max_lat <= max_lat:
+            return True
+        return any(min_lon <= lon <= max_lon and min_lat <= lat <= max_lat for lon, lat in coordinates)
+
+    def sql(self):
+        return "ST_MakeEnvelope({}, {}, {}, {}, 4326)".format(*(repr(value) for value in self.degrees))
+
+class PolygonArea:
+    """
+    Area of a WITHIN condition given as (multi)polygon of a GeoJSON file. Nodes are tested with the even-odd rule
+    on all rings of a polygon (so holes are excluded), but only if the bounding boxes of the way and area overlap.
+    """
+
+    def __init__(self, polygons):
+        self.polygons = polygons  # list of polygons, each a list of rings of (lon, lat) pairs in degrees
+        self.rings = [[[(to_coordinate(lon), to_coordinate(lat)) for lon, lat, *_ in ring] for ring in polygon] for polygon in polygons]
+        points = [point for polygon in self.rings for ring in polygon for point in ring]
+        self.bbox = (min(p[0] for p in points), min(p[1] for p in points), max(p[0] for p in points), max(p[1] for p in points))
+
+    def contains_point(self, lon, lat):
+        for polygon in self.rings:
+            inside = False
+            for ring in polygon:
+                j = len(ring) - 1
+                for i in range(len(ring)):
+                    lon_i, lat_i = ring[i]
+                    lon_j, lat_j = ring[j]
+                    if (lat_i > lat) != (lat_j > lat) and lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+                        inside = not inside
+                    j = i
+            if inside:
+                return True
+        return False
+
+    def contains_way(self, tags):
+        """
+        True if at least one node of the way (WayTags) lies within the area.
+        """
+        coordinates = tags.coordinates()
+        if not coordinates:
+            return False
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        way_min_lon, way_min_lat, way_max_lon, way_max_lat = tags.bbox
+        if way_max_lon < min_lon or way_min_lon > max_lon or way_max_lat < min_lat or way_min_lat > max_lat:
+            return False
+        return any(min_lon <= lon <= max_lon and min_lat <= lat <= max_lat and self.contains_point(lon, lat)
+                   for lon, lat in coordinates)
+
+    def sql(self):
+        geometry = json.dumps({'type': 'MultiPolygon', 'coordinates': self.polygons})
+        return f"ST_SetSRID(ST_GeomFromGeoJSON({sql_literal(geometry)}), 4326)"
+
+def geojson_polygons(geojson):
+    """
+    Collect the polygons (lists of rings) of a GeoJSON geometry, feature or feature collection.
+    Returns None if it contains other geometry types than Polygon and MultiPolygon.
+    """
+    kind = geojson.get('type')
+    if kind == 'FeatureCollection':
+        polygons = []
+        for feature in geojson.get('features', []):
+            feature_polygons = geojson_polygons(feature)
+            if feature_polygons is None:
+                return None
+            polygons += feature_polygons
+        return polygons
+    if kind == 'Feature':
+        return geojson_polygons(geojson.get('geometry') or {})
+    if kind == 'Polygon':
+        return [geojson['coordinates']]
+    if kind == 'MultiPolygon':
+        return list(geojson['coordinates'])
+    return None
+
+_areas = {}
+
+def load_area(spec, original_line):
+    """
+    Load the area of a WITHIN condition: a bounding box or a GeoJSON file (loaded once for all rules using it).
+    Exits if the area is invalid.
+    """
+    if spec in _areas:
+        return _areas[spec]
+    m = BBOX_PATTERN.match(spec)
+    if m:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in m.groups())
+        if min_lon > max_lon or min_lat > max_lat:
+            print(f"Error: Invalid bounding box '{spec}' (min_lon,min_lat,max_lon,max_lat) in rule: {original_line}")
+            sys.exit(1)
+        area = BoundingBoxArea(min_lon, min_lat, max_lon, max_lat)
+    else:
+        try:
+            with open(spec) as f:
+                polygons = geojson_polygons(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Error: Cannot read area '{spec}' ({e}) in rule: {original_line}")
+            sys.exit(1)
+        if not polygons:
+            print(f"Error: Area '{spec}' contains no Polygon or MultiPolygon geometry in rule: {original_line}")
+            sys.exit(1)
+        area = PolygonArea(polygons)
+    _areas[spec] = area
+    return area
+
+def rule_is_spatial(rule):
+    return rule['type'] == 'conditional' and any(token.startswith("WITHIN ") for token in rule['conditions_rpn'])
+
 ###########################
 # Rule Parsing
 ###########################
@@ -392,11 +765,12 @@ def parse_modification_rules(file_path):
     Parse modification rules from a text file.
     Supports both unconditional and conditional rules with extended syntax.
     Exits immediately if any rule is invalid (ignoring lines starting with '#').
-    Returns a list of rule dictionaries.
+    Returns a list of rule dictionaries. Each rule is compiled once into a callable ('apply')
+    that is executed on the WayTags index of a way.
     """
     rules = []
     with open(file_path, 'r') as f:
-        for orig_line in f:
+        for line_number, orig_line in enumerate(f, 1):
             original_line = orig_line.strip().replace("\\xa0", ' ')
             if not original_line or original_line.startswith('#'):
                 continue
@@ -437,161 +811,2119 @@ def parse_modification_rules(file_path):
                 }
                 if freq is not None:
                     rule['frequency'] = freq
+                rule['position'] = len(rules)
+                rule['line'] = line_number
+                rule['apply'] = compile_rule(rule)
                 rules.append(rule)
             else:
                 # Unconditional rule: parse the entire line as a compound action expression.
                 action_ast = parse_action_expression(line, original_line)
                 rule = {
                     'type': 'unconditional',
-                    'action_ast': action_ast
+                    'action_ast': action_ast,
+                    'original_line': original_line
                 }
                 if freq is not None:
                     rule['frequency'] = freq
+                rule['position'] = len(rules)
+                rule['line'] = line_number
+                rule['apply'] = compile_rule(rule)
                 rules.append(rule)
     return rules
 
+def compile_rule(rule):
+    """
+    Compile a parsed rule dictionary into a single callable that applies the rule to a WayTags index.
+    The compiled condition and actions are kept in the rule as well ('condition', 'then_action' and
+    'else_action'; for unconditional rules only 'then_action'), for applying the rule with profiling.
+    """
+    if rule['type'] == 'unconditional':
+        rule['then_action'] = compile_action_ast(rule['action_ast'])
+        return rule['then_action']
+    condition = rule['condition'] = compile_conditions(rule['conditions_rpn'], rule['original_line'])
+    then_action = rule['then_action'] = compile_action_ast(rule['then_action_ast'])
+    rule['else_action'] = None
+    if not rule.get('else_action_ast'):
+        def apply_then(tags):
+            if condition(tags):
+                then_action(tags)
+        return apply_then
+    else_action = rule['else_action'] = compile_action_ast(rule['else_action_ast'])
+    def apply_then_else(tags):
+        if condition(tags):
+            then_action(tags)
+        else:
+            else_action(tags)
+    return apply_then_else
+
 ###########################
-# Applying Modifications
+# Rule Prefilter
 ###########################
 
-def apply_modifications(root, rules):
+# A trigger set describes which ways a rule can possibly act on: the rule can only do something for a way
+# if at least one of its triggers matches the way's tags. A trigger is either ('key', key) - the way has the tag -
+# or ('value', key, value) - the way has the tag with this (normalized) value. None stands for "any way".
+
+def normalize_tag_value(value):
     """
-    Apply modification rules to all 'way' elements in the OSM XML.
-    Supports unconditional and conditional rules with compound action expressions and frequency-based execution.
+    Normalize a tag value for exact lookups: numeric values compare numerically in conditions, so they are
+    indexed as floats (e.g. '50' and '50.0' are the same). All other values are compared as strings.
     """
-    for way in root.findall('way'):
-        for rule in rules:
-            if 'frequency' in rule:
-                if random.random() >= rule['frequency']:
-                    continue  # Skip this rule for the current way
+    try:
+        return float(value)
+    except ValueError:
+        return value
 
-            if rule['type'] == 'unconditional':
-                execute_action_ast(way, rule['action_ast'])
-            elif rule['type'] == 'conditional':
-                conditions_met = evaluate_rpn(way, rule['conditions_rpn'], rule['original_line'])
-                if conditions_met:
-                    execute_action_ast(way, rule['then_action_ast'])
-                elif rule.get('else_action_ast'):
-                    execute_action_ast(way, rule['else_action_ast'])
+def union_triggers(a, b):
+    if a is None or b is None:
+        return None
+    return a | b
+
+def select_triggers(a, b):
+    """
+    Both trigger sets are necessary for a match (AND) - pick the more selective one.
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b, key=lambda t: (sum(1 for trigger in t if trigger[0] == 'key'), len(t)))
+
+def condition_triggers(rpn_tokens, original_line, negated=False):
+    """
+    Derive the trigger set of a condition in RPN from its referenced tag keys.
+    If negated is True, the trigger set of the negated condition (i.e. for the ELSE branch) is returned.
+    """
+    stack = []
+    for token in rpn_tokens:
+        if token in ("AND", "OR"):
+            b = stack.pop()
+            a = stack.pop()
+            # De Morgan: a negated AND is an OR of the negated operands and vice versa
+            if (token == "AND") != negated:
+                stack.append(select_triggers(a, b))
+            else:
+                stack.append(union_triggers(a, b))
+            continue
+        cond_op, cond_key, cond_value = split_condition(token, original_line)
+        if cond_op == "WITHIN":
+            stack.append(None)  # any way may lie within the area (or outside of it)
+        elif negated:
+            # only the negation of NOTEXISTS requires a tag to be present
+            stack.append({('key', cond_key)} if cond_op == "NOTEXISTS" else None)
+        elif cond_op == "NOTEXISTS":
+            stack.append(None)
+        elif cond_op == "==":
+            stack.append({('value', cond_key, normalize_tag_value(cond_value))})
+        else:
+            stack.append({('key', cond_key)})
+    return stack[0]
+
+def action_triggers(ast):
+    """
+    Derive the trigger set of an action expression: assignments, increments, decrements and removals
+    only act on ways that have the tag, ADD and UPDATE may act on any way, DONOTHING never acts.
+    """
+    if ast.get("type") == "atomic":
+        action = ast["action"]
+        if action['action_type'] in ('ASSIGN', 'INCREMENT', 'DECREMENT', 'REMOVE'):
+            return {('key', action['key'])}
+        if action['action_type'] == 'DONOTHING':
+            return set()
+        return None
+    return union_triggers(action_triggers(ast["left"]), action_triggers(ast["right"]))
+
+def action_keys(ast):
+    """
+    Return the set of tag keys an action expression may write.
+    """
+    if ast.get("type") == "atomic":
+        return {ast["action"]['key']} if 'key' in ast["action"] else set()
+    return action_keys(ast["left"]) | action_keys(ast["right"])
+
+def rule_triggers(rule):
+    if rule['type'] == 'unconditional':
+        return action_triggers(rule['action_ast'])
+    then_triggers = select_triggers(condition_triggers(rule['conditions_rpn'], rule['original_line']),
+                                    action_triggers(rule['then_action_ast']))
+    if not rule.get('else_action_ast'):
+        return then_triggers
+    else_triggers = select_triggers(condition_triggers(rule['conditions_rpn'], rule['original_line'], negated=True),
+                                    action_triggers(rule['else_action_ast']))
+    return union_triggers(then_triggers, else_triggers)
+
+def rule_written_keys(rule):
+    if rule['type'] == 'unconditional':
+        return action_keys(rule['action_ast'])
+    keys = action_keys(rule['then_action_ast'])
+    if rule.get('else_action_ast'):
+        keys |= action_keys(rule['else_action_ast'])
+    return keys
+
+class RuleSet:
+    """
+    Compiled modification rules together with an index from referenced tag keys (and exact key/value
+    pairs for '==' conditions) to the rules that can act on a way having them.
+    Only the candidate rules of a way are evaluated; ways no rule can act on are skipped without
+    building a tag index at all.
+    """
+
+    def __init__(self, rules, seed=0, profile=False):
+        self.rules = rules
+        self.seed = seed        # seed for FREQ sampling
+        self.profile = RuleProfile(rules) if profile else None  # per-rule counters (see RuleProfile)
+        self.spatial = any(rule_is_spatial(rule) for rule in rules)  # node references are needed (WITHIN)
+        self.nodes = None       # NodeIndex of the input file (set by the rewriter if the rule set is spatial)
+        self.always = []        # positions of rules that have to be evaluated for every way
+        self.by_key = {}        # tag key -> positions of rules
+        self.by_value = {}      # (tag key, normalized value) -> positions of rules
+        self.value_keys = set()
+        written_keys = set()
+        for position, rule in enumerate(rules):
+            triggers = rule_triggers(rule)
+            # a rule that depends on a key written by an earlier rule cannot be prefiltered on the original tags
+            if triggers is not None and any(trigger[1] in written_keys for trigger in triggers):
+                triggers = None
+            if triggers is None:
+                self.always.append(position)
+            else:
+                for trigger in triggers:
+                    if trigger[0] == 'key':
+                        self.by_key.setdefault(trigger[1], []).append(position)
+                    else:
+                        self.by_value.setdefault((trigger[1], trigger[2]), []).append(position)
+                        self.value_keys.add(trigger[1])
+            written_keys |= rule_written_keys(rule)
+
+    def candidates(self, way_id, tag_pairs):
+        """
+        Return the rules (in file order) that may act on a way with the given id and (key, value) tag pairs.
+        """
+        positions = set(self.always)
+        by_key = self.by_key
+        value_keys = self.value_keys
+        has_osm_id = False
+        for key, value in tag_pairs:
+            hit = by_key.get(key)
+            if hit:
+                positions.update(hit)
+            if key in value_keys:
+                hit = self.by_value.get((key, normalize_tag_value(value)))
+                if hit:
+                    positions.update(hit)
+            if key == OSM_ID_KEY:
+                has_osm_id = True
+        if not has_osm_id and way_id is not None:
+            # exact id lookup for rules on the 'osm_id' pseudo key
+            hit = by_key.get(OSM_ID_KEY)
+            if hit:
+                positions.update(hit)
+            if OSM_ID_KEY in value_keys:
+                hit = self.by_value.get((OSM_ID_KEY, normalize_tag_value(way_id)))
+                if hit:
+                    positions.update(hit)
+        if not positions:
+            return []
+        rules = self.rules
+        return [rules[position] for position in sorted(positions)]
+
+    def take_profile(self):
+        """
+        Return the counters collected since the last call (None if profiling is off) and start new ones.
+        """
+        profile = self.profile
+        if profile is not None:
+            self.profile = RuleProfile(self.rules)
+        return profile
 
 ###########################
-# Other Utility Functions
+# Rule Profiling
 ###########################
 
-def modify_file_content(file_path, replacements):
-    with open(file_path, 'r') as f:
-        content = f.read()
-    for key, value in replacements.items():
-        content = content.replace(f'${{{key}}}', value)
-    return content
+class RuleProfile:
+    """
+    Counters per rule of a rule set, collected while the rules are applied (--profile): ways the rule was
+    evaluated on (candidates of the prefilter), FREQ skips, ways the condition was true for, THEN/ELSE branches
+    taken (THEN is the action of unconditional rules), tags changed by the rule and time spent in seconds.
+    """
+    FIELDS = ('evaluated', 'freq_skipped', 'condition_true', 'then', 'else', 'tags_changed', 'seconds')
 
-def is_docker_running():
-    try:
-        result = subprocess.run(['docker', 'info'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return result.returncode == 0
-    except Exception as e:
-        print(f"Error checking Docker status: {e}")
-        return False
+    def __init__(self, rules):
+        self.ways = 0  # ways processed (including those without candidate rules)
+        self.rules = [(rule['line'], rule['original_line'], sorted(rule_written_keys(rule))) for rule in rules]
+        self.counts = [[0, 0, 0, 0, 0, 0, 0.0] for _ in rules]
 
-def start_docker():
-    try:
-        if platform.system() == "Windows":
-            subprocess.run(['start', 'docker'], shell=True)
-        elif platform.system() == "Darwin":
-            subprocess.run(['open', '-a', 'Docker'])
-        elif platform.system() == "Linux":
-            subprocess.run(['sudo', 'systemctl', 'start', 'docker'])
+    def merge(self, other):
+        self.ways += other.ways
+        for own, counts in zip(self.counts, other.counts):
+            for i, count in enumerate(counts):
+                own[i] += count
+
+    def to_dict(self):
+        return {
+            'ways': self.ways,
+            'rules': [dict(zip(('line', 'rule') + self.FIELDS, (line, text) + tuple(counts)))
+                      for (line, text, _), counts in zip(self.rules, self.counts)]
+        }
+
+def apply_rules_profiled(tags, rules, rule_set):
+    """
+    Apply the rules to a WayTags index like modify_tags does and count the outcome of each rule in the
+    RuleProfile of rule_set.
+    """
+    seed = rule_set.seed
+    profile = rule_set.profile
+    for rule in rules:
+        start = time.perf_counter()
+        counts = profile.counts[rule['position']]
+        counts[0] += 1
+        if 'frequency' in rule and freq_sample(seed, rule['position'], tags.way_id) >= rule['frequency']:
+            counts[1] += 1
         else:
-            print("Unsupported platform for starting Docker.")
-            sys.exit(1)
-        print("Attempting to start Docker. Please wait...")
-        time.sleep(10)
-    except Exception as e:
-        print(f"Failed to start Docker: {e}")
-        sys.exit(1)
+            keys = profile.rules[rule['position']][2]
+            before = [tags.values.get(key) for key in keys]
+            if rule['type'] == 'unconditional':
+                counts[3] += 1
+                rule['then_action'](tags)
+            elif rule['condition'](tags):
+                counts[2] += 1
+                counts[3] += 1
+                rule['then_action'](tags)
+            elif rule['else_action'] is not None:
+                counts[4] += 1
+                rule['else_action'](tags)
+            counts[5] += sum(1 for key, value in zip(keys, before) if tags.values.get(key) != value)
+        counts[6] += time.perf_counter() - start
 
-def clean_docker_environment():
-    temp_files = ['data/temp_import.yml', 'data/temp_download.yml']
-    for temp_file in temp_files:
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-    try:
-        print("Pruning all Docker containers and images...")
-        subprocess.run("docker system prune -a -f", shell=True, check=True)
-    except Exception as e:
-        print(f"Warning: Failed to prune Docker system: {e}")
-    try:
-        subprocess.run("docker rmi -f netascore", shell=True, check=True)
-    except Exception as e:
-        print("Netascore image not found or failed to remove; proceeding.")
+def profile_file_name(path):
+    return summary_file_name(path, 'profile')
+
+def write_profile(path, profile):
+    """
+    Print the RuleProfile of the scenario output at path and write it to a JSON file next to it.
+    Rules that did not change any tag are marked, as they are either dead or undone by later rules.
+    """
+    report = profile.to_dict()
+    with open(profile_file_name(path), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"{path}: rule profile ({report['ways']} ways)")
+    print(f"  {'line':>5} {'evaluated':>10} {'freq skip':>10} {'true':>10} {'then':>10} {'else':>10} {'changed':>10} {'time [s]':>9}  rule")
+    for rule in report['rules']:
+        marker = "  (no changes)" if rule['tags_changed'] == 0 else ""
+        print(f"  {rule['line']:>5} {rule['evaluated']:>10} {rule['freq_skipped']:>10} {rule['condition_true']:>10} {rule['then']:>10} "
+              f"{rule['else']:>10} {rule['tags_changed']:>10} {rule['seconds']:>9.3f}  {rule['rule'][:60]}{marker}")
 
 ###########################
-# Main Routine
+# Applying Modifications
 ###########################
 
-def main():
-    parser = argparse.ArgumentParser(description="Automate NetAScore scenario generation.")
-    parser.add_argument('--city', required=True, help="Name of the city")
-    parser.add_argument('--scenario_name', required=False, help="Name of the scenario")
-    parser.add_argument('--flag', choices=['ALL', 'CITY', 'SCENARIO'], required=True, help="Action to perform")
-    parser.add_argument('--mod_file', help="Path to modification text file", required=False, default="modifications.txt")
-    parser.add_argument('--manual', action='store_true', help="Print the modification rules manual and exit")
-    args = parser.parse_args()
+def freq_sample(seed, rule_position, way_id):
+    """
+    Deterministic sample in [0, 1) for FREQ rules, derived from the seed, the rule's position in the rule file
+    and the way id. Whether a FREQ rule is applied to a way is therefore reproducible for a given seed and does
+    not depend on the order in which ways are processed (e.g. the number of worker processes).
+    """
+    digest = hashlib.md5(f"{seed}:{rule_position}:{way_id}".encode()).hexdigest()
+    return int(digest[:15], 16) / 16**15
 
-    if args.manual:
-        print_manual()
+def modify_way_tags(way, rule_set):
+    """
+    Run the candidate rules of rule_set (see RuleSet) on the tags of a 'way' element.
+    The way's tags are indexed once and all candidate rules run on that index.
+    Returns the WayTags index if any rule was applied that may have changed a tag, None otherwise.
+    Supports unconditional and conditional rules with compound action expressions and frequency-based execution.
+    """
+    tag_pairs = [(tag.get('k'), tag.get('v')) for tag in way.iter('tag')]
+    refs = [int(nd.get('ref')) for nd in way.iter('nd')] if rule_set.spatial else None
+    return modify_tags(way.get('id'), tag_pairs, rule_set, refs)
 
-    city = args.city
-    scenario = args.scenario_name
-    flag = args.flag
-    mod_file = args.mod_file
+def modify_tags(way_id, tag_pairs, rule_set, refs=None):
+    """
+    Run the candidate rules of rule_set on the (key, value) tag pairs of the way with the given id (as string).
+    refs are the node ids of the way, needed for WITHIN conditions only.
+    Returns the WayTags index if any rule was applied that may have changed a tag, None otherwise.
+    """
+    if rule_set.profile is not None:
+        rule_set.profile.ways += 1
+    rules = rule_set.candidates(way_id, tag_pairs)
+    if not rules:
+        return None
+    tags = WayTags(way_id, tag_pairs, refs, rule_set.nodes)
+    if rule_set.profile is not None:
+        apply_rules_profiled(tags, rules, rule_set)
+        return tags if tags.changed else None
+    for rule in rules:
+        if 'frequency' in rule:
+            if freq_sample(rule_set.seed, rule['position'], way_id) >= rule['frequency']:
+                continue  # Skip this rule for the current way
+        rule['apply'](tags)
+    return tags if tags.changed else None
 
-    if not is_docker_running():
-        print("Docker is not running. Attempting to start Docker...")
-        start_docker()
-        if not is_docker_running():
-            print("Failed to start Docker. Please start Docker manually and try again.")
-            sys.exit(1)
-    else:
-        print("Docker is already running.")
+def apply_modifications_to_way(way, rule_set):
+    """
+    Apply modification rules to a single 'way' element in place.
+    Only the changed tags are written back to the element. Returns the list of tag changes (see WayTags.changes),
+    which is empty if the way was not modified.
+    """
+    tags = modify_way_tags(way, rule_set)
+    if tags is None:
+        return []
+    changes = tags.changes()
+    if changes:
+        tags.write_back(way)
+    return changes
 
-    clean_docker_environment()
-    print("Docker environment cleaned. Continuing with the script...")
+def scenario_way(way, rule_set):
+    """
+    Apply modification rules to a 'way' element without changing the element itself.
+    Returns a tuple (modified way, changes): the way itself and an empty list if no tag was changed,
+    otherwise a modified copy (sharing all unchanged children) and the list of tag changes (see WayTags.changes).
+    This allows several rule sets to be applied to the same parsed way.
+    """
+    tags = modify_way_tags(way, rule_set)
+    changes = tags.changes() if tags is not None else None
+    if not changes:
+        return way, []
+    modified = ET.Element(way.tag, way.attrib)
+    modified[:] = list(way)
+    tags.write_back(modified)
+    return modified, changes
 
-    if flag in ('SCENARIO', 'ALL') and not mod_file:
-        parser.error("--mod_file is required when flag is SCENARIO or ALL")
+def apply_modifications(root, rule_set):
+    """
+    Apply modification rules to all 'way' elements in the OSM XML.
+    Returns a ChangeSummary of the modifications. If the rule set collects a profile (see RuleProfile), the
+    counters of its rules are updated as well.
+    """
+    summary = ChangeSummary()
+    if rule_set.spatial:
+        rule_set.nodes = NodeIndex()
+        for node in root.iter('node'):
+            rule_set.nodes.add_element(node)
+    for way in root.findall('way'):
+        changes = apply_modifications_to_way(way, rule_set)
+        if changes:
+            summary.add(changes)
+    return summary
 
-    download_yaml = 'data/settings_osm_query_download.yml'
-    import_yaml = 'data/settings_osm_query_import.yml'
-    xml_input = f'data/osm_download_{city}.xml'
-    xml_output = f'data/osm_download_{city}_{scenario}.xml'
+###########################
+# Compressed OSM Files
+###########################
 
-    if flag in ('CITY', 'ALL'):
-        download_content = modify_file_content(download_yaml, {'CITY': city})
-        temp_download_yaml = 'data/temp_download.yml'
-        with open(temp_download_yaml, 'w') as f:
-            f.write(download_content)
-        print(f"Running Netascore for {city}...")
-        subprocess.run(['docker', 'compose', 'run', '--build', 'netascore', temp_download_yaml], check=True)
-        if os.path.exists(temp_download_yaml):
-            os.remove(temp_download_yaml)
+# OSM XML, osmChange and their revert files may be compressed: the compression is chosen by the file extension
+# (e.g. osm_download_London.xml.gz) and applied while streaming, without writing uncompressed copies to disk.
+COMPRESSION_SUFFIXES = ('.gz', '.bz2', '.zst')
+GZIP_LEVEL = 6  # the default of gzip (9) is several times slower and hardly smaller for OSM XML
 
-    if flag in ('SCENARIO', 'ALL'):
-        if not os.path.exists(xml_input):
-            raise FileNotFoundError(f"Input file {xml_input} does not exist. Run with --flag CITY first.")
-        rules = parse_modification_rules(mod_file)
-        tree = ET.parse(xml_input)
-        root = tree.getroot()
-        apply_modifications(root, rules)
-        tree.write(xml_output)
-        import_content = modify_file_content(import_yaml, {'CITY': city, 'SCENARIO': scenario})
-        temp_import_yaml = 'data/temp_import.yml'
-        with open(temp_import_yaml, 'w') as f:
-            f.write(import_content)
-        print(f"Running scenario {scenario} for {city}...")
-        subprocess.run(['docker', 'compose', 'run', '--build', 'netascore', temp_import_yaml], check=True)
-        if os.path.exists(temp_import_yaml):
-            os.remove(temp_import_yaml)
+def compression_suffix(path):
+    """
+    Return the compression suffix of the file name (.gz, .bz2 or .zst) or '' if it is not compressed.
+    """
+    for suffix in COMPRESSION_SUFFIXES:
+        if path.endswith(suffix):
+            return suffix
+    return ''
+
+def open_osm_file(path, mode='rb'):
+    """
+    Open an OSM file in binary mode ('rb' or 'wb'), decompressing or compressing it on the fly according to its extension.
+    zstd requires Python 3.14 or the zstandard package.
+    """
+    suffix = compression_suffix(path)
+    if suffix == '.gz':
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+    if suffix == '.bz2':
+        return bz2.open(path, mode)
+    if suffix == '.zst':
+        try:
+            from compression import zstd
+        except ImportError:
+            try:
+                import zstandard as zstd
+            except ImportError:
+                print(f"Error: Reading or writing {path} requires Python 3.14 or the zstandard package (pip install zstandard).")
+                sys.exit(1)
+        return zstd.open(path, mode)
+    return open(path, mode)
+
+def find_osm_file(base_path):
+    """
+    Return the existing file base_path or its compressed version (base_path.gz/.bz2/.zst); base_path if none exists.
+    """
+    for path in [base_path] + [base_path + suffix for suffix in COMPRESSION_SUFFIXES]:
+        if os.path.exists(path):
+            return path
+    return base_path
+
+###########################
+# Scenario Outputs
+###########################
+
+class ChangeSummary:
+    """
+    Counts the tag changes of a scenario: modified ways, added/removed/modified tags in total and per key.
+    """
+
+    def __init__(self):
+        self.ways_modified = 0
+        self.tags_added = 0
+        self.tags_removed = 0
+        self.tags_modified = 0
+        self.keys = {}  # key -> [added, removed, modified]
+
+    def add(self, changes):
+        self.ways_modified += 1
+        for key, old, new in changes:
+            counts = self.keys.setdefault(key, [0, 0, 0])
+            if old is None:
+                self.tags_added += 1
+                counts[0] += 1
+            elif new is None:
+                self.tags_removed += 1
+                counts[1] += 1
+            else:
+                self.tags_modified += 1
+                counts[2] += 1
+
+    def merge(self, other):
+        self.ways_modified += other.ways_modified
+        self.tags_added += other.tags_added
+        self.tags_removed += other.tags_removed
+        self.tags_modified += other.tags_modified
+        for key, counts in other.keys.items():
+            own = self.keys.setdefault(key, [0, 0, 0])
+            for i, count in enumerate(counts):
+                own[i] += count
+
+    def to_dict(self):
+        return {
+            'ways_modified': self.ways_modified,
+            'tags_added': self.tags_added,
+            'tags_removed': self.tags_removed,
+            'tags_modified': self.tags_modified,
+            'keys': {key: dict(zip(('added', 'removed', 'modified'), counts)) for key, counts in sorted(self.keys.items())}
+        }
+
+class ScenarioBuffer:
+    """
+    Collects the output of one scenario for a chunk of the input in memory (see rewrite_way_chunk).
+    In change_only mode, only modified ways are kept (plus their original versions for reverting the change).
+    """
+
+    def __init__(self, change_only):
+        self.change_only = change_only
+        self.body = []
+        self.revert = []
+        self.summary = ChangeSummary()
+        self.profile = None  # RuleProfile of the chunk (if profiling)
+
+    def add_unchanged(self, original):
+        if not self.change_only:
+            self.body.append(original)
+
+    def add_change(self, original, modified, changes):
+        self.body.append(modified)
+        if self.change_only:
+            self.revert.append(original)
+        self.summary.add(changes)
+
+class ScenarioWriter:
+    """
+    Writes the output of one scenario. Elements are passed as serialized bytes.
+    By default, a full copy of the OSM XML is written to path. In change_only mode, path is an osmChange
+    file (.osc) that only contains the modified ways, and a second osmChange file (.revert.osc) with
+    their original versions is written, which undoes the change when applied to the modified data.
+    A summary of the changes (and the rule profile, if collected) is written to a JSON file next to the output
+    when the writer is closed.
+    """
+
+    def __init__(self, path, change_only=False):
+        self.path = path
+        self.change_only = change_only
+        self.summary = ChangeSummary()
+        self.profile = None
+        self.out = open_osm_file(path, 'wb')
+        self.revert_out = None
+        if change_only:
+            self.revert_out = open_osm_file(revert_file_name(path), 'wb')
+            for out in (self.out, self.revert_out):
+                out.write(OSM_CHANGE_HEADER)
+
+    def add_raw(self, data):
+        """
+        Add data that is not part of the way section (prologue, nodes, relations, epilogue of the OSM XML).
+        """
+        if not self.change_only:
+            self.out.write(data)
+
+    def add_unchanged(self, original):
+        if not self.change_only:
+            self.out.write(original)
+
+    def add_change(self, original, modified, changes):
+        self.out.write(modified)
+        if self.change_only:
+            self.revert_out.write(original)
+        self.summary.add(changes)
+
+    def add_buffer(self, buffer):
+        self.out.writelines(buffer.body)
+        if self.change_only:
+            self.revert_out.writelines(buffer.revert)
+        self.summary.merge(buffer.summary)
+        self.add_profile(buffer.profile)
+
+    def add_profile(self, profile):
+        if profile is None:
+            return
+        if self.profile is None:
+            self.profile = profile
+        else:
+            self.profile.merge(profile)
+
+    def close(self):
+        if self.change_only:
+            for out in (self.out, self.revert_out):
+                out.write(OSM_CHANGE_FOOTER)
+            self.revert_out.close()
+        self.out.close()
+        write_summary(self.path, self.summary)
+        if self.profile is not None:
+            write_profile(self.path, self.profile)
+
+OSM_CHANGE_HEADER = b"<?xml version='1.0' encoding='UTF-8'?>\n<osmChange version=\"0.6\" generator=\"NetAScore scenario\">\n<modify>\n"
+OSM_CHANGE_FOOTER = b"</modify>\n</osmChange>\n"
+
+def revert_file_name(osc_path):
+    suffix = compression_suffix(osc_path)
+    return re.sub(r'\.osc$', '', osc_path[:len(osc_path) - len(suffix)]) + '.revert.osc' + suffix
+
+def summary_file_name(path, kind='summary'):
+    path = path[:len(path) - len(compression_suffix(path))]
+    return re.sub(r'(\.osm)?\.[^./\\]*$', '', path) + f'.{kind}.json'
+
+def write_summary(path, summary):
+    """
+    Print the ChangeSummary of the scenario output at path and write it to a JSON file next to it.
+    """
+    summary = summary.to_dict()
+    with open(summary_file_name(path), 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f"{path}: {summary['ways_modified']} ways modified, {summary['tags_added']} tags added, "
+          f"{summary['tags_removed']} tags removed, {summary['tags_modified']} tags modified")
+
+def add_scenario_element(outputs, rule_sets, elem, original=None):
+    """
+    Apply each rule set to a top-level element (if it is a way) and add the result to the scenario outputs.
+    original is the element as it appears in the input (bytes, including the whitespace up to the next element);
+    modified elements are then serialized with the same trailing whitespace. If not given, the element is
+    serialized on demand.
+    """
+    for output, rule_set in zip(outputs, rule_sets):
+        modified, changes = scenario_way(elem, rule_set) if elem.tag == 'way' else (elem, None)
+        if changes:
+            if original is None:
+                original = serialize_element(elem)
+                serialized = serialize_element(modified)
+            else:
+                serialized = serialize_element(modified).strip() + original[len(original.rstrip()):]
+            output.add_change(original, serialized, changes)
+        elif not output.change_only:
+            if original is None:
+                original = serialize_element(elem)
+            output.add_unchanged(original)
+
+###########################
+# Streaming Scenario Rewriter
+###########################
+
+def xml_start_tag(elem):
+    """
+    Serialize the opening tag of an element (without its children and closing tag).
+    """
+    attributes = ''.join(f" {k}={quoteattr(v)}" for k, v in elem.attrib.items())
+    return f"<{elem.tag}{attributes}>"
+
+def serialize_element(elem):
+    """
+    Serialize a top-level element of the OSM XML on its own line (as UTF-8 encoded bytes).
+    """
+    elem.tail = None
+    return ("  " + ET.tostring(elem, encoding='unicode') + "\n").encode('utf-8')
+
+def stream_modifications(xml_input, writers, rule_sets):
+    """
+    Apply modification rules while streaming the OSM XML from xml_input to the given scenario writers.
+    Top-level elements (nodes, ways, relations) are parsed one at a time, written straight to the outputs
+    and discarded again. Memory use therefore does not depend on the size of the input file, and output is
+    written while the input is still being read.
+    writers and rule_sets are lists of the same length: each rule set is applied to the ways of its own
+    output, so several scenarios are generated with a single pass over the input.
+    """
+    with open_osm_file(xml_input) as xml_file:
+        context = ET.iterparse(xml_file, events=('start', 'end'))
+        _, root = next(context)
+        depth = 0
+        header = ("<?xml version='1.0' encoding='UTF-8'?>\n" + xml_start_tag(root) + "\n").encode('utf-8')
+        for writer in writers:
+            writer.add_raw(header)
+        # node coordinates for WITHIN conditions are collected on the way (nodes precede the ways)
+        nodes = NodeIndex() if any(rule_set.spatial for rule_set in rule_sets) else None
+        for rule_set in rule_sets:
+            rule_set.nodes = nodes
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth < 0:
+                break  # closing tag of the root element
+            if depth > 0:
+                continue  # child of a top-level element (tag, nd, member)
+            if nodes is not None and elem.tag == 'node':
+                nodes.add_element(elem)
+            add_scenario_element(writers, rule_sets, elem)
+            # drop the processed element (and everything parsed before it) from the root
+            root.clear()
+        for writer, rule_set in zip(writers, rule_sets):
+            writer.add_raw(f"</{root.tag}>\n".encode('utf-8'))
+            writer.add_profile(rule_set.take_profile())
+
+###########################
+# Parallel Scenario Rewriter
+###########################
+
+WAY_START_PATTERN = re.compile(rb'<way[\s>/]')
+ELEMENT_START_PATTERN = re.compile(rb'<(?:node|way|relation)[\s>/]')
+WAY_SECTION_END_PATTERN = re.compile(rb'<relation[\s>/]|</osm>')
+MIN_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+STREAM_CHUNK_SIZE = 16 * 1024 * 1024  # chunk size for compressed input, whose size is not known in advance
+STREAM_READ_SIZE = 4 * 1024 * 1024
+
+def find_way_section(data):
+    """
+    Find the byte range of the <way> section in an OSM XML file (nodes, ways and relations are sorted by type).
+    Returns a tuple (start, end) or None if the file contains no ways.
+    """
+    m = WAY_START_PATTERN.search(data)
+    if not m:
+        return None
+    start = m.start()
+    m = WAY_SECTION_END_PATTERN.search(data, start)
+    return start, (m.start() if m else len(data))
+
+def split_way_section(data, start, end, chunk_count):
+    """
+    Split the byte range of the <way> section into about chunk_count chunks that start at a <way> tag.
+    Returns a list of (begin, stop) byte ranges.
+    """
+    step = max((end - start) // chunk_count, 1)
+    boundaries = [start]
+    while True:
+        m = WAY_START_PATTERN.search(data, boundaries[-1] + step, end)
+        if not m:
+            break
+        boundaries.append(m.start())
+    boundaries.append(end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def rewrite_way_chunk(data, rule_sets, change_only=False):
+    """
+    Apply each of the rule sets to a chunk of the <way> section (bytes).
+    Returns one ScenarioBuffer per rule set. Ways that are not modified are passed through byte by byte,
+    only modified ways are serialized again.
+    """
+    buffers = [ScenarioBuffer(change_only) for _ in rule_sets]
+    root = ET.fromstring(b'<osm>' + data + b'</osm>')
+    starts = [m.start() for m in ELEMENT_START_PATTERN.finditer(data)]
+    if len(starts) != len(root):
+        # unexpected content in the chunk: serialize all elements instead of passing them through
+        for elem in root:
+            add_scenario_element(buffers, rule_sets, elem)
+    else:
+        bounds = starts + [len(data)]
+        for buffer in buffers:
+            buffer.add_unchanged(data[:bounds[0]])
+        for i, elem in enumerate(root):
+            add_scenario_element(buffers, rule_sets, elem, data[bounds[i]:bounds[i + 1]])
+    for buffer, rule_set in zip(buffers, rule_sets):
+        buffer.profile = rule_set.take_profile()
+    return buffers
+
+_chunk_worker_rule_sets = None
+_chunk_worker_change_only = False
+
+def init_chunk_worker(mod_files, seeds, change_only, profile=False, nodes=None):
+    """
+    Initializer of chunk worker processes: parse and compile the rules once per process.
+    seeds contains the seed for FREQ sampling of each rule file, nodes the NodeIndex for WITHIN conditions.
+    """
+    global _chunk_worker_rule_sets, _chunk_worker_change_only
+    _chunk_worker_rule_sets = [RuleSet(parse_modification_rules(mod_file), seed, profile) for mod_file, seed in zip(mod_files, seeds)]
+    for rule_set in _chunk_worker_rule_sets:
+        rule_set.nodes = nodes
+    _chunk_worker_change_only = change_only
+
+def rule_files_spatial(mod_files):
+    """
+    True if a rule of the given rule files has a WITHIN condition (the rewriters need a NodeIndex then).
+    """
+    return any(rule_is_spatial(rule) for mod_file in set(mod_files) for rule in parse_modification_rules(mod_file))
+
+def process_way_chunk(task):
+    if isinstance(task, bytes):
+        data = task  # chunk of a compressed input file, decompressed by the main process
+    else:
+        xml_input, begin, stop = task
+        with open(xml_input, 'rb') as f:
+            f.seek(begin)
+            data = f.read(stop - begin)
+    return rewrite_way_chunk(data, _chunk_worker_rule_sets, _chunk_worker_change_only)
+
+def read_node_section(xml_file, writers, nodes=None):
+    """
+    Copy a (decompressed) OSM XML stream up to its <way> section to the writers, adding the nodes to the NodeIndex
+    nodes if given. Returns the data read beyond it (starting at the first <way> tag), or None if the stream has
+    no ways (it is then copied completely).
+    """
+    pending = b''
+    while True:
+        block = xml_file.read(STREAM_READ_SIZE)
+        data = pending + block
+        m = WAY_START_PATTERN.search(data)
+        if m:
+            cut = m.start()
+        elif block:
+            cut = data.rfind(b'>') + 1  # copy complete tags only, so that the node index sees every node as a whole
+        else:
+            cut = len(data)
+        if nodes is not None:
+            nodes.add_xml(data[:cut])
+        for writer in writers:
+            writer.add_raw(data[:cut])
+        if m:
+            return data[cut:]
+        if not block:
+            return None
+        pending = data[cut:]
+
+def read_way_chunks(xml_file, data, epilogue):
+    """
+    Yield chunks of about STREAM_CHUNK_SIZE bytes of the <way> section of a (decompressed) OSM XML stream, each
+    starting at a <way> tag. data is the beginning of the way section (see read_node_section). The data read
+    beyond the way section is appended to the list epilogue.
+    """
+    scanned = 0  # data before this offset contains no end of the way section
+    while True:
+        m = WAY_SECTION_END_PATTERN.search(data, max(scanned - 16, 0))
+        if m:
+            if m.start():
+                yield data[:m.start()]
+            epilogue.append(data[m.start():])
+            return
+        scanned = len(data)
+        m = WAY_START_PATTERN.search(data, STREAM_CHUNK_SIZE) if len(data) > STREAM_CHUNK_SIZE else None
+        if m:
+            yield data[:m.start()]
+            data = data[m.start():]
+            scanned -= m.start()
+            continue
+        block = xml_file.read(STREAM_READ_SIZE)
+        if not block:
+            if data:
+                yield data  # no closing tag
+            return
+        data += block
+
+def map_bounded(pool, func, tasks, limit):
+    """
+    Like pool.imap, but tasks are only taken from the iterable while fewer than limit results are pending
+    (pool.imap consumes it as fast as possible, which would read a whole compressed input into memory).
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def parallel_modifications(xml_input, writers, mod_files, seeds, workers, profile=False):
+    """
+    Apply modification rules to an OSM XML file using a pool of worker processes.
+    The <way> section is split into byte-range chunks at <way> tags, which are rewritten in parallel and
+    stitched back together in their original order. Everything before and after the <way> section (nodes,
+    relations) is copied byte by byte. writers contains one scenario writer per rule file in mod_files,
+    seeds the seed for FREQ sampling of each rule file. If profile is set, the rule profiles of all chunks are collected by the writers.
+    Compressed input (see open_osm_file) is decompressed as a stream and cut into chunks while it is read.
+    """
+    if compression_suffix(xml_input):
+        parallel_modifications_compressed(xml_input, writers, mod_files, seeds, workers, profile)
+        return
+    change_only = writers[0].change_only
+    with open(xml_input, 'rb') as f, ExitStack() as stack:
+        data = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) if os.fstat(f.fileno()).st_size else b''
+        section = find_way_section(data)
+        if section is None:
+            for writer in writers:
+                writer.add_raw(data[:])
+            return
+        start, end = section
+        nodes = None
+        if rule_files_spatial(mod_files):
+            nodes = NodeIndex()
+            nodes.add_xml(data[:start])
+            nodes.sort()
+            print(f"Indexed {len(nodes)} nodes for WITHIN conditions.")
+        chunk_count = max(workers * 4, (end - start) // MAX_CHUNK_SIZE)
+        chunk_count = max(min(chunk_count, (end - start) // MIN_CHUNK_SIZE), 1)
+        tasks = [(xml_input, begin, stop) for begin, stop in split_way_section(data, start, end, chunk_count)]
+        print(f"Rewriting {len(tasks)} chunks of ways with {workers} worker process(es)...")
+        for writer in writers:
+            writer.add_raw(data[:start])
+        if workers > 1:
+            pool = stack.enter_context(Pool(workers, initializer=init_chunk_worker, initargs=(mod_files, seeds, change_only, profile, nodes)))
+            chunks = pool.imap(process_way_chunk, tasks)
+        else:
+            init_chunk_worker(mod_files, seeds, change_only, profile, nodes)
+            chunks = map(process_way_chunk, tasks)
+        for buffers in chunks:
+            for writer, buffer in zip(writers, buffers):
+                writer.add_buffer(buffer)
+        for writer in writers:
+            writer.add_raw(data[end:])
+
+def parallel_modifications_compressed(xml_input, writers, mod_files, seeds, workers, profile=False):
+    """
+    Apply modification rules to a compressed OSM XML file using a pool of worker processes (see parallel_modifications).
+    At most a few chunks per worker are decompressed and held in memory at a time.
+    """
+    change_only = writers[0].change_only
+    with open_osm_file(xml_input) as f, ExitStack() as stack:
+        nodes = NodeIndex() if rule_files_spatial(mod_files) else None
+        data = read_node_section(f, writers, nodes)
+        if data is None:
+            return
+        if nodes is not None:
+            nodes.sort()
+            print(f"Indexed {len(nodes)} nodes for WITHIN conditions.")
+        print(f"Rewriting chunks of ways with {workers} worker process(es)...")
+        epilogue = []
+        tasks = read_way_chunks(f, data, epilogue)
+        if workers > 1:
+            pool = stack.enter_context(Pool(workers, initializer=init_chunk_worker, initargs=(mod_files, seeds, change_only, profile, nodes)))
+            chunks = map_bounded(pool, process_way_chunk, tasks, workers * 2)
+        else:
+            init_chunk_worker(mod_files, seeds, change_only, profile, nodes)
+            chunks = map(process_way_chunk, tasks)
+        for buffers in chunks:
+            for writer, buffer in zip(writers, buffers):
+                writer.add_buffer(buffer)
+        data = epilogue[0] if epilogue else b''
+        while data:
+            for writer in writers:
+                writer.add_raw(data)
+            data = f.read(STREAM_READ_SIZE)
+
+###########################
+# Impact Estimate
+###########################
+
+# --estimate runs the rules on a sample of ways instead of the whole file and projects the number of changed ways
+# and tags. For uncompressed XML, ways are drawn at random byte offsets of the way section, so that only the sampled
+# ways are read and parsed: a way is drawn with a probability proportional to its size in bytes, which the estimate
+# corrects for (Hansen-Hurwitz estimator). Compressed XML cannot be read at random offsets: its ways are counted
+# while it is decompressed and a uniform sample is kept (reservoir sampling).
+CONFIDENCE_Z = 1.96  # 95% confidence intervals (normal approximation)
+
+def xml_way_end(data, begin):
+    """
+    Return the end offset of the <way> element starting at offset begin of an OSM XML file.
+    """
+    tag_end = data.find(b'>', begin)
+    if data[tag_end - 1:tag_end] == b'/':
+        return tag_end + 1
+    return data.find(b'</way>', tag_end) + len(b'</way>')
+
+def xml_way_at(data, offset, begin, end):
+    """
+    Return the start offset of the <way> element of the way section range [begin, end) that contains offset,
+    together with the start of the following way (end for the last way of the range).
+    """
+    start = offset + len(b'<way')
+    while True:
+        start = data.rfind(b'<way', begin, start)
+        if WAY_START_PATTERN.match(data, start):
+            break
+    m = WAY_START_PATTERN.search(data, start + 1, end)
+    return start, (m.start() if m else end)
+
+def sample_ways_mapped(data, size, strata, rng):
+    """
+    Draw size ways (with replacement) from the way section of a memory-mapped OSM XML file, split into strata byte
+    ranges of about equal size with size/strata ways each. Returns a list of (finite population correction,
+    [(weight, way element)]) per stratum, weight being the inverse of the probability to draw the way.
+    """
+    section = find_way_section(data)
+    if section is None:
+        return []
+    sample = []
+    ranges = split_way_section(data, section[0], section[1], strata)
+    for i, (begin, end) in enumerate(ranges):
+        count = size // len(ranges) + (1 if i < size % len(ranges) else 0)
+        ways = []
+        for _ in range(count):
+            start, following = xml_way_at(data, rng.randrange(begin, end), begin, end)
+            ways.append(((end - begin) / (following - start), ET.fromstring(data[start:xml_way_end(data, start)])))
+        sample.append((1.0, ways))
+    return sample
+
+def sample_ways_streamed(xml_file, size, rng, nodes=None):
+    """
+    Draw a uniform sample of size ways (without replacement) from a (decompressed) OSM XML stream by reservoir
+    sampling, adding all nodes to the NodeIndex nodes if given. Returns the sample like sample_ways_mapped.
+    """
+    data = read_node_section(xml_file, [], nodes)
+    if data is None:
+        return []
+    reservoir = []
+    count = 0
+    for chunk in read_way_chunks(xml_file, data, []):
+        for m in WAY_START_PATTERN.finditer(chunk):
+            count += 1
+            j = len(reservoir) if len(reservoir) < size else rng.randrange(count)
+            if j < size:
+                way = chunk[m.start():xml_way_end(chunk, m.start())]
+                if j == len(reservoir):
+                    reservoir.append(way)
+                else:
+                    reservoir[j] = way
+    ways = [(count, ET.fromstring(way)) for way in reservoir]
+    return [(1 - len(ways) / count if count else 1.0, ways)]
+
+def xml_node_coordinates(data, end, node_ids):
+    """
+    Look up the given node ids in the node section data[:end] of an OSM XML file by binary search over byte offsets
+    (the nodes of OSM files are sorted by id). Returns a NodeIndex of the nodes found.
+    """
+    nodes = NodeIndex()
+    for node_id in sorted(set(node_ids)):
+        low, high = 0, end
+        while low < high:
+            middle = (low + high) // 2
+            m = NODE_TAG_PATTERN.search(data, middle, end)
+            if m is None or int(dict(NODE_ATTRIBUTE_PATTERN.findall(m.group()))[b'id']) >= node_id:
+                high = middle
+            else:
+                low = middle + 1
+        m = NODE_TAG_PATTERN.search(data, low, end)
+        if m is not None:
+            attributes = dict(NODE_ATTRIBUTE_PATTERN.findall(m.group()))
+            if int(attributes[b'id']) == node_id:
+                nodes.add(node_id, to_coordinate(attributes[b'lon']), to_coordinate(attributes[b'lat']))
+    return nodes
+
+def estimate_total(strata_values):
+    """
+    Estimate the total of a value over all ways from the weighted values of the sampled ways per stratum
+    (see sample_ways_mapped). Returns a tuple (estimate, standard error).
+    """
+    total = variance = 0.0
+    for fpc, values in strata_values:
+        n = len(values)
+        if n == 0:
+            continue
+        mean = sum(values) / n
+        total += mean
+        if n > 1:
+            variance += fpc * sum((value - mean) ** 2 for value in values) / (n - 1) / n
+    return total, math.sqrt(variance)
+
+def estimate_rule_set(sample, rule_set):
+    """
+    Apply the (profiling) rule set to the sampled ways without modifying them and estimate the totals of the
+    changes: returns a dict of (estimate, standard error) for the ways modified, tags added/removed/modified and
+    the ways and tags changed per rule.
+    """
+    rule_count = len(rule_set.rules)
+    strata_values = []
+    for fpc, ways in sample:
+        values = []
+        for weight, way in ways:
+            rule_set.take_profile()
+            tags = modify_way_tags(way, rule_set)
+            changes = tags.changes() if tags is not None else []
+            changed = [counts[5] for counts in rule_set.take_profile().counts]
+            row = [1, 1 if changes else 0,
+                   sum(1 for _, old, _ in changes if old is None),
+                   sum(1 for _, old, new in changes if old is not None and new is None),
+                   sum(1 for _, old, new in changes if old is not None and new is not None)]
+            row += [1 if count else 0 for count in changed] + changed
+            values.append([weight * value for value in row])
+        strata_values.append((fpc, values))
+    columns = [estimate_total([(fpc, [row[i] for row in values]) for fpc, values in strata_values])
+               for i in range(5 + 2 * rule_count)]
+    return {
+        'ways': columns[0],
+        'ways_modified': columns[1],
+        'tags_added': columns[2],
+        'tags_removed': columns[3],
+        'tags_modified': columns[4],
+        'rules': [(columns[5 + i], columns[5 + rule_count + i]) for i in range(rule_count)]
+    }
+
+def format_estimate(estimate):
+    value, error = estimate
+    return f"{value:,.0f} ± {CONFIDENCE_Z * error:,.0f}"
+
+def estimate_impact(xml_input, rule_sets, names, size, strata=1, seed=0):
+    """
+    Print the projected impact of each rule set (with profiling enabled) on the OSM XML file xml_input, estimated from
+    a sample of size ways (see sample_ways_mapped and sample_ways_streamed). No output files are written.
+    """
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    spatial = any(rule_set.spatial for rule_set in rule_sets)
+    with open_osm_file(xml_input) as f, ExitStack() as stack:
+        nodes = None
+        if compression_suffix(xml_input):
+            nodes = NodeIndex() if spatial else None
+            sample = sample_ways_streamed(f, size, rng, nodes)
+        else:
+            data = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) if os.fstat(f.fileno()).st_size else b''
+            sample = sample_ways_mapped(data, size, strata, rng)
+            if spatial and sample:
+                refs = [int(nd.get('ref')) for _, ways in sample for _, way in ways for nd in way.iter('nd')]
+                nodes = xml_node_coordinates(data, find_way_section(data)[0], refs)
+    sampled = sum(len(ways) for _, ways in sample)
+    print(f"Sampled {sampled} ways of {xml_input} in {time.perf_counter() - start:.1f} s.")
+    if not sampled:
+        return
+    for name, rule_set in zip(names, rule_sets):
+        rule_set.nodes = nodes
+        estimate = estimate_rule_set(sample, rule_set)
+        print(f"Estimated impact of scenario {name} (95% confidence intervals, {format_estimate(estimate['ways'])} ways in total):")
+        print(f"  ways modified: {format_estimate(estimate['ways_modified'])}, tags added: {format_estimate(estimate['tags_added'])}, "
+              f"tags removed: {format_estimate(estimate['tags_removed'])}, tags modified: {format_estimate(estimate['tags_modified'])}")
+        print(f"  {'line':>5} {'ways changed':>22} {'tags changed':>22}  rule")
+        for rule, (ways, tags) in zip(rule_set.rules, estimate['rules']):
+            marker = "  (no changes in sample)" if ways[0] == 0 else ""
+            print(f"  {rule['line']:>5} {format_estimate(ways):>22} {format_estimate(tags):>22}  {rule['original_line'][:60]}{marker}")
+
+###########################
+# OSM PBF Scenario Rewriter
+###########################
+
+# An OSM PBF file (https://wiki.openstreetmap.org/wiki/PBF_Format) is a sequence of blocks: the size of a BlobHeader,
+# the BlobHeader (block type and size of the blob) and a Blob with a (usually zlib-compressed) protobuf message.
+# The first block (OSMHeader) describes the file, all further blocks (OSMData) hold up to 8000 nodes, ways or relations.
+# Only blocks with ways are decoded by the rewriter; all other blocks are copied byte by byte.
+
+PBF_BLOCK_ENTITIES = 8000  # entities per block when converting OSM XML (as written by osmium and osmosis)
+PBF_COORDINATE_FACTOR = 10**7  # coordinates are stored in units of 100 nanodegrees (default granularity)
+PBF_MEMBER_TYPES = {'node': 0, 'way': 1, 'relation': 2}
+
+def pb_varint(value):
+    """
+    Encode an integer as protobuf varint (negative values as 64 bit two's complement).
+    """
+    if value < 0:
+        value += 1 << 64
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def pb_read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def pb_int64(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def pb_zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+def pb_unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+def pb_fields(data):
+    """
+    Decode a protobuf message into a list of (field number, wire type, value) tuples.
+    value is an int for varints and bytes for all other wire types.
+    """
+    fields = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        key, pos = pb_read_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = pb_read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = pb_read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire_type}")
+        fields.append((field, wire_type, value))
+    return fields
+
+def pb_field(field, wire_type, value):
+    """
+    Encode a single protobuf field (see pb_fields).
+    """
+    if wire_type == 0:
+        return pb_varint(field << 3) + pb_varint(value)
+    if wire_type == 2:
+        return pb_varint((field << 3) | 2) + pb_varint(len(value)) + bytes(value)
+    return pb_varint((field << 3) | wire_type) + bytes(value)
+
+def pb_packed(data):
+    values = []
+    pos = 0
+    while pos < len(data):
+        value, pos = pb_read_varint(data, pos)
+        values.append(value)
+    return values
+
+def pb_packed_field(field, values):
+    return pb_field(field, 2, b''.join(pb_varint(value) for value in values)) if values else b''
+
+def pb_delta(data):
+    """
+    Decode a packed field of delta coded sint64 values (e.g. the node references of a way).
+    """
+    values = []
+    last = 0
+    for value in pb_packed(data):
+        last += pb_unzigzag(value)
+        values.append(last)
+    return values
+
+def pb_delta_field(field, values):
+    out = []
+    last = 0
+    for value in values:
+        out.append(pb_varint(pb_zigzag(value - last)))
+        last = value
+    return pb_field(field, 2, b''.join(out)) if out else b''
+
+def pbf_blocks(path):
+    """
+    Yield (block type, offset, size) of the blocks of an OSM PBF file. Only the headers of the blocks are read.
+    """
+    with open(path, 'rb') as f:
+        offset = 0
+        while True:
+            prefix = f.read(4)
+            if not prefix:
+                return
+            header_size = struct.unpack('>I', prefix)[0]
+            header = {field: value for field, _, value in pb_fields(f.read(header_size))}
+            f.seek(header[3], os.SEEK_CUR)
+            size = 4 + header_size + header[3]
+            yield header[1].decode(), offset, size
+            offset += size
+
+def pbf_block_data(block):
+    """
+    Return the uncompressed protobuf message of a raw PBF block.
+    """
+    header_size = struct.unpack('>I', block[:4])[0]
+    for field, _, value in pb_fields(block[4 + header_size:]):
+        if field == 1:
+            return bytes(value)
+        if field == 3:
+            return zlib.decompress(value)
+        if field == 4:
+            return lzma.decompress(value)
+    raise ValueError("unsupported compression of OSM PBF block (supported: none, zlib, lzma)")
+
+def pbf_block(block_type, data):
+    """
+    Encode a protobuf message as raw (zlib-compressed) PBF block of the given type.
+    """
+    blob = pb_field(2, 0, len(data)) + pb_field(3, 2, zlib.compress(data))
+    header = pb_field(1, 2, block_type.encode()) + pb_field(3, 0, len(blob))
+    return struct.pack('>I', len(header)) + header + blob
+
+class PbfStringTable:
+    """
+    String table of a PBF block: tags and roles refer to strings by their index. Index 0 is reserved.
+    """
+
+    def __init__(self, strings=None):
+        self.strings = list(strings) if strings else [b'']
+        self.index = {}
+        for i, s in enumerate(self.strings):
+            self.index.setdefault(s, i)
+
+    def add(self, s):
+        s = s.encode('utf-8')
+        i = self.index.get(s)
+        if i is None:
+            i = self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def encode(self):
+        return pb_field(1, 2, b''.join(pb_field(1, 2, s) for s in self.strings))
+
+def pbf_tag_fields(table, tag_pairs):
+    return (pb_packed_field(2, [table.add(key) for key, _ in tag_pairs]) +
+            pb_packed_field(3, [table.add(value) for _, value in tag_pairs]))
+
+def pbf_way_element(way_id, refs, tag_pairs):
+    way = ET.Element('way', {'id': way_id})
+    for ref in refs:
+        ET.SubElement(way, 'nd', {'ref': str(ref)})
+    for key, value in tag_pairs:
+        ET.SubElement(way, 'tag', {'k': key, 'v': value})
+    return way
+
+def rewrite_pbf_block(block, rule_sets, change_only=False):
+    """
+    Apply each of the rule sets to the ways of a raw OSMData block of a PBF file.
+    Returns None if no rule set modified a way of the block (and no rule profile is collected). Otherwise, returns
+    one ScenarioBuffer per rule set with the block (re-encoded if modified) or, in change_only mode, with the
+    modified ways as osmChange XML.
+    """
+    fields = pb_fields(pbf_block_data(block))
+    strings = [bytes(s) for field, _, table in fields if field == 1 for _, _, s in pb_fields(table)]
+    texts = [s.decode('utf-8') for s in strings]
+    groups = [pb_fields(value) for field, _, value in fields if field == 2]
+    ways = []  # (group index, field index, way id, way fields, tag pairs)
+    for g, group in enumerate(groups):
+        for i, (field, _, value) in enumerate(group):
+            if field != 3:
+                continue
+            way_fields = pb_fields(value)
+            keys = vals = ()
+            way_id = 0
+            for way_field, _, way_value in way_fields:
+                if way_field == 1:
+                    way_id = pb_int64(way_value)
+                elif way_field == 2:
+                    keys = pb_packed(way_value)
+                elif way_field == 3:
+                    vals = pb_packed(way_value)
+            ways.append((g, i, str(way_id), way_fields, [(texts[k], texts[v]) for k, v in zip(keys, vals)]))
+    if not ways:
+        return None
+
+    modified = []  # per rule set: list of (way, updated tag pairs, changes)
+    way_refs = None
+    if any(rule_set.spatial for rule_set in rule_sets):
+        way_refs = [[ref for field, _, value in way[3] if field == 8 for ref in pb_delta(value)] for way in ways]
+    for rule_set in rule_sets:
+        modified.append([])
+        for w, way in enumerate(ways):
+            tags = modify_tags(way[2], way[4], rule_set, way_refs[w] if rule_set.spatial else None)
+            changes = tags.changes() if tags is not None else None
+            if changes:
+                modified[-1].append((way, tags.updated_pairs(way[4]), changes))
+    profiles = [rule_set.take_profile() for rule_set in rule_sets]
+    if not any(modified) and profiles[0] is None:
+        return None
+
+    buffers = [ScenarioBuffer(change_only) for _ in rule_sets]
+    for buffer, ways_modified, profile in zip(buffers, modified, profiles):
+        buffer.profile = profile
+        if change_only:
+            for (_, _, way_id, way_fields, tag_pairs), updated, changes in ways_modified:
+                refs = [ref for field, _, value in way_fields if field == 8 for ref in pb_delta(value)]
+                buffer.add_change(serialize_element(pbf_way_element(way_id, refs, tag_pairs)),
+                                  serialize_element(pbf_way_element(way_id, refs, updated)), changes)
+            continue
+        if not ways_modified:
+            buffer.add_unchanged(block)
+            continue
+        table = PbfStringTable(strings)
+        updates = {(way[0], way[1]): updated for way, updated, _ in ways_modified}
+        encoded_groups = []
+        for g, group in enumerate(groups):
+            encoded = []
+            for i, (field, wire_type, value) in enumerate(group):
+                if (g, i) in updates:
+                    way_fields = [way_field for way_field in pb_fields(value) if way_field[0] not in (2, 3)]
+                    value = b''.join(pb_field(*way_field) for way_field in way_fields) + pbf_tag_fields(table, updates[(g, i)])
+                encoded.append(pb_field(field, wire_type, value))
+            encoded_groups.append(pb_field(2, 2, b''.join(encoded)))
+        others = b''.join(pb_field(*field) for field in fields if field[0] not in (1, 2))
+        buffer.body.append(pbf_block('OSMData', table.encode() + b''.join(encoded_groups) + others))
+        for _, _, changes in ways_modified:
+            buffer.summary.add(changes)
+    return buffers
+
+def pbf_node_coordinates(block):
+    """
+    Decode the ids and coordinates (see NodeIndex) of the nodes of a raw OSMData block.
+    Returns a tuple of arrays (ids, lons, lats).
+    """
+    ids, lons, lats = array('q'), array('i'), array('i')
+    fields = pb_fields(pbf_block_data(block))
+    granularity, lat_offset, lon_offset = 100, 0, 0
+    for field, _, value in fields:
+        if field == 17:
+            granularity = value
+        elif field == 19:
+            lat_offset = pb_int64(value)
+        elif field == 20:
+            lon_offset = pb_int64(value)
+    scale = 10**9 // COORDINATE_FACTOR
+    for field, _, group in fields:
+        if field != 2:
+            continue
+        for group_field, _, value in pb_fields(group):
+            if group_field == 1:  # Node
+                node = {node_field: node_value for node_field, _, node_value in pb_fields(value)}
+                group_ids, group_lats, group_lons = [pb_unzigzag(node[1])], [pb_unzigzag(node[8])], [pb_unzigzag(node[9])]
+            elif group_field == 2:  # DenseNodes
+                dense = {dense_field: dense_value for dense_field, _, dense_value in pb_fields(value)}
+                group_ids, group_lats, group_lons = pb_delta(dense.get(1, b'')), pb_delta(dense.get(8, b'')), pb_delta(dense.get(9, b''))
+            else:
+                continue
+            ids.extend(group_ids)
+            lats.extend((lat_offset + granularity * lat) // scale for lat in group_lats)
+            lons.extend((lon_offset + granularity * lon) // scale for lon in group_lons)
+    return ids, lons, lats
+
+def read_pbf_nodes(task):
+    pbf_input, block_type, offset, size = task
+    if block_type != 'OSMData':
+        return None
+    with open(pbf_input, 'rb') as f:
+        f.seek(offset)
+        return pbf_node_coordinates(f.read(size))
+
+def pbf_node_index(tasks, workers=None):
+    """
+    Build the NodeIndex of an OSM PBF file from its blocks (decoded in parallel if workers are given).
+    """
+    nodes = NodeIndex()
+    with ExitStack() as stack:
+        if workers and workers > 1:
+            results = stack.enter_context(Pool(workers)).imap(read_pbf_nodes, tasks)
+        else:
+            results = map(read_pbf_nodes, tasks)
+        for result in results:
+            if result is not None:
+                nodes.add_arrays(*result)
+    nodes.sort()
+    return nodes
+
+def process_pbf_block(task):
+    pbf_input, block_type, offset, size = task
+    if block_type != 'OSMData':
+        return None
+    with open(pbf_input, 'rb') as f:
+        f.seek(offset)
+        block = f.read(size)
+    return rewrite_pbf_block(block, _chunk_worker_rule_sets, _chunk_worker_change_only)
+
+def pbf_modifications(pbf_input, writers, mod_files, seeds, workers=None, profile=False):
+    """
+    Apply modification rules to an OSM PBF file block by block, optionally using a pool of worker processes.
+    Blocks without modified ways (including all node and relation blocks) are copied byte by byte, only blocks
+    with modified ways are encoded again. writers contains one scenario writer per rule file in mod_files,
+    seeds the seed for FREQ sampling of each rule file. If profile is set, the rule profiles of all blocks are collected by the writers.
+    """
+    change_only = writers[0].change_only
+    tasks = [(pbf_input, block_type, offset, size) for block_type, offset, size in pbf_blocks(pbf_input)]
+    nodes = None
+    if rule_files_spatial(mod_files):
+        nodes = pbf_node_index(tasks, workers)
+        print(f"Indexed {len(nodes)} nodes for WITHIN conditions.")
+    print(f"Rewriting {len(tasks)} blocks with {workers or 1} worker process(es)...")
+    with open(pbf_input, 'rb') as f, ExitStack() as stack:
+        if workers and workers > 1:
+            pool = stack.enter_context(Pool(workers, initializer=init_chunk_worker, initargs=(mod_files, seeds, change_only, profile, nodes)))
+            results = pool.imap(process_pbf_block, tasks)
+        else:
+            init_chunk_worker(mod_files, seeds, change_only, profile, nodes)
+            results = map(process_pbf_block, tasks)
+        for (_, block_type, offset, size), buffers in zip(tasks, results):
+            if buffers is None:
+                f.seek(offset)
+                block = f.read(size)
+                for writer in writers:
+                    if block_type == 'OSMData':
+                        writer.add_unchanged(block)
+                    else:
+                        writer.add_raw(block)
+            else:
+                for writer, buffer in zip(writers, buffers):
+                    writer.add_buffer(buffer)
+
+def pbf_header_block(bounds=None):
+    header = b''
+    if bounds is not None:
+        # HeaderBBox: left, right, top, bottom in nanodegrees
+        bbox = [bounds.get('minlon'), bounds.get('maxlon'), bounds.get('maxlat'), bounds.get('minlat')]
+        if None not in bbox:
+            header += pb_field(1, 2, b''.join(pb_field(i + 1, 0, pb_zigzag(round(float(v) * 10**9))) for i, v in enumerate(bbox)))
+    header += pb_field(4, 2, b'OsmSchema-V0.6') + pb_field(4, 2, b'DenseNodes')
+    header += pb_field(16, 2, b'NetAScore scenario')
+    return pbf_block('OSMHeader', header)
+
+def pbf_data_block(kind, elements):
+    """
+    Encode a list of node, way or relation elements (all of the same kind) as OSMData block without metadata.
+    """
+    table = PbfStringTable()
+    if kind == 'node':
+        ids, lats, lons, keys_vals = [], [], [], []
+        for elem in elements:
+            ids.append(int(elem.get('id')))
+            lats.append(round(float(elem.get('lat')) * PBF_COORDINATE_FACTOR))
+            lons.append(round(float(elem.get('lon')) * PBF_COORDINATE_FACTOR))
+            for tag in elem.iter('tag'):
+                keys_vals += [table.add(tag.get('k')), table.add(tag.get('v'))]
+            keys_vals.append(0)
+        dense = pb_delta_field(1, ids) + pb_delta_field(8, lats) + pb_delta_field(9, lons) + pb_packed_field(10, keys_vals)
+        group = pb_field(2, 2, dense)
+    else:
+        entities = []
+        for elem in elements:
+            tag_pairs = [(tag.get('k'), tag.get('v')) for tag in elem.iter('tag')]
+            data = pb_field(1, 0, int(elem.get('id'))) + pbf_tag_fields(table, tag_pairs)
+            if kind == 'way':
+                data += pb_delta_field(8, [int(nd.get('ref')) for nd in elem.iter('nd')])
+                entities.append(pb_field(3, 2, data))
+            else:
+                members = list(elem.iter('member'))
+                data += pb_packed_field(8, [table.add(member.get('role', '')) for member in members])
+                data += pb_delta_field(9, [int(member.get('ref')) for member in members])
+                data += pb_packed_field(10, [PBF_MEMBER_TYPES[member.get('type')] for member in members])
+                entities.append(pb_field(4, 2, data))
+        group = b''.join(entities)
+    return pbf_block('OSMData', table.encode() + pb_field(2, 2, group))
+
+def convert_xml_to_pbf(xml_input, pbf_output):
+    """
+    Convert an OSM XML file to OSM PBF while streaming it (see stream_modifications). The elements are written
+    in their original order without metadata (versions, timestamps, users), which osm2pgsql does not use.
+    """
+    print(f"Converting {xml_input} to {pbf_output}...")
+    with open_osm_file(xml_input) as xml_file, open(pbf_output, 'wb') as out:
+        context = ET.iterparse(xml_file, events=('start', 'end'))
+        _, root = next(context)
+        depth = 0
+        header_written = False
+        kind = None
+        elements = []
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 0:
+                continue  # child of a top-level element or closing tag of the root element
+            if not header_written:
+                out.write(pbf_header_block(elem.attrib if elem.tag == 'bounds' else None))
+                header_written = True
+            if elem.tag in PBF_MEMBER_TYPES:
+                if elements and (elem.tag != kind or len(elements) >= PBF_BLOCK_ENTITIES):
+                    out.write(pbf_data_block(kind, elements))
+                    elements = []
+                kind = elem.tag
+                elements.append(elem)
+            # drop the element from the root (it is still referenced by elements until its block is written)
+            root.remove(elem)
+        if not header_written:
+            out.write(pbf_header_block())
+        if elements:
+            out.write(pbf_data_block(kind, elements))
+
+###########################
+# SQL Scenario Compiler
+###########################
+
+# columns of the osm2pgsql tables (see resources/default.style) that are not tags of a way
+OSM_STYLE_COMPUTED_COLUMNS = {'z_order', 'way_area'}
+
+# helper functions of the generated SQL (temporary: they only exist for the session running the script)
+SCENARIO_SQL_FUNCTIONS = """CREATE OR REPLACE FUNCTION pg_temp.scenario_num(value text) RETURNS double precision AS $$
+    SELECT CASE WHEN value ~ '^\\s*[-+]?(\\d+\\.?\\d*|\\.\\d+)([eE][-+]?\\d+)?\\s*$' THEN value::double precision END
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION pg_temp.scenario_num_text(value double precision) RETURNS text AS $$
+    SELECT CASE WHEN value = trunc(value) AND abs(value) < 1e16 THEN trunc(value)::bigint::text || '.0' ELSE value::text END
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION pg_temp.scenario_sample(seed bigint, rule_position integer, way_id bigint) RETURNS double precision AS $$
+    SELECT ('x' || substr(md5(seed || ':' || rule_position || ':' || way_id), 1, 15))::bit(60)::bigint / (16.0 ^ 15)::double precision
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION pg_temp.scenario_non_numeric(key text, rule text) RETURNS boolean AS $$
+BEGIN
+    RAISE EXCEPTION 'Non-numeric comparison for ''%'' in rule: %', key, rule;
+END
+$$ LANGUAGE plpgsql VOLATILE;
+
+CREATE OR REPLACE FUNCTION pg_temp.scenario_set_tags(tags hstore, keys text[], vals text[]) RETURNS hstore AS $$
+    SELECT (COALESCE(tags, ''::hstore) - keys) || COALESCE((SELECT hstore(array_agg(k), array_agg(v)) FROM unnest(keys, vals) AS u(k, v) WHERE v IS NOT NULL), ''::hstore)
+$$ LANGUAGE sql IMMUTABLE;
+"""
+
+def load_style_columns(style_path):
+    """
+    Read the tag keys that osm2pgsql stores in columns of its line and polygon tables from a style file.
+    All other tags of a way end up in the hstore column 'tags'.
+    """
+    columns = set()
+    with open(style_path) as f:
+        for line in f:
+            fields = line.split('#')[0].split()
+            if len(fields) < 4 or 'way' not in fields[0].split(','):
+                continue
+            flags = fields[3].split(',')
+            if 'nocolumn' in flags or 'delete' in flags or fields[1] in OSM_STYLE_COMPUTED_COLUMNS:
+                continue
+            columns.add(fields[1])
+    return columns
+
+def sql_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+def sql_number(value):
+    return f"{sql_literal(repr(value))}::double precision"
+
+def sql_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+class SqlTagState:
+    """
+    Symbolic state of the tags of a row while compiling a rule to SQL: maps each tag key to a SQL expression
+    (text, NULL if the tag does not exist) in terms of the row's values before the rule is applied.
+    """
+
+    def __init__(self, columns, values=None):
+        self.columns = columns
+        self.values = dict(values or {})
+
+    def original(self, key):
+        return sql_identifier(key) if key in self.columns else f"tags -> {sql_literal(key)}"
+
+    def get(self, key):
+        return self.values.get(key) or self.original(key)
+
+    def set(self, key, expr):
+        self.values[key] = expr
+
+    def copy(self):
+        return SqlTagState(self.columns, self.values)
+
+    def changed_keys(self):
+        return [key for key, expr in self.values.items() if expr != self.original(key)]
+
+def merge_sql_states(condition, state_true, state_false):
+    """
+    Combine two states into one that takes the values of state_true where condition holds and of state_false otherwise.
+    """
+    merged = state_true.copy()
+    for key in set(state_true.values) | set(state_false.values):
+        value_true = state_true.get(key)
+        value_false = state_false.get(key)
+        if value_true != value_false:
+            merged.set(key, f"CASE WHEN {condition} THEN {value_true} ELSE {value_false} END")
+    return merged
+
+def compile_single_condition_sql(condition_str, state, original_line):
+    """
+    Translate a single condition (see compile_single_condition) into a SQL expression on state.
+    Comparisons other than ==/!= on non-numeric tag values abort the script, as they abort rewriting the OSM XML.
+    WITHIN tests the points of the way's geometry, i.e. its nodes (the tables are imported in WGS 84).
+    """
+    cond_op, cond_key, cond_value = split_condition(condition_str, original_line)
+    if cond_op == "WITHIN":
+        area = load_area(cond_value, original_line).sql()
+        return f"(way && {area} AND EXISTS (SELECT FROM ST_DumpPoints(way) AS p WHERE ST_Intersects(p.geom, {area})))"
+    tag_val = state.get(cond_key)
+    if cond_op == "NOTEXISTS":
+        return f"({tag_val} IS NULL)"
+    if cond_op == "EXISTS":
+        return f"({tag_val} IS NOT NULL)"
+    if cond_key == OSM_ID_KEY:
+        tag_val = f"COALESCE({tag_val}, osm_id::text)"
+    sql_op = '=' if cond_op == '==' else '<>' if cond_op == '!=' else cond_op
+    try:
+        cond_val_num = float(cond_value)
+    except ValueError:
+        cond_val_num = None
+    if cond_val_num is None:
+        if cond_op not in ('==', '!='):
+            print(f"Error: Non-numeric comparison for '{cond_key}' in rule: {original_line}")
+            sys.exit(1)
+        return f"COALESCE({tag_val} {sql_op} {sql_literal(cond_value)}, false)"
+    if cond_op in ('==', '!='):
+        string_comparison = f"{tag_val} {sql_op} {sql_literal(cond_value)}"
+    else:
+        string_comparison = f"pg_temp.scenario_non_numeric({sql_literal(cond_key)}, {sql_literal(original_line)})"
+    return (f"COALESCE(CASE WHEN {tag_val} IS NULL THEN false "
+            f"WHEN pg_temp.scenario_num({tag_val}) IS NOT NULL THEN pg_temp.scenario_num({tag_val}) {sql_op} {sql_number(cond_val_num)} "
+            f"ELSE {string_comparison} END, false)")
+
+def compile_conditions_sql(rpn_tokens, state, original_line):
+    """
+    Translate the RPN expression of a rule's conditions into a single SQL boolean expression.
+    AND and OR are written as CASE expressions, so that the right operand is only evaluated if needed (as in Python).
+    """
+    stack = []
+    for token in rpn_tokens:
+        if token in ("AND", "OR"):
+            if len(stack) < 2:
+                print(f"Error: Insufficient operands for operator {token} in rule: {original_line}")
+                sys.exit(1)
+            b = stack.pop()
+            a = stack.pop()
+            if token == "AND":
+                stack.append(f"(CASE WHEN {a} THEN {b} ELSE false END)")
+            else:
+                stack.append(f"(CASE WHEN {a} THEN true ELSE {b} END)")
+        else:
+            stack.append(compile_single_condition_sql(token, state, original_line))
+    if len(stack) != 1:
+        print(f"Error: Invalid condition expression in rule: {original_line}")
+        sys.exit(1)
+    return stack[0]
+
+def compile_atomic_action_sql(action, state):
+    """
+    Translate an atomic action (see compile_atomic_action) into SQL: updates state in place and
+    returns a SQL boolean expression that tells whether the action succeeded.
+    """
+    key = action.get('key')
+    value = action.get('value')
+    action_type = action.get('action_type')
+    if action_type == 'DONOTHING':
+        return "false"
+    current = state.get(key)
+    if action_type == 'ASSIGN':
+        state.set(key, f"CASE WHEN {current} IS NOT NULL THEN {sql_literal(value)} END")
+        return f"({current} IS NOT NULL)"
+    elif action_type in ('INCREMENT', 'DECREMENT'):
+        try:
+            mod_value = float(value)
+        except ValueError:
+            return "false"
+        number = f"pg_temp.scenario_num({current})"
+        sign = '+' if action_type == 'INCREMENT' else '-'
+        state.set(key, f"CASE WHEN {number} IS NOT NULL THEN pg_temp.scenario_num_text({number} {sign} {sql_number(mod_value)}) ELSE {current} END")
+        return f"({number} IS NOT NULL)"
+    elif action_type == 'ADD':
+        state.set(key, f"COALESCE({current}, {sql_literal(value)})")
+        return f"({current} IS NULL)"
+    elif action_type == 'REMOVE':
+        state.set(key, "NULL::text")
+        return f"({current} IS NOT NULL)"
+    elif action_type == 'UPDATE':
+        state.set(key, sql_literal(value))
+        return "true"
+    print(f"Error: Unknown action type: {action_type}")
+    sys.exit(1)
+
+def compile_action_ast_sql(ast, state):
+    """
+    Translate an action expression AST into SQL (see compile_action_ast): updates state in place and returns
+    a SQL boolean expression that tells whether the action succeeded.
+    """
+    if ast.get("type") == "atomic":
+        return compile_atomic_action_sql(ast["action"], state)
+    left = compile_action_ast_sql(ast["left"], state)
+    if ast["op"] == "AND":
+        right = compile_action_ast_sql(ast["right"], state)
+        return f"({left} AND {right})"
+    # OR: the right side only runs if the left side did not succeed
+    left_state = state.copy()
+    right = compile_action_ast_sql(ast["right"], state)
+    state.values = merge_sql_states(left, left_state, state).values
+    return f"({left} OR {right})"
+
+def compile_rule_sql(rule, columns, seed, table):
+    """
+    Translate a parsed rule into a single set-based UPDATE statement on an osm2pgsql table (osm_line, osm_polygon).
+    Only rows of ways (positive osm_id) whose tags are actually changed by the rule are updated.
+    Returns None if the rule never changes a tag.
+    """
+    state = SqlTagState(columns)
+    if rule['type'] == 'unconditional':
+        compile_action_ast_sql(rule['action_ast'], state)
+    else:
+        condition = compile_conditions_sql(rule['conditions_rpn'], state, rule['original_line'])
+        then_state = state.copy()
+        compile_action_ast_sql(rule['then_action_ast'], then_state)
+        else_state = state.copy()
+        if rule.get('else_action_ast'):
+            compile_action_ast_sql(rule['else_action_ast'], else_state)
+        state = merge_sql_states(condition, then_state, else_state)
+    keys = state.changed_keys()
+    if not keys:
+        return None
+    assignments = [f"{sql_identifier(key)} = {state.get(key)}" for key in keys if key in columns]
+    tag_keys = [key for key in keys if key not in columns]
+    if tag_keys:
+        assignments.append(f"tags = pg_temp.scenario_set_tags(tags, ARRAY[{', '.join(sql_literal(key) for key in tag_keys)}]::text[], "
+                           f"ARRAY[{', '.join(state.get(key) for key in tag_keys)}]::text[])")
+    filters = ["osm_id > 0"]
+    if 'frequency' in rule:
+        filters.append(f"pg_temp.scenario_sample({seed}, {rule['position']}, osm_id) < {sql_number(rule['frequency'])}")
+    changed = " OR ".join(f"{state.get(key)} IS DISTINCT FROM {state.original(key)}" for key in keys)
+    # the condition is only evaluated on ways not skipped by FREQ (as in Python), since it may abort the script
+    return (f"UPDATE {table} SET\n    " + ",\n    ".join(assignments) +
+            "\nWHERE CASE WHEN " + "\n  AND ".join(filters) + f"\n  THEN ({changed}) ELSE false END;\n")
+
+def compile_scenario_sql(rules, seed, columns, tables=('osm_line', 'osm_polygon')):
+    """
+    Translate parsed modification rules into a SQL script that applies them to the tags of the ways
+    imported by osm2pgsql (hstore mode). Each rule becomes one UPDATE per table, executed in rule order,
+    so every rule sees the tags as changed by the rules before it - as when rewriting the OSM XML.
+    FREQ sampling uses the same hash as freq_sample: with the same seed, the same ways are chosen.
+    """
+    statements = [f"-- NetAScore scenario (seed {seed})\n", SCENARIO_SQL_FUNCTIONS]
+    for rule in rules:
+        statements.append(f"-- rule {rule['position'] + 1}: {rule['original_line']}\n")
+        for table in tables:
+            statement = compile_rule_sql(rule, columns, seed, table)
+            if statement:
+                statements.append(statement)
+    return "\n".join(statements)
+
+###########################
+# Other Utility Functions
+###########################
+
+def collect_rule_files(paths):
+    """
+    Expand the given modification file paths: directories are replaced by the rule files (*.txt) they contain.
+    """
+    rule_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            rule_files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.txt')))
+        else:
+            rule_files.append(path)
+    return rule_files
+
+def scenario_names(scenario, rule_files):
+    """
+    Name the scenarios of the given rule files: a single rule file uses the scenario name as is,
+    several rule files are named after the files (prefixed with the scenario name, if given).
+    """
+    if len(rule_files) == 1:
+        return [scenario]
+    names = [os.path.splitext(os.path.basename(rule_file))[0] for rule_file in rule_files]
+    return [f"{scenario}_{name}" if scenario else name for name in names]
+
+def modify_file_content(file_path, replacements, extra_settings=''):
+    with open(file_path, 'r') as f:
+        content = f.read()
+    for key, value in replacements.items():
+        content = content.replace(f'${{{key}}}', value)
+    return content + extra_settings
+
+def ensemble_settings(name, replicate, replicates):
+    """
+    Settings section (appended to the settings file) that stores the index of a replicate in the ensemble of its scenario.
+    """
+    return f"\nensemble:\n  name: {name}\n  replicate: {replicate}\n  replicates: {replicates}\n"
+
+def is_docker_running():
+    try:
+        result = subprocess.run(['docker', 'info'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return result.returncode == 0
+    except Exception as e:
+        print(f"Error checking Docker status: {e}")
+        return False
+
+def start_docker():
+    try:
+        if platform.system() == "Windows":
+            subprocess.run(['start', 'docker'], shell=True)
+        elif platform.system() == "Darwin":
+            subprocess.run(['open', '-a', 'Docker'])
+        elif platform.system() == "Linux":
+            subprocess.run(['sudo', 'systemctl', 'start', 'docker'])
+        else:
+            print("Unsupported platform for starting Docker.")
+            sys.exit(1)
+        print("Attempting to start Docker. Please wait...")
+        time.sleep(10)
+    except Exception as e:
+        print(f"Failed to start Docker: {e}")
+        sys.exit(1)
+
+def clean_docker_environment():
+    temp_files = ['data/temp_import.yml', 'data/temp_download.yml']
+    for temp_file in temp_files:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    try:
+        print("Pruning all Docker containers and images...")
+        subprocess.run("docker system prune -a -f", shell=True, check=True)
+    except Exception as e:
+        print(f"Warning: Failed to prune Docker system: {e}")
+    try:
+        subprocess.run("docker rmi -f netascore", shell=True, check=True)
+    except Exception as e:
+        print("Netascore image not found or failed to remove; proceeding.")
+
+###########################
+# In-Process Runner
+###########################
+
+class InProcessRunner:
+    """
+    Runs the NetAScore pipeline (generate_index.py) directly in this process against an already running PostGIS
+    database instead of building the Docker image and starting a container for every run. The imported pipeline
+    modules and the loaded mode profiles are kept for all runs, so a scenario does not pay for starting up again.
+    Requires the dependencies of the pipeline (requirements.txt, osm2pgsql and GDAL) on this machine.
+    """
+    def __init__(self, db_host, db_port, loglevel=None):
+        # the pipeline is only imported in this mode, the Docker mode only needs the standard library
+        import generate_index
+        import toolbox.helper as h
+        if loglevel:
+            h.verbose_level = loglevel
+        self.pipeline = generate_index
+        self.db_host = db_host
+        self.db_port = db_port
+        self.profiles = {}
+
+    def load_settings(self, yaml_path, replacements, extra_settings=''):
+        import yaml
+        settings = yaml.safe_load(modify_file_content(yaml_path, replacements, extra_settings))
+        # the settings templates refer to the database service of docker-compose.yml
+        database = settings.get('database') or {}
+        database['host'] = self.db_host
+        database['port'] = self.db_port
+        settings['database'] = database
+        return settings
+
+    def load_profiles(self, base_path, settings):
+        import yaml
+        key = (base_path, yaml.safe_dump(settings.get('profiles'), sort_keys=True))
+        if key not in self.profiles:
+            self.profiles[key] = self.pipeline.load_profiles(base_path, settings['profiles'])
+        return self.profiles[key]
+
+    def run(self, yaml_path, replacements, extra_settings=''):
+        settings = self.load_settings(yaml_path, replacements, extra_settings)
+        base_path = os.path.dirname(yaml_path)
+        profiles = self.load_profiles(base_path, settings) if 'profiles' in settings else None
+        self.pipeline.run_pipeline(settings, base_path, profiles=profiles)
+
+    def close(self):
+        self.profiles = {}
+
+# the Docker image is built by the first run only, later runs (e.g. replicates of an ensemble) start the container directly
+_docker_image_built = False
+
+def run_netascore(runner, yaml_path, replacements, temp_yaml, extra_settings=''):
+    """
+    Run NetAScore for the settings template with the given placeholders replaced (and extra_settings appended):
+    in this process if a runner is given, otherwise in the Docker container (with the settings written to temp_yaml).
+    """
+    global _docker_image_built
+    if runner:
+        runner.run(yaml_path, replacements, extra_settings)
+        return
+    with open(temp_yaml, 'w') as f:
+        f.write(modify_file_content(yaml_path, replacements, extra_settings))
+    build = [] if _docker_image_built else ['--build']
+    subprocess.run(['docker', 'compose', 'run', *build, 'netascore', temp_yaml], check=True)
+    _docker_image_built = True
+    if os.path.exists(temp_yaml):
+        os.remove(temp_yaml)
+
+###########################
+# Main Routine
+###########################
+
+def main():
+    parser = argparse.ArgumentParser(description="Automate NetAScore scenario generation.")
+    parser.add_argument('--city', required=True, help="Name of the city")
+    parser.add_argument('--scenario_name', required=False, help="Name of the scenario")
+    parser.add_argument('--flag', choices=['ALL', 'CITY', 'SCENARIO'], required=True, help="Action to perform")
+    parser.add_argument('--mod_file', nargs='+', required=False, default=["modifications.txt"],
+                        help="Path to one or more modification text files or directories of them (one scenario per file)")
+    parser.add_argument('--manual', action='store_true', help="Print the modification rules manual and exit")
+    parser.add_argument('--stream', action='store_true', help="Rewrite the OSM XML element by element instead of loading it into memory as a whole")
+    parser.add_argument('--workers', type=int, help="Apply the rules in N parallel processes on chunks of the OSM XML")
+    parser.add_argument('--seed', type=int, help="Seed for FREQ sampling (random if not given)")
+    parser.add_argument('--output', choices=['xml', 'pbf', 'osc', 'sql'], default='xml',
+                        help="Write a full copy of the OSM data per scenario as XML (xml) or PBF (pbf), only the modified ways as "
+                             "osmChange file (osc) or a SQL script that applies the rules to the imported base data in the database (sql)")
+    parser.add_argument('--compression', choices=['gz', 'bz2', 'zst'],
+                        help="Compress the downloaded city XML and the XML/osmChange files of the scenarios (default: as the city XML)")
+    parser.add_argument('--replicates', type=int,
+                        help="Run every scenario K times with consecutive seeds (Monte Carlo ensemble of its FREQ rules) and "
+                             "store the index deltas to the base case with their mean, variance and percentiles per edge")
+    parser.add_argument('--estimate', type=int, metavar='N',
+                        help="Only estimate the number of ways and tags each rule would change from a sample of N ways (no output is written)")
+    parser.add_argument('--strata', type=int, default=1,
+                        help="With --estimate: draw the sample from K parts of the file of equal size (stratified sample, uncompressed XML only)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Count per rule how often it was evaluated, applied and changed tags (and its time) and write a report")
+    parser.add_argument('--in_process', action='store_true',
+                        help="Run NetAScore in this process against a running database instead of a new Docker container per run")
+    parser.add_argument('--db_host', default='localhost', help="Database host for --in_process")
+    parser.add_argument('--loglevel', choices=["1", "2", "3", "4"],
+                        help="Level of debug outputs of NetAScore with --in_process: 1=MajorInfo, 2=Info (default), 3=Detailed, 4=Debug")
+    parser.add_argument('--db_port', type=int, default=5433,
+                        help="Database port for --in_process (default: port of the netascore-db service in docker-compose.yml)")
+    args = parser.parse_args()
+
+    if args.manual:
+        print_manual()
+
+    if args.in_process:
+        runner = InProcessRunner(args.db_host, args.db_port, int(args.loglevel) if args.loglevel else None)
+    else:
+        runner = None
+        if not is_docker_running():
+            print("Docker is not running. Attempting to start Docker...")
+            start_docker()
+            if not is_docker_running():
+                print("Failed to start Docker. Please start Docker manually and try again.")
+                sys.exit(1)
+        else:
+            print("Docker is already running.")
+
+        clean_docker_environment()
+        print("Docker environment cleaned. Continuing with the script...")
+
+    try:
+        run_scenarios(args, runner, parser)
+    finally:
+        if runner:
+            runner.close()
+
+def run_scenarios(args, runner, parser):
+    city = args.city
+    scenario = args.scenario_name
+    flag = args.flag
+    mod_file = args.mod_file
+
+    if flag in ('SCENARIO', 'ALL') and not mod_file:
+        parser.error("--mod_file is required when flag is SCENARIO or ALL")
+
+    download_yaml = 'data/settings_osm_query_download.yml'
+    import_yaml = {
+        'xml': 'data/settings_osm_query_import.yml',
+        'pbf': 'data/settings_osm_query_import.yml',
+        'osc': 'data/settings_osm_query_diff.yml',
+        'sql': 'data/settings_osm_query_sql.yml'
+    }[args.output]
+    pbf_input = f'data/osm_download_{city}.osm.pbf'
+    output_format = 'osm.pbf' if args.output == 'pbf' else args.output
+
+    if flag in ('CITY', 'ALL'):
+        print(f"Running Netascore for {city}...")
+        run_netascore(runner, download_yaml, {'CITY': city, 'COMPRESSION': args.compression or ''}, 'data/temp_download.yml')
+    # the city XML may be compressed (see open_osm_file)
+    xml_input = find_osm_file(f'data/osm_download_{city}.xml')
+    if args.output in ('xml', 'osc'):
+        output_format += f'.{args.compression}' if args.compression else compression_suffix(xml_input)
+
+    if flag in ('SCENARIO', 'ALL'):
+        # the city's PBF file is converted from the downloaded XML once (or provided instead of the XML)
+        pbf_current = os.path.exists(pbf_input) and (not os.path.exists(xml_input) or os.path.getmtime(pbf_input) >= os.path.getmtime(xml_input))
+        if args.output == 'pbf' and not pbf_current and os.path.exists(xml_input):
+            convert_xml_to_pbf(xml_input, pbf_input)
+            pbf_current = True
+        # osmChange files can be written from either format, full copies are written in the format of their input
+        use_pbf = pbf_current and args.output in ('pbf', 'osc')
+        if not use_pbf and not os.path.exists(xml_input):
+            raise FileNotFoundError(f"Input file {xml_input} does not exist. Run with --flag CITY first.")
+        rule_files = collect_rule_files(mod_file)
+        if not rule_files:
+            parser.error("no modification files found in --mod_file")
+        scenarios = scenario_names(scenario, rule_files)
+        seed = args.seed if args.seed is not None else random.randrange(2**31)
+        print(f"Using seed {seed} for FREQ sampling.")
+        if args.estimate is not None:
+            if args.estimate < 2 or args.strata < 1 or args.estimate < 2 * args.strata:
+                parser.error("--estimate needs a sample of at least 2 ways per stratum (see --strata)")
+            if not os.path.exists(xml_input):
+                raise FileNotFoundError(f"Input file {xml_input} does not exist. --estimate samples the city XML, run with --flag CITY first.")
+            names = [name or os.path.splitext(os.path.basename(rule_file))[0] for name, rule_file in zip(scenarios, rule_files)]
+            rule_sets = [RuleSet(parse_modification_rules(rule_file), seed, True) for rule_file in rule_files]
+            estimate_impact(xml_input, rule_sets, names, args.estimate, args.strata, seed)
+            return
+        if args.profile and args.output == 'sql':
+            parser.error("--profile is not available for --output sql (the rules are applied in the database)")
+        seeds = [seed] * len(rule_files)
+        ensembles = [None] * len(scenarios)
+        if args.replicates is not None:
+            if args.replicates < 1:
+                parser.error("--replicates must be at least 1")
+            if args.output not in ('osc', 'sql'):
+                parser.error("--replicates requires --output osc or sql (replicates are recomputed incrementally from the base case)")
+            # every scenario is repeated with consecutive seeds: the replicates only differ in the ways chosen by FREQ rules
+            k = args.replicates
+            names = [name or os.path.splitext(os.path.basename(rule_file))[0] for name, rule_file in zip(scenarios, rule_files)]
+            rule_files = [rule_file for rule_file in rule_files for _ in range(k)]
+            seeds = [seed + j * k + i for j in range(len(names)) for i in range(k)]
+            ensembles = [(f"{city}_{name}", i + 1, k) for name in names for i in range(k)]
+            scenarios = [f"{name}_r{i + 1}" for name in names for i in range(k)]
+        xml_outputs = [f'data/osm_download_{city}_{name}.{output_format}' for name in scenarios]
+        rule_sets = [RuleSet(parse_modification_rules(rule_file), seed, args.profile) for rule_file, seed in zip(rule_files, seeds)]
+        if args.replicates and not any('frequency' in rule for rule_set in rule_sets for rule in rule_set.rules):
+            print("Warning: no rule has a frequency specifier (FREQ), all replicates of a scenario are identical.")
+        change_only = args.output == 'osc'
+        if args.output == 'sql':
+            columns = load_style_columns(os.path.join('resources', 'default.style'))
+            for rule_set, xml_output in zip(rule_sets, xml_outputs):
+                with open(xml_output, 'w') as f:
+                    f.write(compile_scenario_sql(rule_set.rules, rule_set.seed, columns))
+                print(f"Wrote SQL for {len(rule_set.rules)} rules to {xml_output}")
+        elif use_pbf:
+            writers = [ScenarioWriter(xml_output, change_only) for xml_output in xml_outputs]
+            pbf_modifications(pbf_input, writers, rule_files, seeds, args.workers, args.profile)
+            for writer in writers:
+                writer.close()
+        elif args.workers or args.stream or change_only or len(rule_sets) > 1:
+            writers = [ScenarioWriter(xml_output, change_only) for xml_output in xml_outputs]
+            if args.workers:
+                parallel_modifications(xml_input, writers, rule_files, seeds, args.workers, args.profile)
+            else:
+                stream_modifications(xml_input, writers, rule_sets)
+            for writer in writers:
+                writer.close()
+        else:
+            with open_osm_file(xml_input) as f:
+                tree = ET.parse(f)
+            root = tree.getroot()
+            summary = apply_modifications(root, rule_sets[0])
+            with open_osm_file(xml_outputs[0], 'wb') as f:
+                tree.write(f)
+            write_summary(xml_outputs[0], summary)
+            if args.profile:
+                write_profile(xml_outputs[0], rule_sets[0].profile)
+        for name, ensemble in zip(scenarios, ensembles):
+            print(f"Running scenario {name} for {city}...")
+            replacements = {'CITY': city, 'SCENARIO': name, 'FORMAT': output_format, 'CITY_FILE': os.path.basename(xml_input)}
+            run_netascore(runner, import_yaml, replacements, 'data/temp_import.yml',
+                          ensemble_settings(*ensemble) if ensemble else '')
+        for name in sorted({ensemble[0] for ensemble in ensembles if ensemble}):
+            print(f"Ensemble of {args.replicates} replicates of {name}: see {DbEntitySettings(name).get_ensemble_schema(name)}.edge_index_summary")
 
 if __name__ == '__main__':
     main()
@@ -1,6 +1,8 @@
 import os
+import re
 from dataclasses import dataclass
 from enum import Enum
+from typing import Union
 
 
 class InputType(Enum):
@@ -24,6 +26,9 @@ class GlobalSettings:
         return GlobalSettings.custom_srid or GlobalSettings.default_srid
 
     case_id = "default_net"
+    base_case_id = None  # if set, only edges affected by the changes of a scenario are recomputed (see core/delta.py)
+    max_parallel_steps: int = 1  # number of independent pipeline steps run at the same time (see core/step_graph.py)
+    sql_profile = None  # if set, name of the file the duration and row count of each SQL template statement is written to
 
 
 @dataclass
@@ -34,9 +39,12 @@ class DbSettings:
     username: str
     password: str
     on_existing: str
+    tuning: Union[str, dict] = None  # session settings of the steps: 'auto', 'none' or a dict (see dbhelper.tuning_profile)
 
     def __post_init__(self):
         self.entities: DbEntitySettings = DbEntitySettings(GlobalSettings.case_id)
+        # connection pool of the pipeline run (see toolbox/dbhelper.py) - None: steps open their own connections
+        self.pool = None
 
     @staticmethod
     def from_dict(settings_template: dict):
@@ -46,6 +54,7 @@ class DbSettings:
         username = settings_template.get('username', '')
         password = settings_template.get('password', '')
         on_existing = settings_template.get('on_existing', 'abort')
+        tuning = settings_template.get('tuning', 'auto')
 
         if len(username) == 0:
             username = os.getenv('DB_USERNAME', '')
@@ -58,7 +67,7 @@ class DbSettings:
         if len(password) == 0:
             print('warn: DB_PASSWORD not set')
 
-        return DbSettings(host, port, dbname, username, password, on_existing)
+        return DbSettings(host, port, dbname, username, password, on_existing, tuning)
 
 
 class DbEntitySettings:
@@ -106,3 +115,16 @@ class DbEntitySettings:
     def set_output_schema(self, schema: str):
         self._output_schema = schema
     output_schema: str = property(get_output_schema, set_output_schema)
+
+    # metadata schema (fingerprints of the processing steps, see core/step_cache.py)
+    def get_metadata_schema(self) -> str:
+        return f"{self.global_schema_prefix}meta".lower()
+    metadata_schema: str = property(get_metadata_schema)
+
+    # ensemble schemas (per ensemble name)
+    def get_ensemble_schema(self, ensemble_name: str) -> str:
+        return f"{self.global_schema_prefix}ensemble_{re.sub('[^a-zA-Z0-9_]', '', str(ensemble_name))}".lower()
+
+    def get_ensemble_data_schema(self, ensemble_name: str) -> str:
+        # osm data of the current replicate, shared by all replicates of the ensemble
+        return f"{self.data_schema}_ensemble_{re.sub('[^a-zA-Z0-9_]', '', str(ensemble_name))}".lower()
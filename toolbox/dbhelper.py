@@ -1,20 +1,194 @@
+import itertools
+import json
+import os
 import psycopg2 as psy
 import toolbox.helper as h
+from datetime import datetime as dt
 from jinjasql import JinjaSql
-from typing import List
+from time import perf_counter
+from typing import Iterator, List
 import re
+import threading
+
+
+DOLLAR_QUOTE = re.compile(r"\$([A-Za-z_][A-Za-z0-9_]*)?\$")
+
+# statements executed from SQL templates with their duration and number of rows (see execute_sql_template_string)
+sql_profile: List[dict] = []
+
+
+def split_sql_statements(sql: str) -> List[str]:
+    """Splits SQL into its statements at semicolons outside of quotes, dollar quotes and comments. Statements consisting
+    of comments only are dropped."""
+    statements = []
+    start = 0
+    code = False  # whether the current statement contains more than comments and whitespace
+    i = 0
+    while i < len(sql):
+        c = sql[i]
+        if c == '-' and sql.startswith('--', i):
+            i = sql.find('\n', i)
+            i = len(sql) if i < 0 else i
+            continue
+        if c == '/' and sql.startswith('/*', i):
+            i = sql.find('*/', i + 2)
+            i = len(sql) if i < 0 else i + 2
+            continue
+        if c in "'\"":
+            # quoted string or identifier - quotes within are doubled
+            i = sql.find(c, i + 1)
+            while i >= 0 and sql.startswith(c * 2, i):
+                i = sql.find(c, i + 2)
+            i = len(sql) if i < 0 else i + 1
+            code = True
+            continue
+        if c == '$':
+            tag = DOLLAR_QUOTE.match(sql, i)
+            if tag and not (i > 0 and (sql[i - 1].isalnum() or sql[i - 1] == '_')):
+                end = sql.find(tag.group(0), i + len(tag.group(0)))
+                i = len(sql) if end < 0 else end + len(tag.group(0))
+                code = True
+                continue
+        if c == ';':
+            if code:
+                statements.append(sql[start:i + 1].strip())
+            start = i + 1
+            code = False
+        elif not c.isspace():
+            code = True
+        i += 1
+    if code:
+        statements.append(sql[start:].strip())
+    return statements
+
+
+def statement_label(statement: str) -> str:
+    """Returns a short label of an SQL statement - e.g. "CREATE TABLE route_network AS"."""
+    text = re.sub(r"--[^\n]*|/\*.*?\*/", " ", statement, flags=re.S)
+    return " ".join(text.split("(")[0].replace(";", " ").split()[:6])
+
+
+def write_sql_profile(path: str, run_info: dict = None):
+    """Writes the statements executed from SQL templates since the last reset of sql_profile (with duration in seconds
+    and number of rows) to a JSON file."""
+    with open(path, 'w') as f:
+        json.dump({**(run_info or {}), 'statements': sql_profile}, f, indent=2)
+
+
+MB = 1024 * 1024
+GUC_NAME = re.compile(r"^[a-z_][a-z0-9_.]*$")
+
+
+def tuning_profile(tuning, parallel_steps: int = 1) -> dict:
+    """Returns the session settings (GUCs) applied to each connection of the steps for the tuning setting of the database
+    section: 'none' for the server defaults, 'auto' for settings sized from the RAM and cores of this host (assuming the
+    database server runs on the same host) shared by parallel_steps steps, or a dict of settings overriding the 'auto'
+    ones - e.g. {'work_mem': '512MB', 'jit': 'off'}."""
+    if tuning is None or tuning == 'none':
+        return {}
+    if tuning != 'auto' and not isinstance(tuning, dict):
+        raise Exception(f"ERROR: invalid database tuning setting '{tuning}' - use 'auto', 'none' or a dict of settings.")
+
+    profile = {}
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        memory = None
+    cores = os.cpu_count() or 1
+    parallel_steps = max(1, parallel_steps)
+    if memory:
+        # work_mem is granted to each sort and hash node of a query (and each of its parallel workers): keep a margin
+        profile['work_mem'] = f"{min(max(memory // (64 * parallel_steps), 4 * MB), 1024 * MB) // MB}MB"
+        profile['maintenance_work_mem'] = f"{min(max(memory // (16 * parallel_steps), 64 * MB), 2048 * MB) // MB}MB"
+    # the server still caps the workers by max_worker_processes and max_parallel_workers
+    workers = min(max(cores // parallel_steps - 1, 0), 8)
+    profile['max_parallel_workers_per_gather'] = workers
+    profile['max_parallel_maintenance_workers'] = min(workers, 4)
+    # the costs of the spatial joins exceed the JIT thresholds, but PostGIS functions cannot be inlined: compiling only
+    # adds seconds to each statement
+    profile['jit'] = 'off'
+
+    if isinstance(tuning, dict):
+        profile.update(tuning)
+    for name in profile:
+        if not GUC_NAME.match(name):
+            raise Exception(f"ERROR: invalid setting name '{name}' in database tuning.")
+    return profile
+
+
+class ConnectionPool:
+    """Database connections shared by the steps of a pipeline run: a PostgresConnection created from settings with a pool
+    (see from_settings_object) leases a connection on connect and returns it on close instead of opening and closing
+    its own. At most max_connections are open at a time - further leases wait until a connection is returned. Extensions
+    and schemas are only created once per pool (see init_extensions_and_schema)."""
+
+    def __init__(self, settings_object, max_connections: int = 4):
+        self._settings = settings_object
+        self._max_connections = max_connections
+        self._idle = []
+        self._count = 0
+        self._condition = threading.Condition()
+        self.bootstrap_lock = threading.Lock()
+        self.extensions_created = False
+        self.schemas = set()
+
+    def getconn(self) -> psy.extensions.connection:
+        with self._condition:
+            while not self._idle and self._count >= self._max_connections:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._count += 1
+        try:
+            s = self._settings
+            db = PostgresConnection(s.dbname, s.username, s.password, s.host or None, s.port or None, s.on_existing)
+            db.connect()
+            return db.con
+        except BaseException:
+            with self._condition:
+                self._count -= 1
+                self._condition.notify()
+            raise
+
+    def putconn(self, con: psy.extensions.connection):
+        # discard the session state of the step (search path, settings incl. tuning, temporary tables) before the next
+        # lease - the tuning profile is applied again on connect
+        try:
+            con.rollback()
+            con.autocommit = True
+            con.cursor().execute("DISCARD ALL")
+            con.autocommit = False
+        except psy.Error:
+            con.close()
+        with self._condition:
+            if con.closed:
+                self._count -= 1
+            else:
+                self._idle.append(con)
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            for con in self._idle:
+                con.close()
+            self._count -= len(self._idle)
+            self._idle = []
+        h.log("DB connection pool closed.")
 
 
 class PostgresConnection:
 
     @staticmethod
-    # creates a PostgresConnection object from settings object instead of individual params
+    # creates a PostgresConnection object from settings object instead of individual params - connections are leased
+    # from the pool of the settings if set (see ConnectionPool)
     def from_settings_object(settings_object):
         return PostgresConnection(settings_object.dbname, settings_object.username, settings_object.password, 
-                settings_object.host or None, settings_object.port or None, settings_object.on_existing)
+                settings_object.host or None, settings_object.port or None, settings_object.on_existing,
+                getattr(settings_object, 'pool', None), getattr(settings_object, 'tuning', None))
 
     # constructor
-    def __init__(self, dbname: str, user: str = "postgres", pw: str = "postgres", host: str = "localhost", port: int = 5432, on_existing: str = "abort"):
+    def __init__(self, dbname: str, user: str = "postgres", pw: str = "postgres", host: str = "localhost", port: int = 5432, on_existing: str = "abort",
+                 pool: ConnectionPool = None, tuning: dict = None):
         self._dbname = dbname
         self._user = user
         self._pw = pw
@@ -22,9 +196,12 @@ class PostgresConnection:
         self._port = port
         self._schema = "public"
         self._on_existing = on_existing
+        self._pool = pool
+        self._tuning = tuning if isinstance(tuning, dict) else None  # session settings, see tuning_profile
         
     _con = None
     _cur = None
+    _cursor_numbers = itertools.count()  # unique names of server-side cursors (see iterate)
 
     @property
     def port(self):
@@ -62,6 +239,11 @@ class PostgresConnection:
         # skip if already connected
         if self._con:
             return
+        if self._pool is not None:
+            self._con = self._pool.getconn()
+            self._cur = self._con.cursor()
+            self.apply_tuning()
+            return
         # connect
         h.log(f"connecting to database '{self._dbname}' on {self._host}:{self._port}...")
         # create db connection
@@ -73,7 +255,19 @@ class PostgresConnection:
             raise Exception("ERROR while connecting to database. Terminating.")
         # retreive cursor
         self._cur:psy.cursor = self._con.cursor()
+        self.apply_tuning()
     
+    def apply_tuning(self, commit: bool = True):
+        """Sets the session settings of the tuning profile (see tuning_profile) - they last until the connection is
+        closed or returned to the pool (DISCARD ALL). Unless commit is False, the settings are committed right away, so
+        that a later rollback does not revert them."""
+        if not self._tuning or self._con is None:
+            return
+        for name, value in self._tuning.items():
+            self._cur.execute(f"SET {name} = %s", (value,))
+        if commit and not self._con.autocommit:
+            self._con.commit()
+
     # define functions
     def ex(self, query, vars=None):
         if self._cur == None:
@@ -133,12 +327,48 @@ class PostgresConnection:
             self.ex(args[0])
         return self.cur.fetchall()
 
+    def iterate(self, query, vars=None, itersize: int = 10000, batches: bool = False, arrays: bool = False) -> Iterator:
+        """Iterates over the result of a query through a named (server-side) cursor, fetching itersize rows at a time -
+        memory is bounded by itersize instead of the size of the result (e.g. for Python-side analytics on export_edge).
+        Yields rows, or with batches=True one dict of column name -> list of values per batch of up to itersize rows.
+        With arrays=True, batches are dicts of column name -> NumPy array. The cursor is closed when the iteration ends
+        or the generator is closed - do not commit on this connection while iterating (the cursor would be closed)."""
+        if self._con is None:
+            self.connect()
+        if arrays:
+            import numpy as np
+        # cursors outside of a transaction (autocommit) only exist WITH HOLD
+        cursor = self._con.cursor(name=f"netascore_cursor_{next(PostgresConnection._cursor_numbers)}", withhold=self._con.autocommit)
+        cursor.itersize = itersize
+        try:
+            cursor.execute(query, vars)
+            columns = None
+            while True:
+                rows = cursor.fetchmany(itersize)
+                if not rows:
+                    break
+                if not batches and not arrays:
+                    yield from rows
+                    continue
+                # the description of named cursors is only available after the first fetch
+                columns = columns or [c.name for c in cursor.description]
+                values = zip(*rows)
+                if arrays:
+                    yield {name: np.array(column) for name, column in zip(columns, values)}
+                else:
+                    yield {name: list(column) for name, column in zip(columns, values)}
+        finally:
+            cursor.close()
+
     def close(self, commit_before_close=False):
         if self._con is not None:
             if commit_before_close:
                 self._con.commit()
-            self._con.close()
-            print("DB connection closed.")
+            if self._pool is not None:
+                self._pool.putconn(self._con)
+            else:
+                self._con.close()
+                print("DB connection closed.")
             self._con = None
             self._cur = None
         else:
@@ -147,21 +377,38 @@ class PostgresConnection:
     # own methods
 
     def init_extensions_and_schema(self, schema):
-        # create extensions
-        h.log('create extensions')
-        self.create_extension("postgis", "public")
-        self.create_extension("postgis_raster", "public")
-        self.create_extension("hstore", "public")
-
-        # create schema
-        h.log("create schema '{schema}' if not exists")
-        self.create_schema(schema)
+        if self._pool is not None:
+            # extensions and schemas are only created once per pool
+            with self._pool.bootstrap_lock:
+                if not self._pool.extensions_created or schema not in self._pool.schemas:
+                    self._create_extensions_and_schema(schema, not self._pool.extensions_created)
+                    self._pool.extensions_created = True
+                    self._pool.schemas.add(schema)
+        else:
+            self._create_extensions_and_schema(schema)
 
         # set search path
         h.log('set search path')
         self.schema = schema
         self.commit()
 
+    def _create_extensions_and_schema(self, schema, extensions: bool = True):
+        # steps running at the same time would race on creating the same extensions and schemas: serialize this
+        # section (the lock is released by the commit below)
+        self.ex("SELECT pg_advisory_xact_lock(hashtext('netascore_init_extensions_and_schema'))")
+
+        # create extensions
+        if extensions:
+            h.log('create extensions')
+            self.create_extension("postgis", "public")
+            self.create_extension("postgis_raster", "public")
+            self.create_extension("hstore", "public")
+
+        # create schema
+        h.log(f"create schema '{schema}' if not exists")
+        self.create_schema(schema)
+        self.commit()
+
 
     # checks whether the given entity (e.g. table) exists within the database
     def exists(self, entity: str, schema: str = None) -> bool:
@@ -258,6 +505,8 @@ class PostgresConnection:
         casc = "CASCADE" if cascade else ""
         h.log(f"Dropping schema {schema} if exists {casc}")
         self.ex(f"DROP SCHEMA IF EXISTS {schema} {casc};")
+        if self._pool is not None:
+            self._pool.schemas.discard(schema)
 
     def verify_input_tables_exist(self, tables: List[str], schema: str = None):
         if schema == None:
@@ -279,7 +528,8 @@ class PostgresConnection:
             return True # no conflicts -> all good
         if on_existing == "skip":
             return False # return False, calling code needs to handle skipping of step
-        if on_existing == "delete":
+        # "update": the step is run because its inputs changed (see core/step_cache.py) - existing results are outdated
+        if on_existing in ["delete", "update"]:
             for table in tables:
                 if self.exists(table, schema):
                     self.drop_table(table, cascade=True, schema = schema)
@@ -297,11 +547,12 @@ class PostgresConnection:
             sql = sqlfile.read()
         self.ex(sql)
 
-    def execute_sql_template_string(self, template: str, parameters: dict, override_parameters: dict = None) -> None:
+    def execute_sql_template_string(self, template: str, parameters: dict, override_parameters: dict = None, name: str = None) -> None:
         '''
         Apply a JinjaSql template (string) substituting parameters (dict) and execute
-        the final SQL. If override_parameters is given, parameters with the same key
+        the final SQL statement by statement. If override_parameters is given, parameters with the same key
         name will be replaced by the values from override_parameters
+        The duration and number of rows of each statement are recorded in sql_profile (labelled with the template name).
         Make sure to use "<param_name> | sqlsafe" for table or schema names in the template - otherwise they get String-quoted which leads to an error.
         '''
 
@@ -315,7 +566,23 @@ class PostgresConnection:
         #n = dbg_file.write(query)
         #dbg_file.close()
         h.log("bind params: " + str(bind_params), h.LOG_LEVEL_4_DEBUG)
-        self.ex(query, bind_params)
+        # re-apply the tuning profile (in the transaction of the template, which may contain uncommitted work)
+        if self._con is None:
+            self.connect()
+        self.apply_tuning(commit=False)
+        # execute the statements one by one to record their duration and number of rows (see sql_profile)
+        for i, statement in enumerate(split_sql_statements(query)):
+            label = statement_label(statement)
+            h.log(f"executing statement {i + 1}: {label}", h.LOG_LEVEL_4_DEBUG)
+            started = dt.now()
+            start = perf_counter()
+            self.ex(statement, bind_params)
+            seconds = perf_counter() - start
+            rows = self.cur.rowcount if self.cur.rowcount >= 0 else None
+            sql_profile.append({'template': name, 'statement': i + 1, 'label': label, 'started': started.isoformat(timespec='seconds'),
+                                'seconds': round(seconds, 3), 'rows': rows})
+            if seconds >= 60:
+                h.log(f"statement {i + 1} ({label}) took {h.secondsToStr(seconds)}, {rows} rows", h.LOG_LEVEL_2_INFO)
         # TODO: error handling and reporting
 
     def execute_template_sql_from_file(self, template_file_name: str, parameters: dict, override_parameters: dict = None,
@@ -330,6 +597,6 @@ class PostgresConnection:
         h.log("Executing SQL statements...")
         if autocommit:
             self.set_autocommit(True, pre_commit=True) # set autocommit TRUE, so VACUUM can take place in SQL
-        self.execute_sql_template_string(sql, parameters, override_parameters)
+        self.execute_sql_template_string(sql, parameters, override_parameters, template_file_name)
         if autocommit:
             self.set_autocommit(False) # reset to manual commit mode
\ No newline at end of file
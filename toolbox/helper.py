@@ -1,7 +1,10 @@
 from functools import reduce
 import atexit
+import bz2
+import gzip
 from time import perf_counter as clock
 import sys
+import threading
 from typing import List
 from datetime import datetime as dt
 import re
@@ -57,26 +60,27 @@ def debugLog(msg: str):
 
 # task logging with time tracking
 
+# the current task is tracked per thread, as pipeline steps may run at the same time (see core/step_graph.py)
+task = threading.local()
+
 def logBeginTask(s, level = LOG_LEVEL_2_INFO):
-    global startT, taskS
     if(verbose_level < level):
         return
-    taskS = s
+    task.name = s
     print()
     print(line)
     print(">>> at", dt.now().strftime('%H:%M:%S'), ">>> ", s, "")
-    startT = clock()
+    task.start = clock()
 
 def logEndTask():
-    global taskS, startT
-    if taskS is None:
+    if getattr(task, 'name', None) is None:
         return
-    print(">>> ", taskS, "completed.")
+    print(">>> ", task.name, "completed.")
     print(lineT)
-    print(lineTime, "took", secondsToStr(clock()-startT, detailed=True), lineTime)
+    print(lineTime, "took", secondsToStr(clock()-task.start, detailed=True), lineTime)
     print(line)
     print()
-    taskS = None
+    task.name = None
 
 def endlog():
     end = clock()
@@ -91,8 +95,6 @@ def get_current_log_level():
     return verbose_level
 
 start = clock()
-startT = clock()
-taskS = None
 atexit.register(endlog)
 log("Program started.")
 
@@ -160,4 +162,28 @@ def str_to_numeric(value: str, throw_error: bool = False):
     return None
 
 def str_is_numeric_only(value: str) -> bool:
-    return True if re.fullmatch("[ 0-9.\-]+" ,value) else False
\ No newline at end of file
+    return True if re.fullmatch("[ 0-9.\-]+" ,value) else False
+
+
+### FILES ###
+
+# OSM files may be compressed - the compression is determined by the file extension
+COMPRESSION_SUFFIXES = ['.gz', '.bz2', '.zst']
+
+def compression_suffix(path: str) -> str:
+    for suffix in COMPRESSION_SUFFIXES:
+        if path.endswith(suffix):
+            return suffix
+    return ""
+
+def open_compressed(path: str, mode: str = 'rb'):
+    """Opens a file in binary mode ('rb' or 'wb') and (de-)compresses it on the fly if its name ends with .gz, .bz2 or .zst."""
+    suffix = compression_suffix(path)
+    if suffix == '.gz':
+        return gzip.open(path, mode, compresslevel=6)
+    if suffix == '.bz2':
+        return bz2.open(path, mode)
+    if suffix == '.zst':
+        import zstandard
+        return zstandard.open(path, mode)
+    return open(path, mode)